@@ -3,25 +3,47 @@
 from __future__ import absolute_import
 import logging
 import visa
+import numpy as np
 from visa_probestation_dev import VisaProbestationDev
 
+# Values returned per point of a list sweep: data A, data B, measurement
+# status and comparator result
+LIST_FIELDS = 4
+
 class AgilentMeter ( VisaProbestationDev ) :
-	def __init__ ( self, resource_name, useserial ) :
-		super ( AgilentMeter, self ) .__init__ ( resource_name, useserial )
+	def __init__ ( self, resource_name, useserial, idn = None ) :
+		super ( AgilentMeter, self ) .__init__ ( resource_name, useserial, idn = idn )
 
-		self._write ( u"*RST; *CLS" )
+		self.reset ( )
 		self._write ( u":FORMAT:ASCII:LONG ON" )
 
-	def identify ( self ) :
-		return self._query ( u"*IDN?" ) .strip ( )
-
 class AgilentE4980A ( AgilentMeter ) :
-	def __init__ ( self, resource_name, useserial ) :
-		super (AgilentE4980A, self ) .__init__ ( resource_name, useserial )
+	# Maximum number of points of a list sweep
+	LIST_MAX_POINTS = 201
+	# Upper estimate of the time per list sweep point in s
+	LIST_POINT_TIME = 3.0
+	# Upper estimate of the time of an open or short correction per spot in s
+	CORRECTION_SPOT_TIME = 30.0
+
+	def __init__ ( self, resource_name, useserial, idn = None ) :
+		super (AgilentE4980A, self ) .__init__ ( resource_name, useserial, idn = idn )
+
+		self._list_points = 0
 
 		# might need something else for resistance
-		self._write ( u":FUNCTION:IMPEDANCE CPG" )
-		self._write ( u":APER MED,5" )
+		with self.batch ( ) :
+			self.set_impedance_function ( u"CPG" )
+			self.set_aperture ( u"MED", 5 )
+
+	def set_impedance_function ( self, function ) :
+		self._write_setting ( u"function", u":FUNCTION:IMPEDANCE {}" .format ( function ) )
+
+	def set_aperture ( self, time, average ) :
+		# Integration time SHORT, MED or LONG and number of readings averaged
+		self._write_setting ( u"aperture", u":APER {},{}" .format ( time, average ) )
+
+	def set_profile ( self, profile ) :
+		self.set_aperture ( profile.aperture, profile.aperture_average )
 
 	def get_VDC ( self ) :
 		return self._query ( u":FETCH:SMONITOR:VDC?" )
@@ -33,7 +55,7 @@ class AgilentE4980A ( AgilentMeter ) :
 		if not 0 <= volts <= 20 :
 			raise ValueError ( u"Voltage level out of range [0;20]: {}" .format ( volts ) )
 
-		self._write ( u":VOLTAGE {}" .format ( volts ) )
+		self._write_setting ( u"voltage", u":VOLTAGE {}" .format ( volts ) )
 
 	def get_frequency ( self ) :
 		return self._query ( u":FREQUENCY?" )
@@ -42,25 +64,137 @@ class AgilentE4980A ( AgilentMeter ) :
 		if not 20 <= freq <= 2e6 :
 			raise ValueError ( u"Frequency out of range [0;2e6]: {}" .format ( freq ) )
 
-		self._write ( u":FREQUENCY {}" .format ( freq ) )
+		self._write_setting ( u"frequency", u":FREQUENCY {}" .format ( freq ) )
+
+	def set_frequency_list ( self, freqs ) :
+		# Measures all frequencies of freqs in one triggered list sweep, or
+		# single frequencies as after *RST if freqs is empty
+		if not freqs :
+			with self.batch ( ) :
+				self._write_setting ( u"page", u":DISPLAY:PAGE MEAS" )
+				self._write_setting ( u"trigger", u":TRIGGER:SOURCE INTERNAL" )
+			self._list_points = 0
+			return
+
+		if not 1 <= len ( freqs ) <= self.LIST_MAX_POINTS :
+			raise ValueError ( u"Number of list sweep points out of range [1;{}]: {}" .format ( self.LIST_MAX_POINTS, len ( freqs ) ) )
+		for freq in freqs :
+			if not 20 <= freq <= 2e6 :
+				raise ValueError ( u"Frequency out of range [0;2e6]: {}" .format ( freq ) )
+
+		with self.batch ( ) :
+			self._write_setting ( u"page", u":DISPLAY:PAGE LIST" )
+			self._write_setting ( u"list", u":LIST:FREQUENCY {}" .format ( u"," .join ( u"{:g}" .format ( freq ) for freq in freqs ) ) )
+			self._write_setting ( u"list_mode", u":LIST:MODE SEQUENCE" )
+			self._write_setting ( u"trigger", u":INITIATE:CONTINUOUS ON; :TRIGGER:SOURCE BUS" )
+		self._list_points = len ( freqs )
+
+	def get_list_reading ( self ) :
+		# Runs the list sweep and fetches all points with a single query
+		timeout = self._get_timeout ( )
+		self._set_timeout ( timeout + 1000 * self._list_points * self.LIST_POINT_TIME )
+		try :
+			self._query ( u":TRIGGER:IMMEDIATE; *OPC?" )
+		finally :
+			self._set_timeout ( timeout )
+		return self.get_reading ( )
+
+	def set_correction_spots ( self, freqs ) :
+		# Corrects with the data measured at the spot of each frequency
+		if not 1 <= len ( freqs ) <= self.LIST_MAX_POINTS :
+			raise ValueError ( u"Number of correction spots out of range [1;{}]: {}" .format ( self.LIST_MAX_POINTS, len ( freqs ) ) )
+		with self.batch ( ) :
+			for n, freq in enumerate ( freqs, 1 ) :
+				self._write_setting ( u"spot{}" .format ( n ), u":CORRECTION:SPOT{}:STATE ON; FREQUENCY {:.12g}" .format ( n, freq ) )
+
+	def measure_correction ( self, kind, freqs ) :
+		# Runs the OPEN or SHORT correction at the spots of freqs, with the
+		# fixture open or shorted. The meter keeps the data of each spot
+		# until it is measured again, also when switched off.
+		if kind not in ( u"OPEN", u"SHORT" ) :
+			raise ValueError ( u"Unknown correction: {}" .format ( kind ) )
+		self.set_correction_spots ( freqs )
+		timeout = self._get_timeout ( )
+		self._set_timeout ( timeout + 1000 * self.CORRECTION_SPOT_TIME )
+		try :
+			for n in range ( 1, len ( freqs ) + 1 ) :
+				self._query ( u":CORRECTION:SPOT{}:{}; *OPC?" .format ( n, kind ) )
+		finally :
+			self._set_timeout ( timeout )
+		self._settings.pop ( u"correction", None )
+
+	def set_correction ( self, state ) :
+		# Switches the open and short correction on or off
+		with self.batch ( ) :
+			self._write_setting ( u"open_correction", u":CORRECTION:OPEN:STATE {}" .format ( u"ON" if state else u"OFF" ) )
+			self._write_setting ( u"short_correction", u":CORRECTION:SHORT:STATE {}" .format ( u"ON" if state else u"OFF" ) )
+		if not state :
+			self._settings.pop ( u"correction", None )
+
+	def load_correction ( self, correction ) :
+		# Selects the spots of a correction from the lcr_correction cache,
+		# whose data the meter still holds, and enables both corrections.
+		# Nothing is sent if the same correction is loaded already.
+		if self._settings.get ( u"correction" ) == correction[u"key"] :
+			return
+		self.set_correction_spots ( correction[u"frequencies"] )
+		self.set_correction ( True )
+		self._settings[u"correction"] = correction[u"key"]
+
+	def set_binary_transfer ( self, state ) :
+		if state :
+			self._write_setting ( u"format", u":FORMAT:DATA REAL,64" )
+		else :
+			self._write_setting ( u"format", u":FORMAT:DATA ASCII" )
+		self._binary = state
 
 	def get_reading ( self ) :
+		if self._binary :
+			return self._query_binary_values ( u"FETCH?", datatype = u"d" )
 		return self._query ( u"FETCH?" ) .strip ( )
 
 	def get_resistance ( self ) :
-		self._write ( u":FUNCTION:IMPEDANCE RX" )
+		self.set_impedance_function ( u"RX" )
+		if self._binary :
+			return self._query_binary_values ( u":FETCH:IMPEDANCE:CORRECTED?", datatype = u"d" )
 		resi = self._query ( u":FETCH:IMPEDANCE:CORRECTED?" )
 		return resi
 
 def parse_cgv ( line, devname ) :
-	line = line.split ( u"," )
+	if not isinstance ( line, np.ndarray ) :
+		line = line.split ( u"," )
 	ret = {}
 	ret[u"{}_capacitance" .format ( devname ) ] = float ( line[0] )
 	ret[u"{}_conductance" .format ( devname ) ] = float ( line[1] )
 	return ret
 
+def parse_cgv_list ( line, devname, freqs ) :
+	# Capacitance and conductance per frequency of a list sweep, and those of
+	# the first frequency under the names used by parse_cgv
+	if not isinstance ( line, np.ndarray ) :
+		line = np.array ( [ float ( field ) for field in line.split ( u"," ) ] )
+	if len ( line ) != LIST_FIELDS * len ( freqs ) :
+		raise ValueError ( u"Got {} values for a list sweep of {} points" .format ( len ( line ), len ( freqs ) ) )
+	values = line.reshape ( -1, LIST_FIELDS )
+	ret = parse_cgv ( values[0], devname )
+	columns = list_columns ( devname, freqs )
+	for i, point in enumerate ( values ) :
+		ret[columns[2 * i]] = float ( point[0] )
+		ret[columns[2 * i + 1]] = float ( point[1] )
+	return ret
+
+def list_columns ( devname, freqs ) :
+	# Column names of parse_cgv_list for the frequencies, which keep all
+	# digits of the frequency so different frequencies never share a name
+	columns = []
+	for freq in freqs :
+		columns.append ( u"{}_capacitance_{:.12g}Hz" .format ( devname, freq ) )
+		columns.append ( u"{}_conductance_{:.12g}Hz" .format ( devname, freq ) )
+	return columns
+
 def parse_res ( line, devname ) :
-	line = line.split ( u"," )
+	if not isinstance ( line, np.ndarray ) :
+		line = line.split ( u"," )
 	ret = {}
 	ret[u"{}_resistance" .format ( devname ) ] = float ( line[0] )
 	ret[u"{}_impedance" .format ( devname ) ] = float ( line[1] )
@@ -3,11 +3,20 @@
 
 from visa_probestation_dev import VisaProbestationDev
 from math import log
+from collections import deque
+from bisect import bisect_left
+from io import open
 import logging
+import threading
+import time
+import csv
+import sys
+import os
 
 class ArduinoEnvSensor ( VisaProbestationDev ) :
-	def __init__ ( self, resource_name ) :
-		super ( ArduinoEnvSensor, self ) .__init__ ( resource_name, True )
+	def __init__ ( self, resource_name, useserial = True, idn = None ) :
+		# Always connected via serial
+		super ( ArduinoEnvSensor, self ) .__init__ ( resource_name, True, idn = idn )
 		
 		self._res.encoding = "utf-8"
 		
@@ -18,9 +27,6 @@ class ArduinoEnvSensor ( VisaProbestationDev ) :
 		else:
 			return error
 		
-	def identify ( self ) :
-		return self._query ( u"*IDN?" ) .strip ( )
-		
 	def get_reading ( self, sensor = None ) :
 		if sensor is None:
 			ret = self._query ( "measureall" ) .strip ( )
@@ -55,6 +61,23 @@ class ArduinoEnvSensor ( VisaProbestationDev ) :
 				 "{}_humidity" .format ( devname ) : humidity,
 				 "{}_resistance" .format ( devname ) : resistance }
 
+	@classmethod
+	def parse_both ( cls, line, devname1, devname2 ) :
+		# Parses the reading of both sensors and adds the dew points
+		read1 = ",".join ( line.split ( "," ) [:4] )
+		read2 = ",".join ( line.split ( "," ) [4:] )
+
+		reading = cls.parse_tphr ( read1, devname1 )
+		reading.update ( cls.parse_tphr ( read2, devname2 ) )
+
+		for devname in ( devname1, devname2 ) :
+			temperature = reading["{}_temperature" .format ( devname )]
+			humidity = reading["{}_humidity" .format ( devname )]
+			reading["{}_dewpoint" .format ( devname )] = None
+			if None not in [temperature, humidity] :
+				reading["{}_dewpoint" .format ( devname )] = cls.get_dewpoint ( temperature, humidity )
+		return reading
+
 	@staticmethod
 	def get_dewpoint (t, rh):
 		"""
@@ -68,6 +91,110 @@ class ArduinoEnvSensor ( VisaProbestationDev ) :
 		logphi = log(rh) - log(100)
 		return c * ((b * t) / (c + t) + logphi) / ((b * c) / (c + t) - logphi)
 
+class EnvironmentSampler ( threading.Thread ) :
+	# Polls the environment sensor in the background and keeps the readings
+	# in a ring buffer, so that measurements can look up the environment at
+	# any time. Looking up a time after the last sample takes the next one
+	# right away and waits for it, so the value is interpolated.
+	def __init__ ( self, sensor, interval = 1.0, maxlen = 3600, record_path = None ) :
+		super ( EnvironmentSampler, self ) .__init__ ( )
+		self.daemon = True
+		self._logger = logging.getLogger ( u'probestation.arduinoenv.EnvironmentSampler' )
+		self._sensor = sensor
+		self._interval = interval
+		self._times = deque ( maxlen = maxlen )
+		self._readings = deque ( maxlen = maxlen )
+		self._lock = threading.Lock ( )
+		self._sampled = threading.Condition ( self._lock )
+		self._stop_event = threading.Event ( )
+		self._wakeup = threading.Event ( )
+		self._record_path = record_path
+		self._record = None
+		self._writer = None
+
+	def run ( self ) :
+		while True :
+			self._wakeup.wait ( self._interval )
+			self._wakeup.clear ( )
+			if self._stop_event.is_set ( ) :
+				break
+			try :
+				self.sample ( )
+			except Exception as e :
+				self._logger.warning ( u"Environment sensor reading failed: {}" .format ( e ) )
+		if self._record :
+			self._record.close ( )
+
+	def stop ( self ) :
+		self._stop_event.set ( )
+		self._wakeup.set ( )
+		if self.is_alive ( ) :
+			self.join ( )
+		elif self._record :
+			self._record.close ( )
+
+	def sample ( self ) :
+		reading = self._sensor.parse_both ( self._sensor.get_reading ( ), "envsensor1", "envsensor2" )
+		timestamp = time.time ( )
+		with self._lock :
+			self._times.append ( timestamp )
+			self._readings.append ( reading )
+			self._sampled.notify_all ( )
+		self._write_record ( timestamp, reading )
+		return reading
+
+	def _write_record ( self, timestamp, reading ) :
+		if self._record_path is None :
+			return
+		if self._writer is None :
+			# A resumed run continues the record of the interrupted one
+			exists = os.path.isfile ( self._record_path ) and os.path.getsize ( self._record_path ) > 0
+			mode = 'a' if exists else 'w'
+			if sys.version_info.major < 3:
+				mode += 'b'
+			self._record = open ( self._record_path, mode )
+			self._writer = csv.DictWriter ( self._record, fieldnames = [ "envsensor_time" ] + sorted ( reading ), extrasaction = "ignore" )
+			if not exists :
+				self._writer.writeheader ( )
+		row = dict ( reading )
+		row["envsensor_time"] = timestamp
+		self._writer.writerow ( row )
+		self._record.flush ( )
+
+	def value_at ( self, timestamp, timeout = 0 ) :
+		# Returns the reading linearly interpolated to timestamp, or the
+		# nearest reading if timestamp is outside of the sampled range.
+		# Waits up to timeout seconds for a sample after timestamp.
+		with self._lock :
+			if timeout > 0 and self.is_alive ( ) and ( not self._times or self._times[-1] < timestamp ) :
+				self._wakeup.set ( )
+				deadline = time.time ( ) + timeout
+				while ( not self._times or self._times[-1] < timestamp ) and time.time ( ) < deadline :
+					self._sampled.wait ( deadline - time.time ( ) )
+			if not self._times :
+				return None
+			i = bisect_left ( self._times, timestamp )
+			if i == 0 :
+				ret = dict ( self._readings[0] )
+				ret["envsensor_time"] = self._times[0]
+				return ret
+			if i == len ( self._times ) :
+				ret = dict ( self._readings[-1] )
+				ret["envsensor_time"] = self._times[-1]
+				return ret
+			t0, t1 = self._times[i - 1], self._times[i]
+			r0, r1 = self._readings[i - 1], self._readings[i]
+
+		weight = ( timestamp - t0 ) / ( t1 - t0 ) if t1 > t0 else 0.0
+		ret = { }
+		for key, value in r0.items ( ) :
+			if value is None or r1.get ( key ) is None :
+				ret[key] = value
+			else :
+				ret[key] = value + weight * ( r1[key] - value )
+		ret["envsensor_time"] = timestamp
+		return ret
+
 if __name__ == "__main__":
 	dev = ArduinoEnvSensor("ASRLCOM10::INSTR")
 	print(dev.get_reading())
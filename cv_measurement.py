@@ -6,8 +6,9 @@ from __future__ import absolute_import
 import logging
 from measurement_window import MeasurementThread, MeasurementWindow
 import keithley
+import drivers
 import agilent
-import sys
+import lcr_correction
 
 try:
     from PyQt5 import QtWidgets as QtW
@@ -17,11 +18,9 @@ except ImportError as e :
     from PyQt4 import QtCore
 
 import os
-import csv
 import datetime
 from time import sleep
 from pyvisa.errors import VisaIOError, InvalidBinaryFormat
-from io import open
 from collections import OrderedDict
 
 def getDateTimeFilename ( ) :
@@ -37,73 +36,98 @@ class CvMeasurementThread ( MeasurementThread ) :
 	def run ( self ) :
 		args = self.args
 
-		fname = getDateTimeFilename ( )
-		output_csv = os.path.join ( str ( args.output_dir ), fname + u".csv" )
+		output_base = self._output_base ( getDateTimeFilename ( ) )
 		logger = logging.getLogger ( u'probestation.cv_measurement.CvMeasurementThread' )
 
 		try :
 			if args.devname_ardenv:
-				if not self._init_envsensor ( ):
+				if not self._init_envsensor ( output_base + u"_env.csv" ):
 					errormsg = u"Could not open environment sensor device."
 					self.error_signal.emit ( errormsg )
 					logger.error ( errormsg )
-					self.finished.emit ( os.path.join ( str ( args.output_dir ), fname ) )
+					self.finished.emit ( output_base )
 			
-			input_hv = keithley.KeithleyMeter ( args.devname_hv, args.serialenable )
-			if input_hv.identify ( ) .startswith ( u"KEITHLEY INSTRUMENTS INC.,MODEL 6517B" ) :
-				keith_hv = keithley.Keithley6517B ( args.devname_hv, args.serialenable )
-			elif input_hv.identify ( ) .startswith ( u"KEITHLEY INSTRUMENTS INC.,MODEL 2410" ) :
-				keith_hv = keithley.Keithley2410 ( args.devname_hv, args.serialenable )
-			else :
-				errormsg = u"Could not open devices."
-				self.error_signal.emit ( errormsg )
-				logger.error ( errormsg )
-				self.finished.emit ( os.path.join ( str ( args.output_dir ), fname ) )
-				return
+			keith_hv = drivers.open_device ( args.devname_hv, args.serialenable, keithley.KeithleySource, args.keepwarm )
 			logger.info ( u"  Voltage source device introduced itself as {}" .format ( keith_hv.identify ( ) ) )
-			agilentE4980A = agilent.AgilentE4980A ( args.devname_agiE4980A, args.serialenable )
+			agilentE4980A = drivers.open_device ( args.devname_agiE4980A, args.serialenable, agilent.AgilentE4980A, args.keepwarm )
 			logger.info ( u"LCR meter introduced itself as {}" .format ( agilentE4980A.identify ( ) ) )
-		except VisaIOError :
+		except ( VisaIOError, IOError, ValueError ) :
 			errormsg = u"Could not open devices."
 			self.error_signal.emit ( errormsg )
 			logger.error ( errormsg )
-			self.finished.emit ( os.path.join ( str ( args.output_dir ), fname ) )
+			self.finished.emit ( output_base )
 			return
 
 		try :
 			logger.info ( u"Starting measurement" )
 
-			agilentE4980A.set_frequency ( args.frequency )
-			agilentE4980A.set_voltage_level ( args.deltavolt )
-
-			mode = 'w'
-			if sys.version_info.major < 3:
-				mode += 'b'
-
-			keith_hv.set_compliance ( args.compcurrent )
-
-			with open ( output_csv, mode ) as f :
-				header = OrderedDict ( [ ( 'keihv_srcvoltage', None ), ( 'agie4980a_capacitance', None ), ('agie4980a_conductance', None ), ( 'keihv_current', None ) ] )
-				if args.devname_ardenv:
-					header.update ( { 'envsensor1_temperature': None, 'envsensor1_dewpoint': None, 'envsensor2_temperature': None, 'envsensor2_dewpoint': None } )
-				writer = csv.DictWriter ( f, fieldnames = header, extrasaction = u"ignore" )
-				writer.writeheader ( )
-
-				for keivolt in keith_hv.voltage_series ( args.start, args.end, args.step ) :
-					sleep ( args.sleep )
+			# Several frequencies are measured in one list sweep per point
+			frequencies = args.frequencies or []
+			if frequencies :
+				read_lcr = agilentE4980A.get_list_reading
+				parse_lcr = lambda reading : agilent.parse_cgv_list ( reading, u"agie4980a", frequencies )
+			else :
+				read_lcr = agilentE4980A.get_reading
+				parse_lcr = lambda reading : agilent.parse_cgv ( reading, u"agie4980a" )
+
+			with agilentE4980A.batch ( ) :
+				agilentE4980A.set_impedance_function ( u"CPG" )
+				agilentE4980A.set_frequency_list ( frequencies )
+				agilentE4980A.set_frequency ( args.frequency )
+				agilentE4980A.set_voltage_level ( args.deltavolt )
+				agilentE4980A.set_binary_transfer ( args.binary )
+				agilentE4980A.set_profile ( args.profile )
+			correction = None
+			if args.correction_fixture :
+				# Open/short correction measured before for the fixture,
+				# selected again unless this device instance has it already
+				correction = lcr_correction.CorrectionCache ( ) .get ( args.correction_fixture, agilentE4980A.identify ( ), frequencies or [ args.frequency ] )
+				if correction is None :
+					errormsg = u"No recent open/short correction for fixture {}, measuring without correction." .format ( args.correction_fixture )
+					self.error_signal.emit ( errormsg )
+					logger.warning ( errormsg )
+			if correction is not None :
+				logger.info ( u"  Using open/short correction from {}" .format ( correction[u"date"] ) )
+				agilentE4980A.load_correction ( correction )
+			elif args.correction_fixture or u"correction" in agilentE4980A.get_settings ( ) :
+				# Otherwise a correction set on the front panel is kept
+				agilentE4980A.set_correction ( False )
+
+			with keith_hv.batch ( ) :
+				keith_hv.set_binary_transfer ( args.binary )
+				keith_hv.set_compliance ( args.compcurrent )
+				keith_hv.set_profile ( args.profile )
+				read_hv = self._range_reader ( keith_hv, keith_hv.get_reading, lambda reading : keith_hv.parse_iv ( reading, u"keihv" ) [u"keihv_current"] )
+			keith_hv.set_ramp ( args.rampspeed, args.rampstep )
+
+			header = OrderedDict ( [ ( 'keihv_srcvoltage', None ), ( 'agie4980a_capacitance', None ), ('agie4980a_conductance', None ), ( 'keihv_current', None ) ] )
+			header.update ( ( name, None ) for name in agilent.list_columns ( u"agie4980a", frequencies ) )
+			if args.devname_ardenv:
+				header.update ( { 'envsensor1_temperature': None, 'envsensor1_dewpoint': None, 'envsensor2_temperature': None, 'envsensor2_dewpoint': None } )
+			header.update ( [ ( 'agie4980a_time', None ), ( 'keihv_time', None ) ] )
+			if args.devname_ardenv:
+				header['envsensor_time'] = None
+			compliance = False
+			with self._open_sink ( output_base, header, keihv = keith_hv, agie4980a = agilentE4980A ) as sink :
+				for keivolt in self._voltage_series ( keith_hv ) :
+					self._apply_profile ( agilentE4980A, keith_hv )
+					self._prepare_ranges ( )
+					self._settle ( lambda : parse_lcr ( read_lcr ( ) ) [u"agie4980a_capacitance"] )
 					if self._exiting :
 						break
 
-					line = agilentE4980A.get_reading ( )
-					meas = agilent.parse_cgv ( line, u"agie4980a" )
+					tasks = OrderedDict ( [ ( u"agie4980a", read_lcr ), ( u"keihv", read_hv ) ] )
+					readings, times = self._acquire ( tasks )
+
+					meas = parse_lcr ( readings[u"agie4980a"] )
 					meas[u"keihv_srcvoltage"] = keivolt
 					if ( not u"keihv_srcvoltage" in meas or not u"agie4980a_capacitance" in meas or not u"agie4980a_conductance" in meas or meas[u"keihv_srcvoltage"] is None or meas[u"agie4980a_capacitance"] is None or meas[u"agie4980a_conductance"] is None ) :
 						raise IOError ( u"Got invalid reading from device" )
-					compline = keith_hv.get_reading ( )
-					meas.update ( keith_hv.parse_iv ( compline, u"keihv" ) )
+					meas.update ( keith_hv.parse_iv ( readings[u"keihv"], u"keihv" ) )
 					if args.devname_ardenv:
-						env = self._measure_environment ( )
-						meas.update(env)
+						meas.update ( self._measure_environment ( times[u"agie4980a"] ) )
+					for name, timestamp in times.items ( ) :
+						meas[u"{}_time" .format ( name )] = timestamp
 
 					print ( u"VSrc = {: 10.4g} V; C = {: 10.4g} F; G = {: 10.4g} S; I = {: 10.4g} A" .format ( meas[u"keihv_srcvoltage"], meas[u"agie4980a_capacitance"], meas[u"agie4980a_conductance"], meas[u"keihv_current"] ) )
 
@@ -113,12 +137,17 @@ class CvMeasurementThread ( MeasurementThread ) :
 						#Instant turn off
 						keith_hv.set_output_state ( False )
 						self._exiting = True
+						compliance = True
 
-					writer.writerow ( meas )
+					self._feed_planner ( 1 / meas[u"agie4980a_capacitance"] ** 2 )
+					sink.write ( keivolt, meas )
 					self.measurement_ready.emit ( ( meas[u"keihv_srcvoltage"], 1 / meas[u"agie4980a_capacitance"] ** 2 ) )
 
 					if self._exiting :
 						break
+				# Reaching compliance ends the run, the point is written first
+				if compliance or not self._exiting :
+					sink.finish ( )
 
 		except IOError as e :
 			errormsg = u"Error: {}" .format ( e )
@@ -128,6 +157,8 @@ class CvMeasurementThread ( MeasurementThread ) :
 			errormsg = u"Error during communication with devices."
 			self.error_signal.emit ( errormsg )
 			logger.error ( errormsg )
+			# Device state is unknown, configure from scratch next time
+			drivers.forget_devices ( )
 		finally :
 			logger.info ( u"Stopping measurement" )
 			try :
@@ -136,7 +167,7 @@ class CvMeasurementThread ( MeasurementThread ) :
 				logger.error ( u"Error during stopping. Trying to turn off output" )
 				keith_hv.set_output_state ( False )
 
-		self.finished.emit ( os.path.join ( str ( args.output_dir ), fname ) )
+		self.finished.emit ( output_base )
 
 class CvMeasurementWindow ( MeasurementWindow ) :
 	def __init__ ( self, parent, args ) :
@@ -144,4 +175,6 @@ class CvMeasurementWindow ( MeasurementWindow ) :
 		super ( CvMeasurementWindow, self ) .__init__ ( parent, 1, args, thread )
 
 		self._ylabel = [u"Capacitance${}^{-2}$ in $\\mathrm{F}^{-2}$", u"Conductance in $\\mathrm{S}$"]
+		self._ycolumns = [u"agie4980a_capacitance"]
+		self._ytransforms = [lambda c : 1 / c ** 2]
 		self.setWindowTitle ( u"CV measurement" )
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+from __future__ import division
+from __future__ import absolute_import
+import numpy as np
+
+# Reduce a series to about as many points as there are pixels to draw it
+# on. Buckets are taken over the index, so x needs not be monotonic.
+
+def minmax ( x, y, buckets ) :
+	# Keeps the minimum and maximum of y in each of buckets runs of points,
+	# in their order, so spikes stay visible, and the first and last point,
+	# so the line spans the whole series. NaN never counts as extremum.
+	x = np.asarray ( x )
+	y = np.asarray ( y, dtype = np.float64 )
+	n = len ( y )
+	if buckets < 1 or n <= 2 * buckets :
+		return x, y
+	size = -( -n // buckets )
+	rows = -( -n // size )
+	low = np.full ( rows * size, np.inf )
+	high = np.full ( rows * size, -np.inf )
+	valid = ~np.isnan ( y )
+	low[:n][valid] = y[valid]
+	high[:n][valid] = y[valid]
+	# The first point of a bucket wins ties, so padding is never chosen
+	offsets = np.arange ( rows ) * size
+	imin = low.reshape ( rows, size ) .argmin ( axis = 1 ) + offsets
+	imax = high.reshape ( rows, size ) .argmax ( axis = 1 ) + offsets
+	index = np.sort ( np.stack ( ( imin, imax ), axis = 1 ), axis = 1 ) .ravel ( )
+	index = np.unique ( np.concatenate ( ( [ 0 ], index, [ n - 1 ] ) ) )
+	return x[index], y[index]
+
+def lttb ( x, y, threshold ) :
+	# Largest-Triangle-Three-Buckets: keeps the first and last point and of
+	# each bucket in between the point spanning the largest triangle with the
+	# point kept before and the mean of the next bucket
+	x = np.asarray ( x )
+	y = np.asarray ( y, dtype = np.float64 )
+	n = len ( y )
+	if threshold < 3 or n <= threshold :
+		return x, y
+	xf = np.asarray ( x, dtype = np.float64 )
+	edges = np.linspace ( 1, n - 1, threshold - 1 ) .astype ( int )
+	index = np.empty ( threshold, dtype = int )
+	index[0] = 0
+	index[-1] = n - 1
+	a = 0
+	for i in range ( threshold - 2 ) :
+		start, stop = edges[i], edges[i + 1]
+		if i + 2 < len ( edges ) :
+			nextx = np.mean ( xf[stop:edges[i + 2]] ) if edges[i + 2] > stop else xf[stop]
+			nexty = np.mean ( y[stop:edges[i + 2]] ) if edges[i + 2] > stop else y[stop]
+		else :
+			nextx, nexty = xf[-1], y[-1]
+		area = np.abs ( ( xf[a] - nextx ) * ( y[start:stop] - y[a] ) - ( xf[a] - xf[start:stop] ) * ( nexty - y[a] ) )
+		area[np.isnan ( area )] = -1
+		a = start + int ( area.argmax ( ) )
+		index[i + 1] = a
+	return x[index], y[index]
+
+DECIMATORS = { u"minmax": lambda x, y, pixels : minmax ( x, y, pixels ),
+			   u"lttb": lambda x, y, pixels : lttb ( x, y, 2 * pixels ) }
+
+def decimate ( x, y, pixels, method = u"minmax" ) :
+	# About two points per pixel for either method
+	try :
+		return DECIMATORS[method] ( x, y, int ( pixels ) )
+	except KeyError :
+		raise ValueError ( u"Unknown decimation method: {}" .format ( method ) )
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import
+import logging
+import keithley
+import agilent
+import arduinoenv
+from visa_probestation_dev import session_pool
+
+# Identification prefixes and the driver classes handling them
+DRIVERS = [ ( u"KEITHLEY INSTRUMENTS INC.,MODEL 6517B", keithley.Keithley6517B ),
+			( u"KEITHLEY INSTRUMENTS INC.,MODEL 2410", keithley.Keithley2410 ),
+			( u"KEITHLEY INSTRUMENTS INC.,MODEL 6485", keithley.Keithley6485 ),
+			( u"Agilent Technologies,E4980A", agilent.AgilentE4980A ),
+			( u"Arduino Probestation Environment Sensoring", arduinoenv.ArduinoEnvSensor ) ]
+
+# Devices kept connected and configured between measurements
+_devices = {}
+
+def driver_for ( idn ) :
+	for prefix, cls in DRIVERS :
+		if idn.startswith ( prefix ) :
+			return cls
+	return None
+
+def open_device ( resource_name, useserial, accept = None, reuse = False ) :
+	# Identifies the device once, reusing the identification from discovery
+	# if available, and returns an instance of the matching driver. accept
+	# is a class or tuple of classes the driver has to be derived from.
+	# With reuse the instance of a previous measurement is returned as is,
+	# without resetting the device.
+	logger = logging.getLogger ( u'probestation.drivers' )
+	dev = _devices.get ( resource_name )
+	if reuse and dev is not None and ( accept is None or isinstance ( dev, accept ) ) :
+		logger.debug ( u"  Reusing {} with driver {}" .format ( resource_name, type ( dev ) .__name__ ) )
+		return dev
+
+	idn = session_pool.identify ( resource_name, useserial )
+	cls = driver_for ( idn )
+	if cls is None or ( accept is not None and not issubclass ( cls, accept ) ) :
+		raise ValueError ( u"No suitable driver for {} ({})" .format ( resource_name, idn ) )
+
+	logger.debug ( u"  Opening {} with driver {}" .format ( resource_name, cls.__name__ ) )
+	dev = cls ( resource_name, useserial, idn = idn )
+	_devices[resource_name] = dev
+	return dev
+
+def forget_device ( resource_name ) :
+	# The next open_device will reset and configure the device again
+	_devices.pop ( resource_name, None )
+
+def forget_devices ( ) :
+	_devices.clear ( )
@@ -5,76 +5,155 @@ import visa
 import pyvisa.errors
 from serial.serialutil import SerialException
 import logging
+from visa_probestation_dev import session_pool
 from multiprocessing.pool import ThreadPool
+from io import open
+import json
+import os
+
+# Device identifications of the last scan, keyed by resource name
+DEFAULT_CACHE_FILE = os.path.join ( os.path.expanduser ( u"~" ), u".probestation_devices.json" )
 
 class GPIBDetector ( object ) :				
-	def __init__ ( self, useserial ) :
+	def __init__ ( self, useserial, cache_file = None, refresh = False ) :
 		self.logger = logging.getLogger ( u'probestation.gpib_detect.GPIBDetector' )
 		self.pool = ThreadPool ( processes=10 )
 		self.useserial = useserial
 		self.identifiers = { }
+		self.cache_file = cache_file
+		self._scanned = False
+		self._validated = set ( )
+
+		if cache_file and not refresh and self._load_cache ( ) :
+			self.logger.debug ( u"Using cached device identifications from %s", cache_file )
+		else :
+			self.scan ( )
 
+	def scan ( self ) :
+		self.identifiers = { }
 		try :
-			rm = visa.ResourceManager ( )
+			session_pool.resource_manager ( )
 		except pyvisa.errors.Error :
 			self.logger.debug ( u"Failed to open ni-visa" )
 		else :
 			self.logger.debug ( u"Probing ni-visa devices..." )
-			self._probe_rm ( rm, False )
-		if useserial :
+			self._probe_rm ( u"", False )
+		if self.useserial :
 			try :
-				rm = visa.ResourceManager ( "@py" )
+				session_pool.resource_manager ( u"@py" )
 			except pyvisa.errors.Error :
 				self.logger.debug ( u"Failed to open pyvisa" )
 			else :
 				self.logger.debug ( u"Probing pyvisa devices..." )
-				self._probe_rm ( rm, True )
+				self._probe_rm ( u"@py", True )
+		self._scanned = True
+		self._save_cache ( )
+
+	def _load_cache ( self ) :
+		try :
+			with open ( self.cache_file, u"r" ) as f :
+				identifiers = json.load ( f )
+		except ( IOError, OSError, ValueError ) :
+			return False
+		if not isinstance ( identifiers, dict ) :
+			return False
+		self.identifiers = identifiers
+		return True
+
+	def _save_cache ( self ) :
+		if not self.cache_file :
+			return
+		try :
+			with open ( self.cache_file, u"w" ) as f :
+				json.dump ( self.identifiers, f, indent = 1, sort_keys = True )
+		except ( IOError, OSError ) :
+			self.logger.warning ( u"Could not write device cache %s", self.cache_file )
+
+	def _validate ( self, res ) :
+		# Checks with a single *IDN? that the cached device is still there
+		if res in self._validated :
+			return True
+		isserial = res.startswith ( u"ASRL" )
+		try :
+			idn = self._obtain_idn ( res, isserial ) [1]
+		except ( pyvisa.errors.Error, SerialException, OSError, ValueError ) :
+			self.logger.debug ( u"Cached device %s did not respond", res )
+			return False
+		if idn != self.identifiers.get ( res ) :
+			self.logger.debug ( u"Cached device %s changed identification", res )
+			return False
+		self._validated.add ( res )
+		session_pool.remember_idn ( res, idn )
+		return True
 		
-	def _probe_rm(self, rm, isserial) :
+	def _probe_rm(self, backend, isserial) :
 		pool_results = []
-		for res in rm.list_resources ( ) :
+		for res in session_pool.list_resources ( backend, refresh = True ) :
 			if isserial and not res.startswith ( u"ASRL" ) :
 				continue
 			if not isserial and not res.startswith ( u"GPIB" ) :
 				continue
 				
-			result = self.pool.apply_async ( self._obtain_idn, ( rm, res, isserial ) )
-			pool_results.append ( result )
+			result = self.pool.apply_async ( self._obtain_idn, ( res, isserial ) )
+			pool_results.append ( ( res, result ) )
 			
-		for pool_result in pool_results :
+		for res, pool_result in pool_results :
 			try :
 				res, idn = pool_result.get ( )
-			except ( pyvisa.errors.Error, SerialException ) :
+			except ( pyvisa.errors.Error, SerialException, ValueError ) :
 				if isserial :
 					self.logger.debug ( u"Could not open serial connection to %s", res )
 				else :
 					self.logger.debug ( u"Could not open GPIB connection to %s", res )
+				session_pool.close ( res )
 			else:
 				if idn:
 					self.identifiers[res] = idn
+					session_pool.remember_idn ( res, idn )
+				else :
+					session_pool.close ( res )
 		
-	def _obtain_idn ( self, rm, res, isserial ) :
+	def _obtain_idn ( self, res, isserial ) :
+		# The session is opened through the pool and stays open for the
+		# device objects created afterwards.
 		if isserial :
 			self.logger.debug ( u"Opening serial connection to %s", res )
-			# 5000 msecs needed to catch slow devices...
-			dev = rm.open_resource ( res, baud_rate = 19200, data_bits = 8, timeout = 5000 )
 		else :
 			self.logger.debug ( u"Opening GPIB connection to %s", res )
-			dev = rm.open_resource ( res )
+		# 5000 msecs needed to catch slow devices...
+		dev = session_pool.open ( res, isserial, baud_rate = 19200, data_bits = 8 )
 		idn = dev.query ( u"*IDN?" )
 		if idn :
 			self.logger.debug ( u"Got device identification: %s", idn )
 		else :
 			self.logger.debug ( u"Got no device identification" )
-		dev.close ( )
 		return res, idn
 		
 
+	def _find ( self, searches ) :
+		found = []
+		for key, value in sorted ( self.identifiers.items ( ) ) :
+			if key.startswith ( u"ASRL" ) and not self.useserial :
+				continue
+			if any ( search in value for search in searches ) :
+				found.append ( key )
+		return found
+
+	def get_resnames_for ( self, *searches ) :
+		# Resource names of the devices matching any of searches. Cached
+		# entries are validated on first use, the full scan is only done if
+		# that fails. Devices not in the cache are absent, use refresh to
+		# find devices connected since the last scan.
+		found = self._find ( searches )
+		if not self._scanned and not all ( self._validate ( res ) for res in found ) :
+			self.logger.debug ( u"Rescanning devices for %s", u", " .join ( searches ) )
+			self.scan ( )
+			found = self._find ( searches )
+		return found
+
 	def get_resname_for ( self, search ) :
-		for key, value in self.identifiers.items ( ) :
-			if search in value :
-				return key
-		return None
+		found = self.get_resnames_for ( search )
+		return found[0] if found else None
 
 if __name__ == u"__main__" :
 	import pprint
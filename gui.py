@@ -15,10 +15,18 @@ from collections import namedtuple
 from pyvisa.errors import VisaIOError
 
 import gpib_detect
+from visa_probestation_dev import session_pool
+import drivers
+import profiles
+import output_sink
+import journal
+import agilent
+import lcr_correction
 from probestation_utils import run_async
 from iv_measurement import IvMeasurementWindow
 from cv_measurement import CvMeasurementWindow
 from strip_measurement import StripMeasurementWindow
+from longterm_measurement import LongtermMeasurementWindow
 
 def createSpin ( lower, upper, step, value, decimals, suffix, tooltip = u"" ) :
 	spin = QtW.QDoubleSpinBox ( )
@@ -45,6 +53,14 @@ class GeneralOptionsWidget ( QtW.QGroupBox ) :
 		self._envsensorsenable_cb = QtW.QCheckBox ( )
 		self._envsensorsenable_cb.setDisabled ( not self._serialenable_cb.isChecked ( ) )
 		form.addRow ( u"  Enable environment sensors", self._envsensorsenable_cb )
+
+		self._binary_cb = QtW.QCheckBox ( )
+		self._binary_cb.setToolTip ( u"Transfer readings from the Keithley and Agilent devices in binary instead of ASCII format." )
+		form.addRow ( u"Binary data transfer", self._binary_cb )
+
+		self._keepwarm_cb = QtW.QCheckBox ( )
+		self._keepwarm_cb.setToolTip ( u"Keep the devices connected and configured after a measurement and only send changed settings to them in the next one." )
+		form.addRow ( u"Keep devices configured", self._keepwarm_cb )
 		
 	def _onSerialEnableToggled ( self, checked ):
 		self._envsensorsenable_cb.setDisabled ( not checked )
@@ -54,7 +70,9 @@ class GeneralOptionsWidget ( QtW.QGroupBox ) :
 	def getStatus ( self ) :
 		enableserial = self._serialenable_cb.isChecked ( )
 		enableenvsensors = self._envsensorsenable_cb.isChecked ( )
-		return ( enableserial, enableenvsensors )
+		binary = self._binary_cb.isChecked ( )
+		keepwarm = self._keepwarm_cb.isChecked ( )
+		return ( enableserial, enableenvsensors, binary, keepwarm )
 
 class VoltsrcGroupWidget ( QtW.QGroupBox ) :
 	def __init__ ( self ) :
@@ -62,18 +80,23 @@ class VoltsrcGroupWidget ( QtW.QGroupBox ) :
 
 		form = QtW.QFormLayout ( )
 		self.setLayout ( form )
+		self._form = form
 
 		self._start_spin = createSpin ( -1000, 1000, 0.01, 0, 2, u" V", u"Source voltage to start with" )
 		self._end_spin = createSpin ( -1000, 1000, 0.01, -1, 2, u" V", u"Source voltage to end with" )
 		self._step_spin = createSpin ( 0, 1000, 0.01, 0.1, 2, u" V", u"Source voltage difference between taking measurements" )
 		self._sleep_spin = createSpin ( 0, 100, 1, 1, 1, u" s", u"Time to wait between setting the source voltage and taking the measurement" )
 		self._compliance_spin = createSpin ( 0.1, 1000, 1, 10, 1, u" \u03BCA", u"If the compliance current is reached by one of the measured currents, the voltage source is immediately turned off." )
+		self._rampspeed_spin = createSpin ( 1, 1000, 10, 100, 0, u" V/s", u"Speed of the voltage ramp between measurement points and when ramping down" )
+		self._rampstep_spin = createSpin ( 0.1, 100, 1, 10, 1, u" V", u"Voltage step of the ramp" )
 
 		form.addRow ( u"Start voltage", self._start_spin )
 		form.addRow ( u"End voltage", self._end_spin )
 		form.addRow ( u"Abs step", self._step_spin )
 		form.addRow ( u"Wait time", self._sleep_spin )
 		form.addRow ( u"Abs compliance current", self._compliance_spin )
+		form.addRow ( u"Ramp speed", self._rampspeed_spin )
+		form.addRow ( u"Ramp step", self._rampstep_spin )
 
 	def getVoltages ( self ) :
 		start = self._start_spin.value ( )
@@ -81,8 +104,141 @@ class VoltsrcGroupWidget ( QtW.QGroupBox ) :
 		step = self._step_spin.value ( )
 		sleeptime = self._sleep_spin.value ( )
 		compcurrent = self._compliance_spin.value ( ) * 1e-6
+		rampspeed = self._rampspeed_spin.value ( )
+		rampstep = self._rampstep_spin.value ( )
+
+		return ( start, end, step, sleeptime, compcurrent, rampspeed, rampstep )
+
+	def hideSweep ( self ) :
+		# For measurements at a single voltage given elsewhere
+		for spin in ( self._start_spin, self._end_spin, self._step_spin ) :
+			self._form.labelForField ( spin ) .hide ( )
+			spin.hide ( )
+
+class AdaptiveStepWidget ( QtW.QGroupBox ) :
+	def __init__ ( self ) :
+		super ( AdaptiveStepWidget, self ) .__init__ ( u"Adaptive step" )
+
+		form = QtW.QFormLayout ( )
+		self.setLayout ( form )
+
+		self._adaptive_cb = QtW.QCheckBox ( )
+		self._adaptive_cb.setToolTip ( u"Use the abs step in flat regions and refine it where the slope of the measured curve changes sharply." )
+		self._adaptive_cb.toggled.connect ( self._onAdaptiveToggled )
+		form.addRow ( u"Enable adaptive step", self._adaptive_cb )
+
+		self._finestep_spin = createSpin ( 0.01, 1000, 0.1, 1, 2, u" V", u"Step used where the slope changes sharply" )
+		self._threshold_spin = createSpin ( 1, 1000, 5, 30, 0, u" %", u"Relative slope change between successive intervals above which the step is refined" )
+		self._maxpoints_spin = QtW.QSpinBox ( )
+		self._maxpoints_spin.setRange ( 2, 100000 )
+		self._maxpoints_spin.setValue ( 200 )
+		self._maxpoints_spin.setToolTip ( u"Maximum number of points of the sweep" )
+		form.addRow ( u"Fine step", self._finestep_spin )
+		form.addRow ( u"Refine threshold", self._threshold_spin )
+		form.addRow ( u"Point budget", self._maxpoints_spin )
+		self._onAdaptiveToggled ( False )
+
+	def _onAdaptiveToggled ( self, checked ) :
+		self._finestep_spin.setEnabled ( checked )
+		self._threshold_spin.setEnabled ( checked )
+		self._maxpoints_spin.setEnabled ( checked )
+
+	def getSettings ( self ) :
+		adaptive = self._adaptive_cb.isChecked ( )
+		finestep = self._finestep_spin.value ( )
+		threshold = self._threshold_spin.value ( ) * 1e-2
+		maxpoints = self._maxpoints_spin.value ( )
+
+		return ( adaptive, finestep, threshold, maxpoints )
+
+class ProfileGroupWidget ( QtW.QGroupBox ) :
+	def __init__ ( self ) :
+		super ( ProfileGroupWidget, self ) .__init__ ( u"Integration" )
+
+		form = QtW.QFormLayout ( )
+		self.setLayout ( form )
+
+		names = list ( profiles.PROFILES.keys ( ) ) + [ profiles.CUSTOM ]
+		self._profile_combo = QtW.QComboBox ( )
+		self._profile_combo.addItems ( names )
+		self._profile_combo.setCurrentIndex ( names.index ( u"normal" ) )
+		self._profile_combo.setToolTip ( u"Integration time and averaging of the meters" )
+		self._profile_combo.currentIndexChanged.connect ( self._onProfileChanged )
+		form.addRow ( u"Profile", self._profile_combo )
+
+		self._fine_combo = QtW.QComboBox ( )
+		self._fine_combo.addItems ( names )
+		self._fine_combo.setCurrentIndex ( names.index ( u"precise" ) )
+		self._fine_combo.setToolTip ( u"Profile used while the adaptive step is refined" )
+		self._fine_combo.currentIndexChanged.connect ( self._onProfileChanged )
+		form.addRow ( u"Profile in refined regions", self._fine_combo )
+
+		self._nplc_spin = createSpin ( 0.01, 10, 0.1, 1, 2, u" PLC", u"Integration time of the Keithley meters in power line cycles" )
+		self._average_spin = QtW.QSpinBox ( )
+		self._average_spin.setRange ( 1, 100 )
+		self._average_spin.setValue ( 5 )
+		self._average_spin.setToolTip ( u"Averaging filter count of the Keithley meters, 1 is off" )
+		self._aperture_combo = QtW.QComboBox ( )
+		self._aperture_combo.addItems ( [ u"SHORT", u"MED", u"LONG" ] )
+		self._aperture_combo.setCurrentIndex ( 1 )
+		self._aperture_combo.setToolTip ( u"Measurement time of the LCR meter" )
+		self._apavg_spin = QtW.QSpinBox ( )
+		self._apavg_spin.setRange ( 1, 256 )
+		self._apavg_spin.setValue ( 5 )
+		self._apavg_spin.setToolTip ( u"Averaging rate of the LCR meter" )
+		form.addRow ( u"Custom NPLC", self._nplc_spin )
+		form.addRow ( u"Custom averaging", self._average_spin )
+		form.addRow ( u"Custom LCR aperture", self._aperture_combo )
+		form.addRow ( u"Custom LCR averaging", self._apavg_spin )
+		self._onProfileChanged ( )
+
+		self._rangehint_cb = QtW.QCheckBox ( )
+		self._rangehint_cb.setToolTip ( u"Set the current range of the Keithley devices from the previous readings instead of using autorange. Not used when running the sweep on the instrument." )
+		form.addRow ( u"Predict current range", self._rangehint_cb )
+
+	def _onProfileChanged ( self, index = None ) :
+		custom = profiles.CUSTOM in ( self._profile_combo.currentText ( ), self._fine_combo.currentText ( ) )
+		self._nplc_spin.setEnabled ( custom )
+		self._average_spin.setEnabled ( custom )
+		self._aperture_combo.setEnabled ( custom )
+		self._apavg_spin.setEnabled ( custom )
+
+	def getSettings ( self ) :
+		custom = profiles.Profile ( self._nplc_spin.value ( ), self._average_spin.value ( ), self._aperture_combo.currentText ( ), self._apavg_spin.value ( ) )
+		profile = profiles.get_profile ( self._profile_combo.currentText ( ), custom )
+		profile_fine = profiles.get_profile ( self._fine_combo.currentText ( ), custom )
+		rangehint = self._rangehint_cb.isChecked ( )
+
+		return ( profile, profile_fine, rangehint )
+
+class SettleGroupWidget ( QtW.QGroupBox ) :
+	def __init__ ( self, absunit ) :
+		super ( SettleGroupWidget, self ) .__init__ ( u"Settling" )
+
+		form = QtW.QFormLayout ( )
+		self.setLayout ( form )
+
+		self._settle_cb = QtW.QCheckBox ( )
+		self._settle_cb.setToolTip ( u"Take the measurement as soon as successive readings agree within the tolerances. The wait time is used as upper limit." )
+		self._settle_cb.toggled.connect ( self._onSettleToggled )
+		form.addRow ( u"Adaptive wait time", self._settle_cb )
+
+		self._reltol_spin = createSpin ( 0, 100, 0.1, 1, 2, u" %", u"Relative difference allowed between successive readings" )
+		self._abstol_spin = createSpin ( 0, 1e6, 1, 1, 2, absunit, u"Absolute difference allowed between successive readings" )
+		form.addRow ( u"Relative tolerance", self._reltol_spin )
+		form.addRow ( u"Absolute tolerance", self._abstol_spin )
+		self._onSettleToggled ( False )
+
+	def _onSettleToggled ( self, checked ) :
+		self._reltol_spin.setEnabled ( checked )
+		self._abstol_spin.setEnabled ( checked )
 
-		return ( start, end, step, sleeptime, compcurrent )
+	def getSettings ( self ) :
+		settle = self._settle_cb.isChecked ( )
+		reltol = self._reltol_spin.value ( ) * 1e-2
+		abstol = self._abstol_spin.value ( ) * 1e-12
+
+		return ( settle, reltol, abstol )
 
 class GuardMeasWidget ( QtW.QGroupBox ) :
 	def __init__ ( self ) :
@@ -99,8 +255,31 @@ class GuardMeasWidget ( QtW.QGroupBox ) :
 		guardring = self._guardring_cb.isChecked ( )
 		return ( guardring )
 
-class FreqGroupWidget ( QtW.QGroupBox ) :
+class SweepModeWidget ( QtW.QGroupBox ) :
 	def __init__ ( self ) :
+		super ( SweepModeWidget, self ) .__init__ ( u"Sweep mode" )
+
+		form = QtW.QFormLayout ( )
+		self.setLayout ( form )
+
+		self._hwsweep_cb = QtW.QCheckBox ( )
+		self._hwsweep_cb.setToolTip ( u"Load the whole sweep into the voltage source and fetch the readings in bulk. The wait time is used as source delay. The sweep runs in chunks of up to 5 s, the software compliance check and Stop only act between chunks. Only for Keithley 2410 without guard ring measurement." )
+
+		form.addRow ( u"Run sweep on instrument", self._hwsweep_cb )
+
+		self._samples_spin = QtW.QSpinBox ( )
+		self._samples_spin.setRange ( 1, 10000 )
+		self._samples_spin.setValue ( 1 )
+		self._samples_spin.setToolTip ( u"Number of readings taken into the instrument buffer per voltage step. Mean and standard deviation are stored. Only for Keithley 6517B." )
+		form.addRow ( u"Buffered samples per point", self._samples_spin )
+
+	def getStatus ( self ) :
+		hwsweep = self._hwsweep_cb.isChecked ( )
+		samples = self._samples_spin.value ( )
+		return ( hwsweep, samples )
+
+class FreqGroupWidget ( QtW.QGroupBox ) :
+	def __init__ ( self, frequency_list = False ) :
 		super ( FreqGroupWidget, self ) .__init__ ( u"LCR parameters" )
 
 		form = QtW.QFormLayout ( )
@@ -112,12 +291,58 @@ class FreqGroupWidget ( QtW.QGroupBox ) :
 		self._volt_spin = createSpin ( 0, 20, 0.5, 1, 2, u" V" )
 		form.addRow ( u"AC Voltage level", self._volt_spin )
 
+		self._freqlist_edit = QtW.QLineEdit ( )
+		self._freqlist_edit.setPlaceholderText ( u"e.g. 1, 10, 100" )
+		self._freqlist_edit.setToolTip ( u"Comma separated frequencies in kHz, all measured in one list sweep of the LCR meter at each voltage. The first one is plotted. Leave empty to measure at the frequency above." )
+		form.addRow ( u"Frequency list", self._freqlist_edit )
+		if not frequency_list :
+			form.labelForField ( self._freqlist_edit ) .hide ( )
+			self._freqlist_edit.hide ( )
+
 	def getSettings ( self ):
 		freq = self._freq_spin.value ( ) * 1e3
 		volt = self._volt_spin.value ( )
 
 		return ( freq, volt )
 
+	def getFrequencies ( self ) :
+		# Frequencies of the list in Hz, raises ValueError for invalid input
+		text = self._freqlist_edit.text ( ) .strip ( )
+		if not text or self._freqlist_edit.isHidden ( ) :
+			return []
+		return [ float ( field ) * 1e3 for field in text.split ( u"," ) ]
+
+class CorrectionGroupWidget ( QtW.QGroupBox ) :
+	def __init__ ( self ) :
+		super ( CorrectionGroupWidget, self ) .__init__ ( u"Open/short correction" )
+
+		form = QtW.QFormLayout ( )
+		self.setLayout ( form )
+
+		self._correction_cb = QtW.QCheckBox ( )
+		self._correction_cb.setToolTip ( u"Use the open/short correction measured before for the fixture and frequencies. Without a recent one the measurement runs uncorrected." )
+		self._correction_cb.toggled.connect ( self._onCorrectionToggled )
+		form.addRow ( u"Enable correction", self._correction_cb )
+
+		self._fixture_edit = QtW.QLineEdit ( u"default" )
+		self._fixture_edit.setToolTip ( u"Name of the fixture the correction belongs to, e.g. the probe card" )
+		form.addRow ( u"Fixture", self._fixture_edit )
+
+		self.measure_button = QtW.QPushButton ( u"Measure..." )
+		self.measure_button.setToolTip ( u"Measure the open and short correction for the fixture at the frequencies set above" )
+		form.addRow ( u"", self.measure_button )
+		self._onCorrectionToggled ( False )
+
+	def _onCorrectionToggled ( self, checked ) :
+		self._fixture_edit.setEnabled ( checked )
+		self.measure_button.setEnabled ( checked )
+
+	def getSettings ( self ) :
+		enabled = self._correction_cb.isChecked ( )
+		fixture = self._fixture_edit.text ( ) .strip ( )
+
+		return ( enabled, fixture )
+
 class StripGroupWidget ( QtW.QGroupBox ) :
 	def __init__ ( self ) :
 		super ( StripGroupWidget, self ) .__init__ ( u"Strip Measurement" )
@@ -134,6 +359,27 @@ class StripGroupWidget ( QtW.QGroupBox ) :
 
 		return ( select )
 
+class LongtermGroupWidget ( QtW.QGroupBox ) :
+	def __init__ ( self ) :
+		super ( LongtermGroupWidget, self ) .__init__ ( u"Long-term measurement" )
+
+		form = QtW.QFormLayout ( )
+		self.setLayout ( form )
+
+		self._bias_spin = createSpin ( -1000, 1000, 1, -100, 2, u" V", u"Source voltage held during the measurement" )
+		self._duration_spin = createSpin ( 0.01, 1000, 1, 1, 2, u" h", u"Time the bias voltage is held" )
+		self._interval_spin = createSpin ( 0, 3600, 1, 0, 2, u" s", u"Time between readings, 0 to read as fast as the devices allow" )
+		form.addRow ( u"Bias voltage", self._bias_spin )
+		form.addRow ( u"Duration", self._duration_spin )
+		form.addRow ( u"Reading interval", self._interval_spin )
+
+	def getSettings ( self ) :
+		bias = self._bias_spin.value ( )
+		duration = self._duration_spin.value ( ) * 3600
+		interval = self._interval_spin.value ( )
+
+		return ( bias, duration, interval )
+
 class DirectoryLayout ( QtW.QHBoxLayout ):
 	def __init__ ( self, directory, parent_win ) :
 		super ( DirectoryLayout, self ) .__init__ ( )
@@ -148,6 +394,17 @@ class DirectoryLayout ( QtW.QHBoxLayout ):
 		self._browse = QtW.QPushButton ( u"Browse..." )
 		self._browse.clicked.connect ( self._onBrowseClicked )
 		self.addWidget ( self._browse )
+		self._format_combo = QtW.QComboBox ( )
+		self._format_combo.addItems ( output_sink.available_formats ( ) )
+		self._format_combo.setToolTip ( u"File format of the measured data. npz and hdf5 store typed columns in blocks together with the measurement settings." )
+		self.addWidget ( self._format_combo )
+		self._flush_spin = createSpin ( 0, 3600, 1, 0, 1, u" s", u"Time between writes of the measured data to the file, default of the format with 0" )
+		self._flush_spin.setSpecialValueText ( u"Default" )
+		self.addWidget ( self._flush_spin )
+		self._fsync_cb = QtW.QCheckBox ( u"Sync" )
+		self._fsync_cb.setToolTip ( u"Sync the file to disk on each flush, every flush interval, so at most the data of one interval is lost on a crash or power failure" )
+		self._fsync_cb.setChecked ( True )
+		self.addWidget ( self._fsync_cb )
 
 	def _onBrowseClicked ( self ) :
 		new_dir = QtCore.QDir.toNativeSeparators ( QtW.QFileDialog.getExistingDirectory ( self._parent_win, u"", self.getOutputDir ( ) ) )
@@ -157,6 +414,20 @@ class DirectoryLayout ( QtW.QHBoxLayout ):
 	def getOutputDir ( self ) :
 		return self._edit.text ( )
 
+	def getOutputFormat ( self ) :
+		return self._format_combo.currentText ( )
+
+	def getFlushPolicy ( self ) :
+		flush_interval = self._flush_spin.value ( ) or None
+		fsync = self._fsync_cb.isChecked ( )
+
+		return ( flush_interval, fsync )
+
+	def setOutputFormat ( self, output_format ) :
+		index = self._format_combo.findText ( output_format )
+		if index >= 0 :
+			self._format_combo.setCurrentIndex ( index )
+
 MeasurementArgs = namedtuple ( u"MeasurementArgs", [u"type",
 													u"serialenable",
 													u"devname_ardenv",
@@ -172,12 +443,64 @@ MeasurementArgs = namedtuple ( u"MeasurementArgs", [u"type",
 													u"frequency",
 													u"deltavolt",
 													u"sleep",
-													u"output_dir"] )
+													u"output_dir",
+													u"hwsweep",
+													u"samples",
+													u"binary",
+													u"rampspeed",
+													u"rampstep",
+													u"settle",
+													u"settle_reltol",
+													u"settle_abstol",
+													u"adaptive",
+													u"fine_step",
+													u"adaptive_threshold",
+													u"max_points",
+													u"keepwarm",
+													u"profile",
+													u"profile_fine",
+													u"rangehint",
+													u"output_format",
+													u"resume",
+													u"duration",
+													u"interval",
+													u"frequencies",
+													u"correction_fixture",
+													u"flush_interval",
+													u"fsync"] )
 													
 class MeasurementSetttingsError ( RuntimeError ) :
 	pass
+
+def resumeArgs ( path ) :
+	# Arguments continuing the run of the journal at path after its last
+	# completed point
+	try :
+		output, params, points, finished = journal.load_journal ( path )
+	except ( IOError, ValueError ) as e :
+		raise MeasurementSetttingsError ( u"Could not read journal: {}" .format ( e ) )
+	if finished :
+		raise MeasurementSetttingsError ( u"The run of this journal is already complete." )
+	if set ( params ) != set ( MeasurementArgs._fields ) :
+		raise MeasurementSetttingsError ( u"The journal was written by a different software version." )
+
+	args = MeasurementArgs ( **params )
+	args = args._replace ( profile = profiles.Profile ( *args.profile ), profile_fine = profiles.Profile ( *args.profile_fine ), resume = path )
+	if not points :
+		return args
+	last = points[-1][0]
+	if last == args.end :
+		raise MeasurementSetttingsError ( u"All points of the run have been measured." )
+	direction = 1 if args.end >= args.start else -1
+	start = round ( last + direction * abs ( args.step ), 3 )
+	if direction * ( start - args.end ) > 0 :
+		start = args.end
+	return args._replace ( start = start )
 													
 class MeasurementTab ( QtW.QWidget ) :
+	# Unit of the absolute settle tolerance, which is given in multiples of 1e-12
+	SETTLE_UNIT = u" pA"
+
 	def __init__ ( self, parent_win, output_dir ) :
 		super ( MeasurementTab, self ).__init__ ( )
 		
@@ -191,6 +514,15 @@ class MeasurementTab ( QtW.QWidget ) :
 		
 		self._voltsrc = VoltsrcGroupWidget ( )
 		self._vbox.addWidget ( self._voltsrc )
+
+		self._adaptive = AdaptiveStepWidget ( )
+		self._vbox.addWidget ( self._adaptive )
+
+		self._settle = SettleGroupWidget ( self.SETTLE_UNIT )
+		self._vbox.addWidget ( self._settle )
+
+		self._profile = ProfileGroupWidget ( )
+		self._vbox.addWidget ( self._profile )
 		
 		self._vbox.addStretch ( 1 )
 		
@@ -207,6 +539,14 @@ class MeasurementTab ( QtW.QWidget ) :
 		self._loadingindicator.hide ( )
 		hbox.addStretch ( 1 )
 		self._bottombox.addLayout ( hbox )
+		self._rescan_button = QtW.QPushButton ( u"Rescan devices" )
+		self._rescan_button.setToolTip ( u"Search all GPIB/serial devices again instead of using the devices found before" )
+		self._rescan_button.clicked.connect ( self._onRescanClicked )
+		hbox.addWidget ( self._rescan_button )
+		self._resume_button = QtW.QPushButton ( u"Resume..." )
+		self._resume_button.setToolTip ( u"Continue an interrupted measurement after its last completed point" )
+		self._resume_button.clicked.connect ( self._onResumeClicked )
+		hbox.addWidget ( self._resume_button )
 		self._start_button = QtW.QPushButton ( u"Start" )
 		self._start_button.setToolTip ( u"Start the measurement" )
 		self._start_button.resize ( self._start_button.sizeHint ( ) )
@@ -226,25 +566,34 @@ class MeasurementTab ( QtW.QWidget ) :
 			self._bottombox.insertLayout ( self._bottombox.count ( ) - 2, obj )
 			
 	def _setupMeasurement ( self ) :
-		start, end, step, sleeptime, compcurrent = self._voltsrc.getVoltages ( )
+		start, end, step, sleeptime, compcurrent, rampspeed, rampstep = self._voltsrc.getVoltages ( )
 		if step <= 0 :
 			raise MeasurementSetttingsError ( u"Abs step needs to be positive." )
 		if abs ( start ) > 1000 or abs ( end ) > 1000 :
 			raise MeasurementSetttingsError ( u"Voltage can't be larger than 1000 V." )
 		if not 0 <= sleeptime :
 			raise MeasurementSetttingsError ( u"Invalid sleep time." )
+		if rampspeed <= 0 or rampstep <= 0 :
+			raise MeasurementSetttingsError ( u"Ramp speed and step need to be positive." )
+		adaptive, fine_step, adaptive_threshold, max_points = self._adaptive.getSettings ( )
+		if adaptive and not 0 < fine_step <= step :
+			raise MeasurementSetttingsError ( u"Fine step needs to be positive and not larger than the abs step." )
 			
-		serialenable, envsensorsenable = self._general.getStatus ( )
+		serialenable, envsensorsenable, binary, keepwarm = self._general.getStatus ( )
+		settle, settle_reltol, settle_abstol = self._settle.getSettings ( )
+		profile, profile_fine, rangehint = self._profile.getSettings ( )
 		
 		if compcurrent <= 0 :
 			raise MeasurementSetttingsError ( u"Compliance current needs to be positive." )
 			
 		output_dir = self._browse_layout.getOutputDir ( )
+		output_format = self._browse_layout.getOutputFormat ( )
+		flush_interval, fsync = self._browse_layout.getFlushPolicy ( )
 		if not os.path.isdir ( output_dir ) or not os.access ( output_dir, os.W_OK ) :
 			raise MeasurementSetttingsError ( u"Invalid output directory." )
 			
 		try :
-			self.detector = gpib_detect.GPIBDetector ( serialenable )
+			self.detector = gpib_detect.GPIBDetector ( serialenable, gpib_detect.DEFAULT_CACHE_FILE )
 			detector = self.detector
 			if envsensorsenable:
 				devname_ardenv = detector.get_resname_for ( u"Arduino Probestation Environment Sensoring" )
@@ -252,20 +601,14 @@ class MeasurementTab ( QtW.QWidget ) :
 					raise MeasurementSetttingsError ( u"Could not find an Arduino for environment sensoring.<br>Arduino might be in use by another process." )
 			else:
 				devname_ardenv = None
-			kei6517b_devname = detector.get_resname_for ( u"KEITHLEY INSTRUMENTS INC.,MODEL 6517B" )
-			kei2410_devname = detector.get_resname_for ( u"KEITHLEY INSTRUMENTS INC.,MODEL 2410" )
-			if kei6517b_devname is None :
-				hvdev_devname = kei2410_devname
-				logger.debug ( u"  Couldn't find Keithley 6517B, trying Keithley 2410 for HV." )
-			if kei2410_devname is None :
-				hvdev_devname = kei6517b_devname
-				logger.debug ( u"  Couldn't find Keithley 2410, trying Keithley 6517B for HV." )
-			if ( kei6517b_devname is not None and kei2410_devname is not None) :
+			hv_devnames = detector.get_resnames_for ( u"KEITHLEY INSTRUMENTS INC.,MODEL 6517B", u"KEITHLEY INSTRUMENTS INC.,MODEL 2410" )
+			if len ( hv_devnames ) > 1 :
 				raise MeasurementSetttingsError ( u"I found both Keithley 6517B and Keithley 2410!<br><br>I don't know which to use!" )
-			if ( kei6517b_devname is None and kei2410_devname is None ) :
-				raise MeasurementSetttingsError ( u"Could not find Keithley 6517B or Keithley 2410." )
-			else :
-				kei6485_devname = None
+			if not hv_devnames :
+				raise MeasurementSetttingsError ( u"Could not find Keithley 6517B or Keithley 2410.<br>Rescan devices if it was connected since the last scan." )
+			hvdev_devname = hv_devnames[0]
+			logger.debug ( u"  Using {} for HV." .format ( detector.identifiers[hvdev_devname] ) )
+			kei6485_devname = None
 		except VisaIOError :
 			raise MeasurementSetttingsError ( u"Could not connect to GPIB/serial devices." )
 				
@@ -284,7 +627,31 @@ class MeasurementTab ( QtW.QWidget ) :
 								 None, # frequency
 								 None, # deltavolt
 								 sleeptime, # sleep
-								 output_dir ) # output_dir
+								 output_dir, # output_dir
+								 False, # hwsweep
+								 1, # samples
+								 binary, # binary
+								 rampspeed, # rampspeed
+								 rampstep, # rampstep
+								 settle, # settle
+								 settle_reltol, # settle_reltol
+								 settle_abstol, # settle_abstol
+								 adaptive, # adaptive
+								 fine_step, # fine_step
+								 adaptive_threshold, # adaptive_threshold
+								 max_points, # max_points
+								 keepwarm, # keepwarm
+								 profile, # profile
+								 profile_fine, # profile_fine
+								 rangehint, # rangehint
+								 output_format, # output_format
+								 None, # resume
+								 None, # duration
+								 None, # interval
+								 None, # frequencies
+								 None, # correction_fixture
+								 flush_interval, # flush_interval
+								 fsync ) # fsync
 			
 		return args
 		
@@ -301,6 +668,38 @@ class MeasurementTab ( QtW.QWidget ) :
 		self._parent_win.setEnabled ( False )
 		self._loadingindicator.show ( )
 		
+	def _rescan ( self ) :
+		serialenable = self._general.getStatus ( ) [0]
+		try :
+			gpib_detect.GPIBDetector ( serialenable, gpib_detect.DEFAULT_CACHE_FILE, refresh = True )
+		except VisaIOError :
+			raise MeasurementSetttingsError ( u"Could not connect to GPIB/serial devices." )
+
+	def _onRescanClicked ( self ) :
+		run_async ( self._rescan, self._onRescanFinished, self._onSetupError )
+		self._parent_win.setEnabled ( False )
+		self._loadingindicator.show ( )
+
+	def _onResumeClicked ( self ) :
+		if self._parent_win.measurementIsRunning ( ) :
+			self._parent_win.showErrorDialog ( u"Measurement is currently running." )
+			return
+
+		output_dir = self._browse_layout.getOutputDir ( )
+		path = QtW.QFileDialog.getOpenFileName ( self._parent_win, u"Resume measurement", journal.find_unfinished ( output_dir ) or output_dir, u"Journals (*{})" .format ( journal.EXTENSION ) )
+		if isinstance ( path, tuple ) :
+			path = path[0]
+		if not path :
+			return
+
+		run_async ( resumeArgs, self._onSetupFinished, self._onSetupError, path )
+		self._parent_win.setEnabled ( False )
+		self._loadingindicator.show ( )
+
+	def _onRescanFinished ( self, result ) :
+		self._loadingindicator.hide ( )
+		self._parent_win.setEnabled ( True )
+
 	def _onSetupFinished ( self, args ) :
 		self._loadingindicator.hide ( )
 		self._parent_win.startMeasurement ( args )
@@ -320,12 +719,20 @@ class IvTab ( MeasurementTab ) :
 
 		self._guard = GuardMeasWidget ( )
 		self._addToCenter ( self._guard )
+
+		self._sweepmode = SweepModeWidget ( )
+		self._addToCenter ( self._sweepmode )
 		
 	def _setupMeasurement ( self ):
 		args = super ( IvTab, self ) ._setupMeasurement ( ) ._asdict ( )
 		args = dict ( args )
 		
 		guardring = self._guard.getStatus ( )
+		hwsweep, samples = self._sweepmode.getStatus ( )
+		if hwsweep and guardring :
+			raise MeasurementSetttingsError ( u"Running the sweep on the instrument is not possible with guard ring measurement." )
+		if hwsweep and args["adaptive"] :
+			raise MeasurementSetttingsError ( u"Running the sweep on the instrument is not possible with adaptive step." )
 		
 		kei6485_devname = None
 		try:
@@ -333,11 +740,17 @@ class IvTab ( MeasurementTab ) :
 				kei6485_devname = self.detector.get_resname_for ( u"KEITHLEY INSTRUMENTS INC.,MODEL 6485" )
 				if kei6485_devname is None :
 					raise MeasurementSetttingsError ( u"Could not find Keithley 6485." )
+			if hwsweep and not u"MODEL 2410" in self.detector.identifiers[args["devname_hv"]] :
+				raise MeasurementSetttingsError ( u"Running the sweep on the instrument needs a Keithley 2410." )
+			if samples > 1 and not u"MODEL 6517B" in self.detector.identifiers[args["devname_hv"]] :
+				raise MeasurementSetttingsError ( u"Buffered samples need a Keithley 6517B." )
 		except VisaIOError:
 			raise MeasurementSetttingsError ( u"Could not connect to GPIB/serial devices." )
 
 		args["type"] = u"IV"
 		args["guardring"] = guardring
+		args["hwsweep"] = hwsweep
+		args["samples"] = samples
 		args["devname_kei6485"] = kei6485_devname
 		
 		return MeasurementArgs ( **args )
@@ -347,21 +760,48 @@ class IvTab ( MeasurementTab ) :
 		super( IvTab, self ) ._onStartClicked ( u"Is the CV/IV box set to IV?" )
 
 class CvTab ( MeasurementTab ) :
+	SETTLE_UNIT = u" pF"
+
 	def __init__ ( self, parent_win, output_dir ) :
 		super ( CvTab, self ) .__init__ ( parent_win, output_dir )
 
-		self._freqsettings = FreqGroupWidget ( )
+		self._freqsettings = FreqGroupWidget ( frequency_list = True )
 		self._addToCenter ( self._freqsettings )
-		
-	def _setupMeasurement ( self ):
-		args = super ( CvTab, self ) ._setupMeasurement ( ) ._asdict ( )
-		args = dict ( args )
-		
+
+		self._correction = CorrectionGroupWidget ( )
+		self._correction.measure_button.clicked.connect ( self._onCorrectionClicked )
+		self._addToCenter ( self._correction )
+
+	def _getLcrSettings ( self ) :
+		# Frequency, AC voltage level and the frequency list, which may be
+		# empty
 		freq, volt = self._freqsettings.getSettings ( )
 		if not 20 <= freq <= 2e6 :
 			raise MeasurementSetttingsError ( u"Frequency must be between 20 Hz and 2 MHz." )
 		if not 0 <= volt <= 20 :
 			raise MeasurementSetttingsError ( u"AC voltage must be between 0 V and 20 V." )
+		try :
+			frequencies = self._freqsettings.getFrequencies ( )
+		except ValueError :
+			raise MeasurementSetttingsError ( u"Invalid frequency list." )
+		if not all ( 20 <= f <= 2e6 for f in frequencies ) :
+			raise MeasurementSetttingsError ( u"Frequency must be between 20 Hz and 2 MHz." )
+		if len ( set ( agilent.list_columns ( u"", frequencies ) ) ) != 2 * len ( frequencies ) :
+			raise MeasurementSetttingsError ( u"Frequencies in the list must differ." )
+		if len ( frequencies ) > agilent.AgilentE4980A.LIST_MAX_POINTS :
+			raise MeasurementSetttingsError ( u"Too many frequencies in the list." )
+		return ( freq, volt, frequencies )
+
+	def _setupMeasurement ( self ):
+		args = super ( CvTab, self ) ._setupMeasurement ( ) ._asdict ( )
+		args = dict ( args )
+		
+		freq, volt, frequencies = self._getLcrSettings ( )
+		if frequencies :
+			freq = frequencies[0]
+		correction, fixture = self._correction.getSettings ( )
+		if correction and not fixture :
+			raise MeasurementSetttingsError ( u"Fixture name needed for the correction." )
 		
 		agie4980a_devname = None
 		try:
@@ -370,10 +810,15 @@ class CvTab ( MeasurementTab ) :
 				raise MeasurementSetttingsError ( u"Could not find Agilent E4980A." )
 		except VisaIOError:
 			raise MeasurementSetttingsError ( u"Could not connect to GPIB/serial devices." )
+		if correction and lcr_correction.CorrectionCache ( ) .get ( fixture, self.detector.identifiers[agie4980a_devname], frequencies or [ freq ] ) is None :
+			# Measured without correction, the measurement thread reports it
+			logger.warning ( u"No open/short correction of the last {:.0f} days for fixture {} at these frequencies" .format ( lcr_correction.CorrectionCache.MAX_AGE / 86400, fixture ) )
 
 		args["type"] = u"CV"
 		args["compcurrent"] *= 1000.0 # CV box adds 1KOhm -> compcurrent goes down...
 		args["frequency"] = freq
+		args["frequencies"] = frequencies
+		args["correction_fixture"] = fixture if correction else None
 		args["deltavolt"] = volt
 		args["devname_agiE4980A"] = agie4980a_devname
 		
@@ -382,7 +827,64 @@ class CvTab ( MeasurementTab ) :
 	def _onStartClicked ( self ) :
 		super( CvTab, self ) ._onStartClicked ( u"Is the CV/IV box set to both CV and External?" )
 
+	def _measureCorrection ( self, kind, frequencies, volt ) :
+		# Runs one step of the correction, returns the device identification
+		serialenable = self._general.getStatus ( ) [0]
+		try :
+			detector = gpib_detect.GPIBDetector ( serialenable, gpib_detect.DEFAULT_CACHE_FILE )
+			devname = detector.get_resname_for ( u"Agilent Technologies,E4980A" )
+			if devname is None :
+				raise MeasurementSetttingsError ( u"Could not find Agilent E4980A." )
+			dev = drivers.open_device ( devname, serialenable, agilent.AgilentE4980A, True )
+			dev.set_voltage_level ( volt )
+			if kind == u"OPEN" :
+				# The stored correction is lost from here on, also if the
+				# short correction is cancelled
+				lcr_correction.CorrectionCache ( ) .forget ( dev.identify ( ) )
+			dev.measure_correction ( kind, frequencies )
+			return dev.identify ( )
+		except ( VisaIOError, IOError, ValueError ) as e :
+			drivers.forget_devices ( )
+			raise MeasurementSetttingsError ( u"Correction failed: {}" .format ( e ) )
+
+	def _onCorrectionClicked ( self ) :
+		if self._parent_win.measurementIsRunning ( ) :
+			self._parent_win.showErrorDialog ( u"Measurement is currently running." )
+			return
+		try :
+			freq, self._correction_volt, frequencies = self._getLcrSettings ( )
+		except MeasurementSetttingsError as e :
+			self._parent_win.showErrorDialog ( str ( e ) )
+			return
+		self._correction_freqs = frequencies or [ freq ]
+
+		check = QtW.QMessageBox.question ( self, u"Open correction", u"Lift the probes, so the fixture is open.", QtW.QMessageBox.Ok, QtW.QMessageBox.Cancel )
+		if check != QtW.QMessageBox.Ok :
+			return
+		run_async ( self._measureCorrection, self._onOpenMeasured, self._onSetupError, u"OPEN", self._correction_freqs, self._correction_volt )
+		self._parent_win.setEnabled ( False )
+		self._loadingindicator.show ( )
+
+	def _onOpenMeasured ( self, idn ) :
+		self._loadingindicator.hide ( )
+		self._parent_win.setEnabled ( True )
+		check = QtW.QMessageBox.question ( self, u"Short correction", u"Short the probes.", QtW.QMessageBox.Ok, QtW.QMessageBox.Cancel )
+		if check != QtW.QMessageBox.Ok :
+			return
+		run_async ( self._measureCorrection, self._onShortMeasured, self._onSetupError, u"SHORT", self._correction_freqs, self._correction_volt )
+		self._parent_win.setEnabled ( False )
+		self._loadingindicator.show ( )
+
+	def _onShortMeasured ( self, idn ) :
+		self._loadingindicator.hide ( )
+		self._parent_win.setEnabled ( True )
+		fixture = self._correction.getSettings ( ) [1]
+		correction = lcr_correction.CorrectionCache ( ) .put ( fixture, idn, self._correction_freqs )
+		QtW.QMessageBox.information ( self, u"Correction", u"Stored open/short correction of fixture {} from {}." .format ( fixture, correction[u"date"] ) )
+
 class StripTab ( MeasurementTab ) :
+	SETTLE_UNIT = u" pF"
+
 	def __init__ ( self, parent_win, output_dir ) :
 		super ( StripTab, self ) .__init__ ( parent_win, output_dir )
 
@@ -427,6 +929,60 @@ class StripTab ( MeasurementTab ) :
 	def _onStartClicked ( self ) :
 		super( StripTab, self ) ._onStartClicked ( u"Is the CV/IV box set to both IV and C<sub>int</sub>/R<sub>int</sub>?" )
 
+class LongtermTab ( MeasurementTab ) :
+	def __init__ ( self, parent_win, output_dir ) :
+		super ( LongtermTab, self ) .__init__ ( parent_win, output_dir )
+
+		# Sweep settings do not apply, the bias is set below
+		self._voltsrc.hideSweep ( )
+		self._adaptive.hide ( )
+		self._settle.hide ( )
+		self._resume_button.hide ( )
+
+		self._longterm = LongtermGroupWidget ( )
+		self._addToCenter ( self._longterm )
+
+		self._guard = GuardMeasWidget ( )
+		self._addToCenter ( self._guard )
+
+		# Long runs are better stored in blocks than as text
+		self._browse_layout.setOutputFormat ( u"npz" )
+
+	def _setupMeasurement ( self ):
+		args = super ( LongtermTab, self ) ._setupMeasurement ( ) ._asdict ( )
+		args = dict ( args )
+
+		bias, duration, interval = self._longterm.getSettings ( )
+		if abs ( bias ) > 1000 :
+			raise MeasurementSetttingsError ( u"Voltage can't be larger than 1000 V." )
+		if duration <= 0 or interval < 0 :
+			raise MeasurementSetttingsError ( u"Invalid duration or reading interval." )
+		guardring = self._guard.getStatus ( )
+
+		kei6485_devname = None
+		try:
+			if guardring :
+				kei6485_devname = self.detector.get_resname_for ( u"KEITHLEY INSTRUMENTS INC.,MODEL 6485" )
+				if kei6485_devname is None :
+					raise MeasurementSetttingsError ( u"Could not find Keithley 6485." )
+		except VisaIOError:
+			raise MeasurementSetttingsError ( u"Could not connect to GPIB/serial devices." )
+
+		args["type"] = u"Longterm"
+		args["start"] = bias
+		args["end"] = bias
+		args["adaptive"] = False
+		args["settle"] = False
+		args["duration"] = duration
+		args["interval"] = interval
+		args["guardring"] = guardring
+		args["devname_kei6485"] = kei6485_devname
+
+		return MeasurementArgs ( **args )
+
+	def _onStartClicked ( self ) :
+		super( LongtermTab, self ) ._onStartClicked ( u"Is the CV/IV box set to IV?" )
+
 class MainWindow ( QtW.QMainWindow ) :
 	def __init__ ( self, output_dir ) :
 		super ( MainWindow, self ) .__init__ ( )
@@ -445,8 +1001,18 @@ class MainWindow ( QtW.QMainWindow ) :
 		self._striptab = StripTab ( self, output_dir )
 		self._tabwidget.addTab ( self._striptab, u"Strip" )
 
+		self._longtermtab = LongtermTab ( self, output_dir )
+		self._tabwidget.addTab ( self._longtermtab, u"Long-term" )
+
 		self._mwin = None
 
+	def closeEvent ( self, event ) :
+		if self.measurementIsRunning ( ) :
+			self._mwin.close ( )
+		drivers.forget_devices ( )
+		session_pool.close_all ( )
+		event.accept ( )
+
 	def measurementIsRunning ( self ) :
 		return not self._mwin is None and self._mwin.isRunning ( )
 
@@ -457,12 +1023,20 @@ class MainWindow ( QtW.QMainWindow ) :
 			self._mwin = CvMeasurementWindow ( self, args )
 		elif args.type == u"Strip" :
 			self._mwin = StripMeasurementWindow ( self, args )
+		elif args.type == u"Longterm" :
+			self._mwin = LongtermMeasurementWindow ( self, args )
 		else :
 			raise NotImplementedError ( args.type )
 		self._mwin.setWindowModality ( QtCore.Qt.WindowModal )
 		self._mwin.set_absolute ( True )
 		self._mwin.start ( )
 
+	def resumeMeasurement ( self, path ) :
+		try :
+			self.startMeasurement ( resumeArgs ( path ) )
+		except MeasurementSetttingsError as e :
+			self.showErrorDialog ( str ( e ) )
+
 	def showErrorDialog ( self, message ) :
 		reply = QtW.QMessageBox.critical ( self, u"Error", message, QtW.QMessageBox.Ok, QtW.QMessageBox.Ok )
 
@@ -471,16 +1045,17 @@ if __name__ == u"__main__" :
 	import optparse
 
 	app = QtW.QApplication ( sys.argv )
-	if len ( sys.argv ) > 1 and os.path.isdir ( sys.argv[1] ) :
-		output_dir = sys.argv[1]
-	else:
-		output_dir = os.getcwd ( )
 
 	usage = u"Usage: python %prog [options] <default storage path>"
 	description = u"If no default storage path is specified, the current directory is used."
 	parser = optparse.OptionParser ( usage = usage, description = description )
 	parser.add_option ( u"-d", u"--debug", action = u"store_true", dest = u"debug", help = u"debug flag, enables more verbose console output" )
+	parser.add_option ( u"-r", u"--resume", dest = u"resume", metavar = u"JOURNAL", help = u"resume the interrupted measurement of the given journal file" )
 	options, args = parser.parse_args ( )
+	if len ( args ) > 0 and os.path.isdir ( args[0] ) :
+		output_dir = args[0]
+	else:
+		output_dir = os.getcwd ( )
 	logger = logging.getLogger ( u'probestation' )
 	ch = logging.StreamHandler ( )
 	logger.addHandler ( ch )
@@ -494,4 +1069,6 @@ if __name__ == u"__main__" :
 
 	win = MainWindow ( output_dir )
 	win.show ( )
+	if options.resume :
+		win.resumeMeasurement ( options.resume )
 	sys.exit ( app.exec_ ( ) )
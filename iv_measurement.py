@@ -6,7 +6,7 @@ from __future__ import absolute_import
 import logging
 from measurement_window import MeasurementThread, MeasurementWindow
 import keithley
-import sys
+import drivers
 
 try:
     from PyQt5 import QtWidgets as QtW
@@ -16,11 +16,9 @@ except ImportError as e :
     from PyQt4 import QtCore
 
 import os
-import csv
 import datetime
 from time import sleep
 from pyvisa.errors import VisaIOError, InvalidBinaryFormat
-from io import open
 from collections import OrderedDict
 
 def getDateTimeFilename ( ) :
@@ -33,84 +31,131 @@ class IvMeasurementThread ( MeasurementThread ) :
 	def __init__ ( self, args ) :
 		super ( IvMeasurementThread, self ) .__init__ ( args )
 
+	def _series ( self, keith_hv ) :
+		# Yields ( voltage, reading, time ) tuples. The reading and its time
+		# are only known in advance for sweeps run on the instrument.
+		args = self.args
+		if args.hwsweep :
+			for chunk in keith_hv.sweep_series ( args.start, args.end, args.step, args.sleep ) :
+				for line, timestamp in chunk :
+					yield None, line, timestamp
+		else :
+			for voltage in self._voltage_series ( keith_hv ) :
+				yield voltage, None, None
+
 	def run ( self ) :
 		args = self.args
 
-		fname = getDateTimeFilename ( )
-		output_csv = os.path.join ( str ( args.output_dir ), fname + u".csv" )
+		output_base = self._output_base ( getDateTimeFilename ( ) )
 		logger = logging.getLogger ( u'probestation.iv_measurement.IvMeasurementThread' )
 		logger.debug ( u" In iv_measurement.py:" )
 
 		try :
 			if args.devname_ardenv:
-				if not self._init_envsensor ( ):
+				if not self._init_envsensor ( output_base + u"_env.csv" ):
 					errormsg = u"Could not open environment sensor device."
 					self.error_signal.emit ( errormsg )
 					logger.error ( errormsg )
-					self.finished.emit ( os.path.join ( str ( args.output_dir ), fname ) )
+					self.finished.emit ( output_base )
 			
-			input_hv = keithley.KeithleyMeter ( args.devname_hv, args.serialenable )
-			if input_hv.identify ( ) .startswith ( u"KEITHLEY INSTRUMENTS INC.,MODEL 6517B" ) :
-				keith_hv = keithley.Keithley6517B ( args.devname_hv, args.serialenable )
-			elif input_hv.identify ( ) .startswith ( u"KEITHLEY INSTRUMENTS INC.,MODEL 2410" ) :
-				keith_hv = keithley.Keithley2410 ( args.devname_hv, args.serialenable )
-			else :
-				errormsg = u"Could not open devices."
+			keith_hv = drivers.open_device ( args.devname_hv, args.serialenable, keithley.KeithleySource, args.keepwarm )
+			if args.hwsweep and not isinstance ( keith_hv, keithley.Keithley2410 ) :
+				errormsg = u"Running the sweep on the instrument needs a Keithley 2410."
+				self.error_signal.emit ( errormsg )
+				logger.error ( errormsg )
+				self.finished.emit ( output_base )
+				return
+			if args.samples > 1 and not isinstance ( keith_hv, keithley.Keithley6517B ) :
+				errormsg = u"Buffered samples need a Keithley 6517B."
 				self.error_signal.emit ( errormsg )
 				logger.error ( errormsg )
-				self.finished.emit ( os.path.join ( str ( args.output_dir ), fname ) )
+				self.finished.emit ( output_base )
 				return
 			logger.info ( u"  Voltage source device introduced itself as {}" .format ( keith_hv.identify ( ) ) )
 			
 			if not args.devname_kei6485 is None and args.guardring :
-				keith6485 = keithley.Keithley6485 ( args.devname_kei6485, args.serialenable )
+				keith6485 = drivers.open_device ( args.devname_kei6485, args.serialenable, keithley.Keithley6485, args.keepwarm )
 				logger.info ( u"  Guard ring device introduced itself as {}" .format ( keith6485.identify ( ) ) )
 			else :
 				keith6485 = None
 				logger.info ( u"  Running without guard ring measurement" )
-		except VisaIOError :
+		except ( VisaIOError, IOError, ValueError ) :
 			errormsg = u"Could not open devices."
 			self.error_signal.emit ( errormsg )
 			logger.error ( errormsg )
-			self.finished.emit ( os.path.join ( str ( args.output_dir ), fname ) )
+			self.finished.emit ( output_base )
 			return
 
 		try :
 			logger.info ( u"Starting measurement" )
-			mode = 'w'
-			if sys.version_info.major < 3:
-				mode += 'b'
-
-			keith_hv.set_compliance ( args.compcurrent )
-
-			with open ( output_csv, mode ) as f :
-				if not keith6485 is None :
-					header = OrderedDict ( [ ( 'keihv_srcvoltage', None ), ( 'keihv_current', None ), ( 'kei6485_current', None ) ] )
+			with keith_hv.batch ( ) :
+				keith_hv.set_binary_transfer ( args.binary )
+				keith_hv.set_compliance ( args.compcurrent )
+				if isinstance ( keith_hv, keithley.Keithley6517B ) :
+					keith_hv.set_buffer_samples ( args.samples )
+				keith_hv.set_profile ( args.profile )
+				if args.samples > 1 :
+					current_hv = lambda reading : keith_hv.parse_iv_buffer ( reading, u"keihv" ) [u"keihv_current"]
+					read_hv = self._range_reader ( keith_hv, keith_hv.get_buffered_reading, current_hv )
 				else :
-					header = OrderedDict ( [ ( 'keihv_srcvoltage', None ), ( 'keihv_current', None ) ] )
-				if args.devname_ardenv:
-					header.update ( { 'envsensor1_temperature': None, 'envsensor1_dewpoint': None, 'envsensor2_temperature': None, 'envsensor2_dewpoint': None } )
-				writer = csv.DictWriter ( f, fieldnames = header, extrasaction = u"ignore" )
-				writer.writeheader ( )
-
-				for voltage in keith_hv.voltage_series ( args.start, args.end, args.step ) :
-					sleep ( args.sleep )
-					if self._exiting :
-						break
-						
-					line = keith_hv.get_reading ( )
-					meas = keith_hv.parse_iv ( line, u"keihv" )
+					current_hv = lambda reading : keith_hv.parse_iv ( reading, u"keihv" ) [u"keihv_current"]
+					read_hv = self._range_reader ( keith_hv, keith_hv.get_reading, current_hv )
+			keith_hv.set_ramp ( args.rampspeed, args.rampstep )
+			if not keith6485 is None :
+				with keith6485.batch ( ) :
+					keith6485.set_binary_transfer ( args.binary )
+					keith6485.set_profile ( args.profile )
+					read_6485 = self._range_reader ( keith6485, keith6485.get_reading, lambda reading : keith6485.parse_iv ( reading, u"kei6485" ) [u"kei6485_current"] )
+
+			if not keith6485 is None :
+				header = OrderedDict ( [ ( 'keihv_srcvoltage', None ), ( 'keihv_current', None ), ( 'kei6485_current', None ) ] )
+			else :
+				header = OrderedDict ( [ ( 'keihv_srcvoltage', None ), ( 'keihv_current', None ) ] )
+			if args.samples > 1 :
+				header['keihv_current_std'] = None
+				header['keihv_current_count'] = None
+			if args.devname_ardenv:
+				header.update ( { 'envsensor1_temperature': None, 'envsensor1_dewpoint': None, 'envsensor2_temperature': None, 'envsensor2_dewpoint': None } )
+			header['keihv_time'] = None
+			if not keith6485 is None :
+				header['kei6485_time'] = None
+			if args.devname_ardenv:
+				header['envsensor_time'] = None
+			compliance = False
+			with self._open_sink ( output_base, header, keihv = keith_hv, kei6485 = keith6485 ) as sink :
+				for voltage, line, timestamp in self._series ( keith_hv ) :
+					tasks = OrderedDict ( )
+					if line is None :
+						self._apply_profile ( keith_hv, keith6485 )
+						self._prepare_ranges ( )
+						self._settle ( lambda : current_hv ( read_hv ( ) ) )
+						if self._exiting :
+							break
+
+						tasks[u"keihv"] = read_hv
+					if not keith6485 is None :
+						tasks[u"kei6485"] = read_6485
+					readings, times = self._acquire ( tasks )
+					if line is not None :
+						times[u"keihv"] = timestamp
+
+					if line is None and args.samples > 1 :
+						meas = keith_hv.parse_iv_buffer ( readings[u"keihv"], u"keihv" )
+						if meas[u"keihv_srcvoltage"] is None :
+							meas[u"keihv_srcvoltage"] = voltage
+					else :
+						meas = keith_hv.parse_iv ( readings.get ( u"keihv", line ), u"keihv" )
 					if args.devname_ardenv:
-						env = self._measure_environment ( )
-						meas.update(env)
+						meas.update ( self._measure_environment ( times[u"keihv"] ) )
+					for name, timestamp in times.items ( ) :
+						meas[u"{}_time" .format ( name )] = timestamp
 					if ( not u"keihv_srcvoltage" in meas or not u"keihv_current" in meas or meas[u"keihv_srcvoltage"] is None or meas[u"keihv_current"] is None ) :
 						raise IOError ( u"Got invalid response from Keithley 6517B" )
 					if self._exiting :
 						break
 
 					if not keith6485 is None :
-						gr_line = keith6485.get_reading ( )
-						meas.update ( keith6485.parse_iv ( gr_line, u"kei6485" ) )
+						meas.update ( keith6485.parse_iv ( readings[u"kei6485"], u"kei6485" ) )
 						if ( not u"kei6485_current" in meas or meas[u"kei6485_current"] is None ) :
 							raise IOError ( u"Got invalid response from Keithley 6485" )
 						print ( u"VSrc = {: 10.4g} V; I = {: 10.4g} A; IGr = {: 10.4g} A" .format ( meas[u"keihv_srcvoltage"], meas[u"keihv_current"], meas[u"kei6485_current"] ) )
@@ -124,14 +169,19 @@ class IvMeasurementThread ( MeasurementThread ) :
 						#Instant turn off
 						keith_hv.set_output_state ( False )
 						self._exiting = True
+						compliance = True
 
-					writer.writerow ( meas )
+					self._feed_planner ( abs ( meas[u"keihv_current"] ), meas.get ( u"keihv_current_std" ) )
+					sink.write ( meas[u"keihv_srcvoltage"] if voltage is None else voltage, meas )
 					if args.guardring :
 						self.measurement_ready.emit ( ( meas[u"keihv_srcvoltage"], meas[u"keihv_current"], meas[u"kei6485_current"] ) )
 					else :
 						self.measurement_ready.emit ( ( meas[u"keihv_srcvoltage"], meas[u"keihv_current"] ) )
 					if self._exiting :
 						break
+				# Reaching compliance ends the run, the point is written first
+				if compliance or not self._exiting :
+					sink.finish ( )
 
 		except IOError as e :
 			errormsg = u"Error: {}" .format ( e )
@@ -141,6 +191,8 @@ class IvMeasurementThread ( MeasurementThread ) :
 			errormsg = u"Error during communication with devices."
 			self.error_signal.emit ( errormsg )
 			logger.error ( errormsg )
+			# Device state is unknown, configure from scratch next time
+			drivers.forget_devices ( )
 		finally :
 			logger.info ( u"Stopping measurement" )
 			try :
@@ -149,7 +201,7 @@ class IvMeasurementThread ( MeasurementThread ) :
 				logger.error ( u"Error during stopping. Trying turn off output" )
 				keith_hv.set_output_state ( False )
 
-		self.finished.emit ( os.path.join (  str ( args.output_dir ), fname ) )
+		self.finished.emit ( output_base )
 
 class IvMeasurementWindow ( MeasurementWindow ) :
 	def __init__ ( self, parent, args ) :
@@ -157,4 +209,5 @@ class IvMeasurementWindow ( MeasurementWindow ) :
 		super ( IvMeasurementWindow, self ) .__init__ ( parent, 2 if args.guardring else 1, args, thread )
 
 		self._ylabel = [u"Pad current in A", u"GR current in A"]
+		self._ycolumns = [u"keihv_current", u"kei6485_current"] [:self._num_plots]
 		self.setWindowTitle ( u"IV measurement" )
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import
+import os
+import io
+import glob
+import json
+import time
+import numpy as np
+
+EXTENSION = u".journal"
+
+class RunJournal ( object ) :
+	# Append-only record of a run, one JSON object per line: the run
+	# parameters first, then every completed point with its row of data, and
+	# a last line once the sweep is complete. Used like an output sink, so it
+	# can be written by output_sink.AsyncSinkWriter.
+	FLUSH_INTERVAL = 1.0
+
+	def __init__ ( self, path ) :
+		self.path = path
+		self._file = io.open ( path, 'ab+' )
+		# Terminate a line cut off by a crash before appending
+		if self._file.seek ( 0, io.SEEK_END ) > 0 :
+			self._file.seek ( -1, io.SEEK_END )
+			if self._file.read ( 1 ) != b"\n" :
+				self._file.write ( b"\n" )
+
+	def write ( self, record ) :
+		line = json.dumps ( record, default = _plain ) + u"\n"
+		self._file.write ( line.encode ( u"utf-8" ) )
+
+	def flush ( self ) :
+		self._file.flush ( )
+
+	def sync ( self ) :
+		self._file.flush ( )
+		os.fsync ( self._file.fileno ( ) )
+
+	def close ( self ) :
+		self._file.close ( )
+
+class JournaledOutput ( object ) :
+	# Writes each row to the output sink, the series store of the run and,
+	# with the voltage of the point, to the journal
+	def __init__ ( self, sink, journal, store ) :
+		self.path = sink.path
+		self._sink = sink
+		self._journal = journal
+		self._store = store
+
+	def write ( self, voltage, row ) :
+		self._sink.write ( row )
+		self._store.append ( row )
+		self._journal.write ( point_record ( voltage, row ) )
+
+	def finish ( self ) :
+		self._journal.write ( finished_record ( ) )
+
+	def close ( self ) :
+		try :
+			self._sink.close ( )
+		finally :
+			self._journal.close ( )
+
+	def __enter__ ( self ) :
+		return self
+
+	def __exit__ ( self, *exc ) :
+		self.close ( )
+
+def journal_path ( output_base ) :
+	return output_base + EXTENSION
+
+def start_record ( output_base, args ) :
+	return { u"event": u"start", u"time": time.time ( ), u"output": output_base, u"args": args._asdict ( ) }
+
+def point_record ( voltage, row ) :
+	return { u"event": u"point", u"voltage": voltage, u"row": row }
+
+def resume_record ( voltage ) :
+	return { u"event": u"resume", u"time": time.time ( ), u"voltage": voltage }
+
+def finished_record ( ) :
+	return { u"event": u"finished", u"time": time.time ( ) }
+
+def load_journal ( path ) :
+	# Returns the output base path, the run parameters as dict, the list of
+	# ( voltage, row ) of the completed points and whether the run finished
+	output = args = None
+	points = []
+	finished = False
+	with io.open ( path, 'rb' ) as f :
+		for line in f :
+			try :
+				record = json.loads ( line.decode ( u"utf-8" ) )
+			except ValueError :
+				# Line cut off by a crash while writing
+				continue
+			if record[u"event"] == u"start" :
+				output = record[u"output"]
+				args = record[u"args"]
+			elif record[u"event"] == u"point" :
+				points.append ( ( record[u"voltage"], record[u"row"] ) )
+			elif record[u"event"] == u"finished" :
+				finished = True
+	if args is None :
+		raise ValueError ( u"No run parameters in journal {}" .format ( path ) )
+	return output, args, points, finished
+
+def find_unfinished ( directory ) :
+	# Journal of the latest run in directory that did not finish, or None
+	for path in sorted ( glob.glob ( os.path.join ( directory, u"*" + EXTENSION ) ), key = os.path.getmtime, reverse = True ) :
+		try :
+			if not load_journal ( path ) [3] :
+				return path
+		except ( IOError, ValueError ) :
+			continue
+	return None
+
+def _plain ( obj ) :
+	# numpy scalars as their python value, arrays as lists
+	if isinstance ( obj, ( np.generic, np.ndarray ) ) :
+		return obj.tolist ( )
+	return str ( obj )
@@ -6,64 +6,193 @@ import time
 import numpy as np
 from visa_probestation_dev import VisaProbestationDev
 
-class KeithleyMeter ( VisaProbestationDev ) :
-	def __init__ ( self, resource_name, useserial ) :
-		super ( KeithleyMeter, self ).__init__ ( resource_name, useserial )
+def ramp_steps ( start_volt, end_volt, absstep_volt ) :
+	# Intermediate voltages from start to end, excluding start and including end
+	steps = []
+	volts = start_volt
+	while abs ( end_volt - volts ) > abs ( absstep_volt ) :
+		if volts < end_volt :
+			volts = volts + abs ( absstep_volt )
+		else :
+			volts = volts - abs ( absstep_volt )
+		steps.append ( volts )
+	steps.append ( end_volt )
+	return steps
 
-		self._write ( "*RST" )
-		
-	def identify ( self ) :
-		return self._query ( "*IDN?" ) .strip ( )
+def voltage_steps ( start_volt, end_volt, absstep_volt ) :
+	if end_volt < start_volt:
+		step_mvolt = int ( -abs ( absstep_volt ) * 1000 )
+	else:
+		step_mvolt = int ( abs ( absstep_volt ) * 1000 )
+	start_mvolt = int ( start_volt * 1000 )
+	end_mvolt = int ( end_volt * 1000 ) + ( step_mvolt // abs ( step_mvolt ) )
 
-	def get_reading ( self ) :
-		return self._query ( "READ?" ) .strip ( )
+	return [ mvolt / 1000 for mvolt in range ( start_mvolt, end_mvolt, step_mvolt ) ]
 
-class Keithley6517B ( KeithleyMeter ) :
-	def __init__ ( self, resource_name, useserial ) :
-		super ( Keithley6517B, self ) .__init__ ( resource_name, useserial )
+# Reading returned by the Keithley devices on overflow
+OVERFLOW = 9.9e37
 
-		self._write ( ":SYSTEM:ZCHECK OFF" )
-
-		self._write ( ":OUTPUT1:STATE OFF" )
-		self._write ( ":SOURCE:VOLTAGE:RANGE 100" )
-		self._1000_range = False
+class KeithleyMeter ( VisaProbestationDev ) :
+	# Averaging filter count of the normal profile, 1 is off
+	DEFAULT_AVERAGE = 1
+	# Upper limits of the current measurement ranges in A
+	CURRENT_RANGES = []
+	SENSE_CURRENT = ":SENSE:CURRENT"
+
+	def __init__ ( self, resource_name, useserial, idn = None ) :
+		super ( KeithleyMeter, self ).__init__ ( resource_name, useserial, idn = idn )
+
+		self.reset ( )
+
+	def set_current_function ( self ) :
+		self._write_setting ( "function", ":SENSE:FUNCTION 'CURRENT:DC'" )
+
+	def set_nplc ( self, nplc ) :
+		# None selects the default integration time
+		if nplc is None :
+			nplc = "DEFAULT"
+		self._write_setting ( "nplc", "{}:NPLCYCLES {}" .format ( self.SENSE_CURRENT, nplc ) )
+
+	def set_current_range ( self, amps ) :
+		# Fixes the smallest range measuring amps, autorange for None or
+		# currents beyond the largest range. Returns the upper limit of the
+		# range or None for autorange.
+		ranges = [ upper for upper in self.CURRENT_RANGES if upper >= abs ( amps ) ] if amps is not None else []
+		if not ranges :
+			self._write_setting ( "current_range", "{}:RANGE:AUTO ON" .format ( self.SENSE_CURRENT ) )
+			return None
+		self._write_setting ( "current_range", "{}:RANGE {}" .format ( self.SENSE_CURRENT, ranges[0] ) )
+		return ranges[0]
+
+	def set_average ( self, count ) :
+		# Averaging filter over count readings, off for a count of 1
+		if count > 1 :
+			self._write_setting ( "average", ":SENSE:AVERAGE:COUNT {}; STATE ON" .format ( count ) )
+		else :
+			self._write_setting ( "average", ":SENSE:AVERAGE:STATE OFF" )
 
-		self._write ( ":SENSE:FUNCTION 'CURRENT:DC'" )
+	def set_profile ( self, profile ) :
+		self.set_nplc ( profile.nplc )
+		self.set_average ( self.DEFAULT_AVERAGE if profile.average is None else profile.average )
 
-		self._write ( ":SENSE:CURRENT:DC:NPLCYCLES 1; AVERAGE:COUNT 5; STATE OFF" )
-		self._write ( ":FORMAT:ELEMENTS READING,UNITS,VSOURCE" )
+	def get_reading ( self ) :
+		if self._binary :
+			return self._query_binary_values ( "READ?" )
+		return self._query ( "READ?" ) .strip ( )
 
-	# FIXME
-	def set_compliance ( self, compliance ) :
-		#self._write ( ":SENSE:CURRENT:PROT {}" .format ( compliance ) )
-		print ( u"Hardware compliance not implemented yet!" )
+class KeithleySource ( KeithleyMeter ) :
+	# Default ramp speed in V/s and voltage step of the ramp in V
+	RAMP_SPEED = 100
+	RAMP_STEP = 10
+	# Allowed difference between setpoint and readback after a ramp in V
+	RAMP_TOLERANCE = 0.1
+
+	def __init__ ( self, resource_name, useserial, idn = None ) :
+		super ( KeithleySource, self ) .__init__ ( resource_name, useserial, idn = idn )
+
+		# Source voltage as commanded, *RST sets it to 0
+		self._setpoint = 0.0
+		self._ramp_speed = self.RAMP_SPEED
+		self._ramp_step = self.RAMP_STEP
+
+	def set_ramp ( self, speed = None, step = None ) :
+		if speed is not None :
+			if not speed > 0 :
+				raise ValueError ( "Ramp speed must be positive: {}" .format ( speed ) )
+			self._ramp_speed = speed
+		if step is not None :
+			if not step > 0 :
+				raise ValueError ( "Ramp step must be positive: {}" .format ( step ) )
+			self._ramp_step = step
+
+	def get_setpoint ( self ) :
+		return self._setpoint
 
 	def voltage_series ( self, start_volt, end_volt, absstep_volt ) :
+		return self.ramp_series ( voltage_steps ( start_volt, end_volt, absstep_volt ) )
+
+	def ramp_series ( self, volts ) :
+		# Ramps to each voltage of the iterable in turn, which may be
+		# computed while the series is running.
 		if self.get_source_voltage ( ) != 0 :
 			self.set_source_voltage ( 0 )
 		self.set_output_state ( True )
 
-		if end_volt < start_volt:
-			step_mvolt = int ( -abs ( absstep_volt ) * 1000 )
-		else:
-			step_mvolt = int ( abs ( absstep_volt ) * 1000 )
-		start_mvolt = int ( start_volt * 1000 )
-		end_mvolt = int ( end_volt * 1000 ) + ( step_mvolt // abs ( step_mvolt ) )
-
-		for mvolt in range ( start_mvolt, end_mvolt, step_mvolt ) :
-			self.set_source_voltage_cont ( mvolt / 1000 )
-			yield self.get_source_voltage ( )
+		for U in volts :
+			yield self.set_source_voltage_cont ( U )
 
 	def stop_measurement ( self ) :
 		self.set_source_voltage_cont ( 0 )
 		self.set_output_state ( False )
 
+	def set_source_voltage_cont ( self, target, speed = None ) :
+		# Ramps to target using the locally tracked setpoint and only reads
+		# the source voltage back once at the end.
+		if speed is None :
+			speed = self._ramp_speed
+		if abs ( target - self._setpoint ) > self._ramp_step :
+			self._ramp ( ramp_steps ( self._setpoint, target, self._ramp_step ) [:-1], self._ramp_step / speed )
+		self.set_source_voltage ( target )
+
+		volts = self.get_source_voltage ( )
+		if abs ( volts - target ) > self.RAMP_TOLERANCE :
+			raise IOError ( u"Source voltage is {} V after ramping to {} V" .format ( volts, target ) )
+		return volts
+
+	def _ramp ( self, volts, interval ) :
+		for U in volts :
+			self.set_source_voltage ( U )
+			time.sleep ( interval )
+
+class Keithley6517B ( KeithleySource ) :
+	# Reading buffer size of the 6517B
+	BUFFER_MAX_POINTS = 10000
+	# Upper estimate of the time per buffered reading in s
+	BUFFER_SAMPLE_TIME = 0.1
+	CURRENT_RANGES = [ 2e-11, 2e-10, 2e-9, 2e-8, 2e-7, 2e-6, 2e-5, 2e-4, 2e-3, 2e-2 ]
+	SENSE_CURRENT = ":SENSE:CURRENT:DC"
+
+	def __init__ ( self, resource_name, useserial, idn = None ) :
+		super ( Keithley6517B, self ) .__init__ ( resource_name, useserial, idn = idn )
+
+		with self.batch ( ) :
+			self._write ( ":SYSTEM:ZCHECK OFF" )
+
+			self.set_output_state ( False )
+			self.set_1000_range ( False )
+
+			self.set_current_function ( )
+			self.set_current_range ( None )
+
+			self.set_nplc ( None )
+			self.set_average ( self.DEFAULT_AVERAGE )
+			self._write ( ":FORMAT:ELEMENTS READING,UNITS,VSOURCE" )
+			self._buffer_samples = 1
+
+	def set_binary_transfer ( self, state ) :
+		if state :
+			self._write_setting ( "format", ":FORMAT:DATA SREAL; BORDER NORMAL; ELEMENTS READING,VSOURCE" )
+		else :
+			self._write_setting ( "format", ":FORMAT:DATA ASCII; ELEMENTS READING,UNITS,VSOURCE" )
+		self._binary = state
+
+	def set_average ( self, count ) :
+		if count > 1 :
+			self._write_setting ( "average", ":SENSE:CURRENT:DC:AVERAGE:COUNT {}; STATE ON" .format ( count ) )
+		else :
+			self._write_setting ( "average", ":SENSE:CURRENT:DC:AVERAGE:STATE OFF" )
+
+	# FIXME
+	def set_compliance ( self, compliance ) :
+		#self._write ( ":SENSE:CURRENT:PROT {}" .format ( compliance ) )
+		print ( u"Hardware compliance not implemented yet!" )
+
 	def set_1000_range ( self, state ) :
 		if not state :
-			self._write ( ":SOURCE:VOLTAGE:RANGE 100" )
+			self._write_setting ( "source_range", ":SOURCE:VOLTAGE:RANGE 100" )
 			self._1000_range = False
 		else:
-			self._write( ":SOURCE:VOLTAGE:RANGE 1000" )
+			self._write_setting ( "source_range", ":SOURCE:VOLTAGE:RANGE 1000" )
 			self._1000_range = True
 
 	def is_1000_range ( self ) :
@@ -77,38 +206,90 @@ class Keithley6517B ( KeithleyMeter ) :
 		if not -1000 <= volts <= 1000 :
 			raise ValueError ( "Voltage level out of range [-1000;1000]: {}" .format ( volts ) )
 
-		if abs ( volts ) > 100 and not self.is_1000_range ( ) :
-			self.set_1000_range ( True )
-		elif abs ( volts ) < 100 and self.is_1000_range ( ) :
-			self.set_1000_range ( False )
+		if abs ( volts ) != 100 :
+			self.set_1000_range ( abs ( volts ) > 100 )
 
 		logger.debug ( u"Setting source voltage to {:.2f} V" .format ( volts ) )
 		self._write ( ":SOURCE:VOLTAGE {}" .format ( volts ) )
+		self._setpoint = volts
 
 	def set_output_state ( self, state ) :
 		if state :
-			self._write ( ":OUTPUT1:STATE ON" )
+			self._write_setting ( "output", ":OUTPUT1:STATE ON" )
 		else :
+			# Turning off is always sent, whatever the device is assumed to be in
 			self._write ( ":OUTPUT1:STATE OFF" )
+			self._settings["output"] = ":OUTPUT1:STATE OFF"
+
 
-	def set_source_voltage_cont ( self, target, speed = 100 ) :
-		interval = 0.1
-		step = interval * speed
-		U = self.get_source_voltage ( )
-		while abs ( U - target ) > abs ( step ) :
-			if U < target :
-				U = min ( U + step, target )
+	def set_buffer_samples ( self, count ) :
+		if not 1 <= count <= self.BUFFER_MAX_POINTS :
+			raise ValueError ( "Buffer sample count out of range [1;{}]: {}" .format ( self.BUFFER_MAX_POINTS, count ) )
+
+		with self.batch ( ) :
+			if count == 1 :
+				# Back to single readings as after *RST
+				self._write_setting ( "buffer", ":TRACE:CLEAR; FEED NONE" )
 			else :
-				U = max ( U - step, target )
-			self.set_source_voltage ( U )
-			time.sleep ( interval / 2 )
-			U = self.get_source_voltage ( )
-			time.sleep ( interval / 2 )
-		self.set_source_voltage ( target )
+				self._write_setting ( "buffer", ":TRACE:CLEAR; POINTS {}; ELEMENTS VSOURCE; FEED SENSE" .format ( count ) )
+			# The trigger count is only raised while filling the buffer, so
+			# READ? stays a single reading
+			self._write_setting ( "trigger", ":TRIGGER:SOURCE IMMEDIATE; COUNT 1" )
+		self._buffer_samples = count
+
+	def get_buffered_reading ( self ) :
+		# Fills the reading buffer at instrument speed and fetches it with
+		# a single query.
+		timeout = self._get_timeout ( )
+		self._set_timeout ( timeout + 1000 * self._buffer_samples * self.BUFFER_SAMPLE_TIME )
+		try :
+			self._query ( ":TRACE:CLEAR; FEED:CONTROL NEXT; :TRIGGER:COUNT {}; :INITIATE; *OPC?" .format ( self._buffer_samples ) )
+		except :
+			# Unknown whether the trigger count is back at 1
+			self.invalidate_settings ( )
+			raise
+		finally :
+			self._set_timeout ( timeout )
+		if self._binary :
+			return self._query_binary_values ( ":TRIGGER:COUNT 1; :TRACE:DATA?" )
+		return self._query ( ":TRIGGER:COUNT 1; :TRACE:DATA?" ) .strip ( )
+
+	def parse_iv_buffer ( self, line, devname ) :
+		series = self.parse_iv_series ( line, devname )
+		voltages = series["{}_srcvoltage" .format ( devname )]
+		currents = series["{}_current" .format ( devname )]
+		ret = { "{}_srcvoltage" .format ( devname ) : np.mean ( voltages ) if len ( voltages ) else None,
+				"{}_current" .format ( devname ) : np.mean ( currents ) if len ( currents ) else None,
+				"{}_current_std" .format ( devname ) : np.std ( currents ) if len ( currents ) else None,
+				"{}_current_count" .format ( devname ) : len ( currents ) }
+		return ret
+
+	def parse_iv_series ( self, line, devname ) :
+		# The single readings of the buffer, as arrays
+		if isinstance ( line, np.ndarray ) :
+			# Binary transfer, pairs of reading and source voltage
+			values = line.reshape ( -1, 2 )
+			currents = values[:, 0]
+			voltages = values[:, 1]
+		else :
+			voltages = []
+			currents = []
+			for field in line.split ( "," ) :
+				if field[-3:] == "ADC" :
+					currents.append ( float ( field[:-3] ) )
+				elif field[-1:] == "A" :
+					currents.append ( float ( field[:-1] ) )
+				elif field[-4:] == "Vsrc" :
+					voltages.append ( float ( field[:-4] ) )
+			currents = np.array ( currents )
+			voltages = np.array ( voltages )
+		return { "{}_srcvoltage" .format ( devname ) : voltages, "{}_current" .format ( devname ) : currents }
 
 	def parse_iv ( self, line, devname ) :
 		voltage = current = None
 		print ( u"read %s", line )
+		if isinstance ( line, np.ndarray ) :
+			return { "{}_srcvoltage".format ( devname ) : line[1], "{}_current" .format ( devname ) : line[0] }
 		for field in line.split ( "," ) :
 			if field[-3:] == "ADC" :
 				current = float ( field[:-3] )
@@ -118,15 +299,24 @@ class Keithley6517B ( KeithleyMeter ) :
 				voltage = float ( field[:-4] )
 		return { "{}_srcvoltage".format ( devname ) : voltage, "{}_current" .format ( devname ) : current }
 
-class Keithley2410 ( KeithleyMeter ) :
-	def __init__ ( self, resource_name, useserial ) :
-		super ( Keithley2410, self ) .__init__ ( resource_name, useserial )
+class Keithley2410 ( KeithleySource ) :
+	# Source list length limit of the 2400 series
+	LIST_MAX_POINTS = 100
+	# Estimated time per list point on top of the source delay in s
+	LIST_POINT_OVERHEAD = 0.05
+	# Integration time of the reading taken at each point of a ramp in PLC
+	RAMP_NPLC = 0.01
+	CURRENT_RANGES = [ 1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1 ]
 
-		self._write ( ":OUTPUT1:STATE OFF" )
-		self._write ( ":SOURCE:VOLTAGE:RANGE 100" )
-		self._1000_range = False
+	def __init__ ( self, resource_name, useserial, idn = None ) :
+		super ( Keithley2410, self ) .__init__ ( resource_name, useserial, idn = idn )
+
+		with self.batch ( ) :
+			self.set_output_state ( False )
+			self.set_1000_range ( False )
 
-		self._write ( ":SENSE:FUNCTION 'CURRENT:DC'" )
+			self.set_current_function ( )
+			self.set_current_range ( None )
 		# only 6517b
 		#self._write ( ":SENSE:CURRENT:DC:NPLCYCLES 1; AVERAGE:COUNT 5; STATE ON" )
 		#self._write ( ":FORMAT:ELEMENTS READING,UNITS,VSOURCE" )
@@ -143,35 +333,124 @@ class Keithley2410 ( KeithleyMeter ) :
 		#print ("Setting initial voltage to 0")
 		#self._write(":SOUR:VOLT:LEV 0")
 
+	def set_binary_transfer ( self, state ) :
+		if state :
+			self._write_setting ( "format", ":FORMAT:DATA SREAL; BORDER NORMAL; ELEMENTS VOLTAGE,CURRENT" )
+		else :
+			self._write_setting ( "format", ":FORMAT:DATA ASCII" )
+		self._binary = state
+
 	def set_compliance ( self, compliance ) :
-		self._write ( ":SENSE:CURRENT:PROT {}" .format ( compliance ) )
+		self._write_setting ( "compliance", ":SENSE:CURRENT:PROT {}" .format ( compliance ) )
+
+	def sweep_series ( self, start_volt, end_volt, absstep_volt, delay, max_chunk_time = 5 ) :
+		# Runs the sweep on the instrument in source list mode and fetches
+		# the readings in bulk. Yields one list of ( reading, time ) per
+		# chunk, the chunks being short enough to check compliance and abort
+		# in between. The times come from the instrument timer, which is
+		# reset when the chunk starts.
+		logger = logging.getLogger ( u'probestation.keithley.Keithley2410' )
+		volts = voltage_steps ( start_volt, end_volt, absstep_volt )
 
-	def voltage_series ( self, start_volt, end_volt, absstep_volt ) :
 		if self.get_source_voltage ( ) != 0 :
 			self.set_source_voltage ( 0 )
 		self.set_output_state ( True )
-
-		if end_volt < start_volt:
-			step_mvolt = int ( -abs ( absstep_volt ) * 1000 )
-		else:
-			step_mvolt = int ( abs ( absstep_volt ) * 1000 )
-		start_mvolt = int ( start_volt * 1000 )
-		end_mvolt = int ( end_volt * 1000 ) + ( step_mvolt // abs ( step_mvolt ) )
-
-		for mvolt in range ( start_mvolt, end_mvolt, step_mvolt ) :
-			self.set_source_voltage_cont ( mvolt / 1000 )
-			yield self.get_source_voltage ( )
-
-	def stop_measurement ( self ) :
-		self.set_source_voltage_cont ( 0 )
-		self.set_output_state ( False )
+		self.set_source_voltage_cont ( volts[0] )
+		last_volt = volts[0]
+
+		chunk_size = int ( max_chunk_time / ( delay + self.LIST_POINT_OVERHEAD ) )
+		chunk_size = max ( 1, min ( self.LIST_MAX_POINTS, chunk_size ) )
+		logger.debug ( u"Running {} point sweep in chunks of {}" .format ( len ( volts ), chunk_size ) )
+
+		self._write_setting ( "elements", ":FORMAT:ELEMENTS VOLTAGE,CURRENT,TIME" )
+		self._write_setting ( "source_delay", ":SOURCE:DELAY {}" .format ( delay ) )
+		timeout = self._get_timeout ( )
+		try :
+			for i in range ( 0, len ( volts ), chunk_size ) :
+				chunk = volts[i:i + chunk_size]
+				with self.batch ( ) :
+					self.set_1000_range ( max ( abs ( volt ) for volt in chunk ) > 100 )
+					self._write ( ":SOURCE:LIST:VOLTAGE {}" .format ( ",".join ( "{:.3f}" .format ( volt ) for volt in chunk ) ) )
+					self._write ( ":SOURCE:VOLTAGE:MODE LIST" )
+					self._write ( ":TRIGGER:COUNT {}" .format ( len ( chunk ) ) )
+					self._write ( ":SYSTEM:TIME:RESET" )
+					self._set_timeout ( timeout + 1000 * len ( chunk ) * ( delay + self.LIST_POINT_OVERHEAD ) )
+					start = time.time ( )
+					if self._binary :
+						values = self._query_binary_values ( ":READ?" )
+					else :
+						values = np.array ( self._query_ascii_values ( ":READ?" ) )
+				self._set_timeout ( timeout )
+				last_volt = chunk[-1]
+				values = values.reshape ( -1, 3 )
+				if self._binary :
+					yield [ ( value[:2], start + value[2] ) for value in values ]
+				else :
+					yield [ ( "{},{}" .format ( value[0], value[1] ), start + value[2] ) for value in values ]
+		finally :
+			# Keep the output at the last list voltage when going back to
+			# fixed mode, stop_measurement ramps down from there.
+			self._set_timeout ( timeout )
+			with self.batch ( ) :
+				self._write ( ":TRIGGER:COUNT 1" )
+				self._write ( ":SOURCE:VOLTAGE:LEVEL {}" .format ( last_volt ) )
+				self._write ( ":SOURCE:VOLTAGE:MODE FIXED" )
+				self._write_setting ( "source_delay", ":SOURCE:DELAY:AUTO ON" )
+				self._write_setting ( "elements", ":FORMAT:ELEMENTS VOLTAGE,CURRENT" )
+			self._setpoint = last_volt
+
+	def _ramp ( self, volts, interval ) :
+		# Uses the source list with the step interval as source delay
+		# instead of stepping from the host. :INITIATE turns the output on,
+		# so with the output off the host sets the steps.
+		if not self._output :
+			super ( Keithley2410, self ) ._ramp ( volts, interval )
+			return
+
+		# Every list point takes a reading, made as short as possible so the
+		# ramp keeps its speed. The settings are restored afterwards.
+		nplc = self._settings.get ( "nplc" )
+		average = self._settings.get ( "average" )
+		with self.batch ( ) :
+			self.set_nplc ( self.RAMP_NPLC )
+			self.set_average ( 1 )
+			self._write_setting ( "source_delay", ":SOURCE:DELAY {}" .format ( interval ) )
+		timeout = self._get_timeout ( )
+		try :
+			for i in range ( 0, len ( volts ), self.LIST_MAX_POINTS ) :
+				chunk = volts[i:i + self.LIST_MAX_POINTS]
+				with self.batch ( ) :
+					self.set_1000_range ( max ( abs ( volt ) for volt in chunk + [ self._setpoint ] ) > 100 )
+					self._write ( ":SOURCE:LIST:VOLTAGE {}" .format ( ",".join ( "{:.3f}" .format ( volt ) for volt in chunk ) ) )
+					self._write ( ":SOURCE:VOLTAGE:MODE LIST" )
+					self._write ( ":TRIGGER:COUNT {}" .format ( len ( chunk ) ) )
+					self._set_timeout ( timeout + 1000 * len ( chunk ) * ( interval + self.LIST_POINT_OVERHEAD ) )
+					self._query ( ":INITIATE; *OPC?" )
+				self._set_timeout ( timeout )
+				self._write ( ":SOURCE:VOLTAGE:LEVEL {}" .format ( chunk[-1] ) )
+				self._write ( ":SOURCE:VOLTAGE:MODE FIXED" )
+				self._setpoint = chunk[-1]
+		finally :
+			self._set_timeout ( timeout )
+			with self.batch ( ) :
+				self._write ( ":TRIGGER:COUNT 1" )
+				self._write ( ":SOURCE:VOLTAGE:MODE FIXED" )
+				self._write_setting ( "source_delay", ":SOURCE:DELAY:AUTO ON" )
+				if nplc is None :
+					self.set_nplc ( None )
+				else :
+					self._write_setting ( "nplc", nplc )
+				if average is None :
+					self.set_average ( self.DEFAULT_AVERAGE )
+				else :
+					self._write_setting ( "average", average )
 
 	def set_1000_range ( self, state ) :
 		if not state :
-			self._write ( ":SOURCE:VOLTAGE:RANGE 100" )
+			self._write_setting ( "source_range", ":SOURCE:VOLTAGE:RANGE 100" )
 			self._1000_range = False
 		else:
-			self._write ( ":SOURCE:VOLTAGE:RANGE 1000" )
+			self._write_setting ( "source_range", ":SOURCE:VOLTAGE:RANGE 1000" )
 			self._1000_range = True
 
 	def is_1000_range ( self ) :
@@ -185,53 +464,59 @@ class Keithley2410 ( KeithleyMeter ) :
 		if not -1000 <= volts <= 1000 :
 			raise ValueError ( "Voltage level out of range [-1000;1000]: {}" .format ( volts ) )
 
-		if abs ( volts ) > 100 and not self.is_1000_range ( ) :
-			self.set_1000_range ( True )
-		elif abs ( volts ) < 100 and self.is_1000_range ( ) :
-			self.set_1000_range ( False )
+		if abs ( volts ) != 100 :
+			self.set_1000_range ( abs ( volts ) > 100 )
 
 		logger.debug ( u"Setting source voltage to {:.2f} V" .format ( volts ) )
 		self._write ( "SOUR:VOLT:LEV {}" .format ( volts ) )
+		self._setpoint = volts
 
 	def set_output_state ( self, state ) :
 		if state :
-			self._write ( ":OUTPUT1:STATE ON" )
+			self._write_setting ( "output", ":OUTPUT1:STATE ON" )
 		else :
+			# Turning off is always sent, whatever the device is assumed to be in
 			self._write ( ":OUTPUT1:STATE OFF" )
+			self._settings["output"] = ":OUTPUT1:STATE OFF"
+		self._output = state
 
-	def set_source_voltage_cont ( self, target, speed = 100 ) :
-		interval = 0.1
-		step = interval * speed
-		U = self.get_source_voltage ( )
-		while abs ( U - target ) > abs ( step ) :
-			if U < target :
-				U = min ( U + step, target )
-			else :
-				U = max ( U - step, target )
-			self.set_source_voltage ( U )
-			time.sleep ( interval / 2 )
-			U = self.get_source_voltage ( )
-			time.sleep ( interval / 2 )
-		self.set_source_voltage ( target )
 
 	def parse_iv ( self, line, devname ) :
 		voltage = current = None
-		voltage = float(line.split(",",2)[0])
-		current = float(line.split(",",2)[1])
+		if isinstance ( line, np.ndarray ) :
+			voltage = line[0]
+			current = line[1]
+		else :
+			voltage = float(line.split(",",2)[0])
+			current = float(line.split(",",2)[1])
 		return { "{}_srcvoltage".format ( devname ) : voltage, "{}_current" .format ( devname ) : current }
 
 class Keithley6485 ( KeithleyMeter ) :
-	def __init__ ( self, resource_name, useserial ) :
-		super ( Keithley6485, self ) .__init__ ( resource_name, useserial )
+	DEFAULT_AVERAGE = 5
+	CURRENT_RANGES = [ 2e-9, 2e-8, 2e-7, 2e-6, 2e-5, 2e-4, 2e-3, 2e-2 ]
+
+	def __init__ ( self, resource_name, useserial, idn = None ) :
+		super ( Keithley6485, self ) .__init__ ( resource_name, useserial, idn = idn )
 		
-		self._write ( ":SYSTEM:ZCHECK OFF" )
+		with self.batch ( ) :
+			self._write ( ":SYSTEM:ZCHECK OFF" )
+
+			self.set_current_function ( )
+			self.set_current_range ( None )
+			self._write ( ":FORMAT:ELEMENTS READING,UNITS" )
+			self.set_average ( self.DEFAULT_AVERAGE )
 
-		self._write ( ":SENSE:FUNCTION 'CURRENT:DC'" )
-		self._write ( ":FORMAT:ELEMENTS READING,UNITS" )
-		self._write ( ":SENSE:AVERAGE:COUNT 5; STATE ON" )
+	def set_binary_transfer ( self, state ) :
+		if state :
+			self._write_setting ( "format", ":FORMAT:DATA SREAL; BORDER NORMAL; ELEMENTS READING" )
+		else :
+			self._write_setting ( "format", ":FORMAT:DATA ASCII; ELEMENTS READING,UNITS" )
+		self._binary = state
 
 	def parse_iv ( self, line, devname ) :
 		voltage = current = None
+		if isinstance ( line, np.ndarray ) :
+			return { "{}_srcvoltage".format ( devname ) : voltage, "{}_current" .format ( devname ) : line[0] }
 		for field in line.split ( "," ) :
 			if field[-3:] == "ADC" :
 				current = float ( field[:-3] )
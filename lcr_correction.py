@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import
+import logging
+import datetime
+import time
+from io import open
+import json
+import os
+
+# Open/short corrections held by the LCR meters, keyed by correction_key
+DEFAULT_CACHE_FILE = os.path.join ( os.path.expanduser ( u"~" ), u".probestation_corrections.json" )
+
+def correction_key ( fixture, idn, freqs ) :
+	return u"{}|{}|{}" .format ( fixture, idn.strip ( ), u"," .join ( repr ( float ( freq ) ) for freq in freqs ) )
+
+class CorrectionCache ( object ) :
+	# Corrections measured for a fixture on an instrument at a set of
+	# frequencies, reused until they are MAX_AGE seconds old. The instrument
+	# keeps the data of its last correction only, so that is the only one
+	# of each instrument in the cache.
+	MAX_AGE = 7 * 24 * 3600
+
+	def __init__ ( self, cache_file = DEFAULT_CACHE_FILE ) :
+		self.logger = logging.getLogger ( u'probestation.lcr_correction.CorrectionCache' )
+		self.cache_file = cache_file
+		self.corrections = { }
+		self._load_cache ( )
+
+	def get ( self, fixture, idn, freqs ) :
+		# The stored correction, or None if there is none or it is too old
+		correction = self.corrections.get ( correction_key ( fixture, idn, freqs ) )
+		if correction is None :
+			return None
+		if time.time ( ) - correction[u"time"] > self.MAX_AGE :
+			self.logger.debug ( u"Correction for %s from %s is outdated", fixture, correction[u"date"] )
+			return None
+		return correction
+
+	def put ( self, fixture, idn, freqs ) :
+		key = correction_key ( fixture, idn, freqs )
+		now = time.time ( )
+		self._remove ( idn )
+		correction = { u"key": key,
+					   u"fixture": fixture,
+					   u"idn": idn.strip ( ),
+					   u"frequencies": list ( freqs ),
+					   u"time": now,
+					   u"date": datetime.datetime.fromtimestamp ( now ) .isoformat ( ) }
+		self.corrections[key] = correction
+		self._save_cache ( )
+		return correction
+
+	def forget ( self, idn ) :
+		# Drops the correction of an instrument, whose data is overwritten
+		# by a new correction measurement
+		if self._remove ( idn ) :
+			self._save_cache ( )
+
+	def _remove ( self, idn ) :
+		keys = [ key for key, correction in self.corrections.items ( ) if correction[u"idn"] == idn.strip ( ) ]
+		for key in keys :
+			del self.corrections[key]
+		return len ( keys ) > 0
+
+	def _load_cache ( self ) :
+		try :
+			with open ( self.cache_file, u"r" ) as f :
+				corrections = json.load ( f )
+		except ( IOError, OSError, ValueError ) :
+			return False
+		if not isinstance ( corrections, dict ) :
+			return False
+		self.corrections = corrections
+		return True
+
+	def _save_cache ( self ) :
+		try :
+			with open ( self.cache_file, u"w" ) as f :
+				json.dump ( self.corrections, f, indent = 1, sort_keys = True )
+		except ( IOError, OSError ) :
+			self.logger.warning ( u"Could not write correction cache %s", self.cache_file )
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+
+from __future__ import with_statement
+from __future__ import division
+from __future__ import absolute_import
+import logging
+from measurement_window import MeasurementThread, MeasurementWindow
+from series_store import SeriesStore
+import keithley
+import drivers
+import output_sink
+
+try:
+    from PyQt5 import QtWidgets as QtW
+    from PyQt5 import QtCore
+except ImportError as e :
+    from PyQt4 import QtGui as QtW
+    from PyQt4 import QtCore
+
+import time
+import datetime
+import numpy as np
+from time import sleep
+from pyvisa.errors import VisaIOError, InvalidBinaryFormat
+from collections import OrderedDict
+
+def getDateTimeFilename ( ) :
+	s = datetime.datetime.now ( ) .isoformat ( )
+	s = s.replace ( u":", u"_" )
+	s = s.replace ( u".", u"_" )
+	return s
+
+class LongtermMeasurementThread ( MeasurementThread ) :
+	# Holds the bias voltage for args.duration seconds and reads the currents
+	# every args.interval seconds, or as fast as the devices allow with 0.
+	# The window only shows the last DISPLAY_POINTS points, the output file
+	# gets all of them.
+	DISPLAY_POINTS = 100000
+	# Readings taken into the buffer of a 6517B at a time with interval 0,
+	# when it is the only device read
+	BUFFER_SAMPLES = 100
+	# Longest time slept at once between readings in s, so a stop is not
+	# delayed by long intervals
+	SLEEP_SLICE = 0.1
+
+	def __init__ ( self, args ) :
+		super ( LongtermMeasurementThread, self ) .__init__ ( args )
+		self.store = SeriesStore ( maxlen = self.DISPLAY_POINTS )
+
+	def _open_stream ( self, output_base, columns, **devices ) :
+		# Output of the measured rows, written in the background. No journal
+		# is kept, a run cut short is simply shorter.
+		dtypes = output_sink.column_dtypes ( columns )
+		sink = output_sink.open_sink ( self.args.output_format, output_base, columns, self._metadata ( **devices ), dtypes )
+		self.store.reset ( columns, dtypes )
+		return output_sink.AsyncSinkWriter ( sink, flush_interval = self.args.flush_interval, fsync = self.args.fsync )
+
+	def _sleep_until ( self, wakeup ) :
+		while not self._exiting :
+			delay = wakeup - time.time ( )
+			if delay <= 0 :
+				return
+			sleep ( min ( delay, self.SLEEP_SLICE ) )
+
+	def _buffered_rows ( self, keith_hv, reading, started, finished ) :
+		# Rows of the single readings of a buffer filled between started and
+		# finished, the readings being spread evenly over that time
+		series = keith_hv.parse_iv_series ( reading, u"keihv" )
+		currents = series[u"keihv_current"]
+		voltages = series[u"keihv_srcvoltage"]
+		if not len ( currents ) :
+			raise IOError ( u"Got invalid response from Keithley 6517B" )
+		count = len ( currents )
+		rows = []
+		for i in range ( count ) :
+			rows.append ( { u"keihv_current": currents[i],
+							u"keihv_srcvoltage": voltages[i] if len ( voltages ) == count else keith_hv.get_setpoint ( ),
+							u"keihv_time": started + ( finished - started ) * ( i + 1 ) / count } )
+		return rows
+
+	def _peak_current ( self, keith_hv, reading ) :
+		currents = keith_hv.parse_iv_series ( reading, u"keihv" ) [u"keihv_current"]
+		if not len ( currents ) :
+			return None
+		return currents[np.argmax ( np.abs ( currents ) )]
+
+	def run ( self ) :
+		args = self.args
+
+		output_base = self._output_base ( getDateTimeFilename ( ) )
+		logger = logging.getLogger ( u'probestation.longterm_measurement.LongtermMeasurementThread' )
+		logger.debug ( u" In longterm_measurement.py:" )
+
+		try :
+			if args.devname_ardenv:
+				if not self._init_envsensor ( output_base + u"_env.csv" ):
+					errormsg = u"Could not open environment sensor device."
+					self.error_signal.emit ( errormsg )
+					logger.error ( errormsg )
+					self.finished.emit ( output_base )
+
+			keith_hv = drivers.open_device ( args.devname_hv, args.serialenable, keithley.KeithleySource, args.keepwarm )
+			logger.info ( u"  Voltage source device introduced itself as {}" .format ( keith_hv.identify ( ) ) )
+
+			if not args.devname_kei6485 is None and args.guardring :
+				keith6485 = drivers.open_device ( args.devname_kei6485, args.serialenable, keithley.Keithley6485, args.keepwarm )
+				logger.info ( u"  Guard ring device introduced itself as {}" .format ( keith6485.identify ( ) ) )
+			else :
+				keith6485 = None
+				logger.info ( u"  Running without guard ring measurement" )
+		except ( VisaIOError, IOError, ValueError ) :
+			errormsg = u"Could not open devices."
+			self.error_signal.emit ( errormsg )
+			logger.error ( errormsg )
+			self.finished.emit ( output_base )
+			return
+
+		try :
+			logger.info ( u"Starting measurement" )
+			# With interval 0 a 6517B fills its buffer at instrument speed and
+			# the rows are taken from it, unless the 6485 has to be read along
+			buffered = args.interval == 0 and keith6485 is None and isinstance ( keith_hv, keithley.Keithley6517B )
+			with keith_hv.batch ( ) :
+				keith_hv.set_binary_transfer ( args.binary )
+				keith_hv.set_compliance ( args.compcurrent )
+				if isinstance ( keith_hv, keithley.Keithley6517B ) :
+					keith_hv.set_buffer_samples ( self.BUFFER_SAMPLES if buffered else 1 )
+				keith_hv.set_profile ( args.profile )
+				if buffered :
+					# The range has to fit the largest reading of the buffer
+					read_hv = self._range_reader ( keith_hv, keith_hv.get_buffered_reading, lambda reading : self._peak_current ( keith_hv, reading ) )
+				else :
+					read_hv = self._range_reader ( keith_hv, keith_hv.get_reading, lambda reading : keith_hv.parse_iv ( reading, u"keihv" ) [u"keihv_current"] )
+			keith_hv.set_ramp ( args.rampspeed, args.rampstep )
+			if not keith6485 is None :
+				with keith6485.batch ( ) :
+					keith6485.set_binary_transfer ( args.binary )
+					keith6485.set_profile ( args.profile )
+					read_6485 = self._range_reader ( keith6485, keith6485.get_reading, lambda reading : keith6485.parse_iv ( reading, u"kei6485" ) [u"kei6485_current"] )
+
+			header = OrderedDict ( [ ( 'time', None ), ( 'keihv_srcvoltage', None ), ( 'keihv_current', None ) ] )
+			if not keith6485 is None :
+				header['kei6485_current'] = None
+			if args.devname_ardenv:
+				header.update ( { 'envsensor1_temperature': None, 'envsensor1_dewpoint': None, 'envsensor2_temperature': None, 'envsensor2_dewpoint': None } )
+			header['keihv_time'] = None
+			if not keith6485 is None :
+				header['kei6485_time'] = None
+			if args.devname_ardenv:
+				header['envsensor_time'] = None
+
+			for voltage in keith_hv.ramp_series ( [ args.end ] ) :
+				logger.info ( u"  Holding {} V for {} s" .format ( voltage, args.duration ) )
+			self._sleep_until ( time.time ( ) + args.sleep )
+
+			with self._open_stream ( output_base, header, keihv = keith_hv, kei6485 = keith6485 ) as sink :
+				start = next_time = time.time ( )
+				compliance = False
+				while not self._exiting and time.time ( ) - start < args.duration :
+					self._prepare_ranges ( )
+					tasks = OrderedDict ( )
+					tasks[u"keihv"] = read_hv
+					if not keith6485 is None :
+						tasks[u"kei6485"] = read_6485
+					started = time.time ( )
+					readings, times = self._acquire ( tasks )
+
+					if buffered :
+						rows = self._buffered_rows ( keith_hv, readings[u"keihv"], started, times[u"keihv"] )
+					else :
+						meas = keith_hv.parse_iv ( readings[u"keihv"], u"keihv" )
+						if meas[u"keihv_current"] is None :
+							raise IOError ( u"Got invalid response from Keithley 6517B" )
+						if meas[u"keihv_srcvoltage"] is None :
+							meas[u"keihv_srcvoltage"] = keith_hv.get_setpoint ( )
+						if not keith6485 is None :
+							meas[u"kei6485_current"] = keith6485.parse_iv ( readings[u"kei6485"], u"kei6485" ) [u"kei6485_current"]
+							if meas[u"kei6485_current"] is None :
+								raise IOError ( u"Got invalid response from Keithley 6485" )
+						for name, timestamp in times.items ( ) :
+							meas[u"{}_time" .format ( name )] = timestamp
+						rows = [ meas ]
+
+					for meas in rows :
+						# Buffered rows have their own time, spread over the acquisition
+						if args.devname_ardenv:
+							meas.update ( self._measure_environment ( meas[u"keihv_time"] ) )
+						meas[u"time"] = meas[u"keihv_time"] - start
+
+						if not compliance and ( abs ( meas[u"keihv_current"] ) >= args.compcurrent or abs ( meas.get ( u"kei6485_current", 0 ) ) >= args.compcurrent ) :
+							compliance = True
+							self.error_signal.emit ( u"Compliance current reached" )
+							print ( u"Compliance current reached" )
+							#Instant turn off
+							keith_hv.set_output_state ( False )
+							self._exiting = True
+
+						sink.write ( meas )
+						self.store.append ( meas )
+						self.measurement_ready.emit ( ( meas[u"time"], meas[u"keihv_current"] ) )
+
+					if args.interval > 0 :
+						next_time += args.interval
+						if next_time > time.time ( ) :
+							self._sleep_until ( next_time )
+						else :
+							# Fell behind, do not try to catch up with a burst
+							next_time = time.time ( )
+
+		except IOError as e :
+			errormsg = u"Error: {}" .format ( e )
+			self.error_signal.emit ( errormsg )
+			logger.error ( errormsg )
+		except ( VisaIOError, InvalidBinaryFormat, ValueError ) :
+			errormsg = u"Error during communication with devices."
+			self.error_signal.emit ( errormsg )
+			logger.error ( errormsg )
+			# Device state is unknown, configure from scratch next time
+			drivers.forget_devices ( )
+		finally :
+			logger.info ( u"Stopping measurement" )
+			try :
+				keith_hv.stop_measurement ( )
+			except ( VisaIOError, InvalidBinaryFormat, ValueError ) :
+				logger.error ( u"Error during stopping. Trying turn off output" )
+				keith_hv.set_output_state ( False )
+
+		self.finished.emit ( output_base )
+
+class LongtermMeasurementWindow ( MeasurementWindow ) :
+	def __init__ ( self, parent, args ) :
+		thread = LongtermMeasurementThread ( args )
+		super ( LongtermMeasurementWindow, self ) .__init__ ( parent, 2 if args.guardring else 1, args, thread )
+
+		self._xcolumn = u"time"
+		self._xlabel = u"Time in s"
+		self._ylabel = [u"Pad current in A", u"GR current in A"]
+		self._ycolumns = [u"keihv_current", u"kei6485_current"] [:self._num_plots]
+		self.setWindowTitle ( u"Long-term measurement" )
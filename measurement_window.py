@@ -13,7 +13,19 @@ except ImportError as e :
 from matplotlib.figure import Figure
 import numpy as np
 import logging
+import os
+import time
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 import arduinoenv
+import drivers
+import output_sink
+import journal
+from sweep_planner import AdaptiveSweepPlanner
+from range_hint import RangeHinter
+from keithley import OVERFLOW
+from series_store import SeriesStore
+import decimation
 
 class MeasurementThread ( QtCore.QThread ) :
 	error_signal = QtCore.pyqtSignal ( str )
@@ -21,12 +33,25 @@ class MeasurementThread ( QtCore.QThread ) :
 	envmeasurement_ready = QtCore.pyqtSignal ( tuple )
 	finished = QtCore.pyqtSignal ( str )
 
+	# Time between readings while waiting for the reading to settle in s
+	SETTLE_INTERVAL = 0.05
+	# Time between environment sensor readings in s
+	ENV_SAMPLE_INTERVAL = 1.0
+	# Longest wait for the environment sample after a reading in s
+	ENV_WAIT = 2.0
+
 	def __init__ ( self, args ) :
 		super ( MeasurementThread, self ) .__init__ ( )
 		self.args = args
 		self._exiting = False
 		self._logger = logging.getLogger("probestation.measurement_window.MeasurementThread")
 		self._envsensor = None
+		self._envsampler = None
+		self._planner = None
+		self._hinters = []
+		self._pool = None
+		# Measured rows of the run, read by the window for plotting
+		self.store = SeriesStore ( )
 
 	def __del__ ( self ) :
 		self.quit_and_wait ( )
@@ -34,37 +59,145 @@ class MeasurementThread ( QtCore.QThread ) :
 	def quit_and_wait ( self ) :
 		self._exiting = True
 		self.wait ( )
+		if self._pool :
+			self._pool.close ( )
+			self._pool = None
+		if self._envsampler :
+			self._envsampler.stop ( )
+			self._envsampler = None
 		if self._envsensor:
 			self._envsensor.close ( )
 		
-	def _init_envsensor ( self ):
-		self._envsensor = arduinoenv.ArduinoEnvSensor ( self.args.devname_ardenv )
-		idn = self._envsensor.identify ( )
-		if not idn.startswith ( u"Arduino Probestation Environment Sensoring" ) :
+	def _acquire ( self, tasks ) :
+		# Runs the reading functions of different devices concurrently.
+		# tasks maps a device name to its reading function. Returns the
+		# results and the times the readings finished under the same keys.
+		def timed ( func ) :
+			result = func ( )
+			return result, time.time ( )
+
+		if len ( tasks ) <= 1 :
+			pending = OrderedDict ( ( name, timed ( func ) ) for name, func in tasks.items ( ) )
+		else :
+			if self._pool is None :
+				self._pool = ThreadPool ( processes = 4 )
+			async_results = OrderedDict ( ( name, self._pool.apply_async ( timed, ( func, ) ) ) for name, func in tasks.items ( ) )
+			pending = OrderedDict ( ( name, result.get ( ) ) for name, result in async_results.items ( ) )
+
+		results = OrderedDict ( ( name, value[0] ) for name, value in pending.items ( ) )
+		times = OrderedDict ( ( name, value[1] ) for name, value in pending.items ( ) )
+		return results, times
+
+	def _voltage_series ( self, keith_hv ) :
+		args = self.args
+		if not args.adaptive :
+			return keith_hv.voltage_series ( args.start, args.end, args.step )
+
+		self._planner = AdaptiveSweepPlanner ( args.start, args.end, args.step, args.fine_step, args.adaptive_threshold, args.max_points )
+		return keith_hv.ramp_series ( self._planner )
+
+	def _feed_planner ( self, value, noise = None ) :
+		# Passes the value that steers the adaptive step size, and its
+		# standard deviation if it was measured
+		if self._planner is not None :
+			self._planner.feed ( value, noise )
+
+	def _settle ( self, read_value ) :
+		# Waits for args.sleep seconds or, with adaptive settling, until two
+		# successive values returned by read_value agree within the tolerance.
+		args = self.args
+		if not args.settle :
+			time.sleep ( args.sleep )
+			return
+
+		start = time.time ( )
+		previous = None
+		while time.time ( ) - start < args.sleep and not self._exiting :
+			value = read_value ( )
+			if value is None or abs ( value ) >= OVERFLOW :
+				# Nothing to compare while over range, keep waiting
+				previous = None
+			elif previous is not None and abs ( value - previous ) <= args.settle_abstol + args.settle_reltol * abs ( value ) :
+				self._logger.debug ( u"Settled after {:.2f} s" .format ( time.time ( ) - start ) )
+				return
+			else :
+				previous = value
+			time.sleep ( self.SETTLE_INTERVAL )
+
+	def _apply_profile ( self, *devices ) :
+		# Uses the fine profile while the adaptive planner refines the step
+		profile = self.args.profile
+		if self._planner is not None and self._planner.is_refining ( ) :
+			profile = self.args.profile_fine
+		for dev in devices :
+			if dev is not None :
+				dev.set_profile ( profile )
+
+	def _range_reader ( self, dev, read, current_of ) :
+		# Returns read, wrapped to fix the current range of dev before each
+		# point if range hinting is enabled
+		dev.set_current_range ( None )
+		if not self.args.rangehint :
+			return read
+		hinter = RangeHinter ( dev, read, current_of )
+		self._hinters.append ( hinter )
+		return hinter.read
+
+	def _prepare_ranges ( self ) :
+		for hinter in self._hinters :
+			hinter.prepare ( )
+
+	def _metadata ( self, **devices ) :
+		# Run parameters with identification and configured settings of the
+		# devices, stored with the columnar output formats
+		if self._envsensor is not None :
+			devices[u"envsensor"] = self._envsensor
+		info = dict ( ( name, { u"idn": dev.identify ( ), u"settings": dev.get_settings ( ) } ) for name, dev in devices.items ( ) if dev is not None )
+		return { u"args": self.args._asdict ( ), u"start_time": time.time ( ), u"devices": info }
+
+	def _output_base ( self, fname ) :
+		# Output file name without extension, the one of the interrupted run
+		# when resuming
+		if self.args.resume :
+			return journal.load_journal ( self.args.resume ) [0]
+		return os.path.join ( str ( self.args.output_dir ), fname )
+
+	def _open_sink ( self, output_base, columns, **devices ) :
+		# Output of the measured rows and the journal of the run, both written
+		# in the background. A resumed run rewrites the rows journaled before.
+		dtypes = output_sink.column_dtypes ( columns )
+		sink = output_sink.open_sink ( self.args.output_format, output_base, columns, self._metadata ( **devices ), dtypes )
+		sink = output_sink.AsyncSinkWriter ( sink, flush_interval = self.args.flush_interval, fsync = self.args.fsync )
+		runjournal = output_sink.AsyncSinkWriter ( journal.RunJournal ( journal.journal_path ( output_base ) ), fsync = True )
+		self.store.reset ( columns, dtypes )
+		if self.args.resume :
+			points = journal.load_journal ( self.args.resume ) [2]
+			self._logger.info ( u"Resuming {} after {} points at {} V" .format ( output_base, len ( points ), self.args.start ) )
+			for voltage, row in points :
+				sink.write ( row )
+				self.store.append ( row )
+			runjournal.write ( journal.resume_record ( self.args.start ) )
+		else :
+			runjournal.write ( journal.start_record ( output_base, self.args ) )
+		return journal.JournaledOutput ( sink, runjournal, self.store )
+
+	def _init_envsensor ( self, record_path = None ):
+		try :
+			self._envsensor = drivers.open_device ( self.args.devname_ardenv, True, arduinoenv.ArduinoEnvSensor, self.args.keepwarm )
+		except ValueError :
 			return False
 		self._logger.info ( u"Environment sensor device introduced itself as {}" .format ( self._envsensor.identify ( ) ) )
+
+		self._envsampler = arduinoenv.EnvironmentSampler ( self._envsensor, self.ENV_SAMPLE_INTERVAL, record_path = record_path )
+		self._envsampler.sample ( )
+		self._envsampler.start ( )
 		
 		return True
 		
-	def _measure_environment ( self ):
-		# Query both sensors
-		reading = self._envsensor.get_reading ( )
-		read1 = ",".join(reading.split(",")[:4])
-		read2 = ",".join(reading.split(",")[4:])
-		
-		reading = self._envsensor.parse_tphr(read1, "envsensor1")
-		reading.update(self._envsensor.parse_tphr(read2, "envsensor2"))
-		
-		reading["envsensor1_dewpoint"] = None
-		reading["envsensor2_dewpoint"] = None
-		if None not in [reading["envsensor1_temperature"], reading["envsensor1_humidity"]] :
-			reading["envsensor1_dewpoint"] = self._envsensor.get_dewpoint (
-						reading["envsensor1_temperature"],
-						reading["envsensor1_humidity"] )
-		if None not in [reading["envsensor2_temperature"], reading["envsensor2_humidity"]] :
-			reading["envsensor2_dewpoint"] = self._envsensor.get_dewpoint (
-						reading["envsensor2_temperature"],
-						reading["envsensor2_humidity"] )
+	def _measure_environment ( self, timestamp ):
+		# Looks up the environment at the time of a reading from the
+		# background sampler
+		reading = self._envsampler.value_at ( timestamp, self.ENV_WAIT )
 		
 		self.envmeasurement_ready.emit ( ( reading["envsensor1_temperature"],
 										   reading["envsensor1_dewpoint"],
@@ -74,6 +207,12 @@ class MeasurementThread ( QtCore.QThread ) :
 		return reading
 
 class MeasurementWindow ( QtW.QWidget ) :
+	# Minimum time between redraws of the plot in ms, points arriving in
+	# between are drawn together
+	REDRAW_INTERVAL = 100
+	# Decimation of the plotted series, minmax or lttb
+	DECIMATION = u"minmax"
+
 	def __init__ ( self, parent, num_plots, args, thread ) :
 		super ( MeasurementWindow, self ) .__init__ ( parent )
 		self.setWindowFlags ( QtCore.Qt.Window )
@@ -83,8 +222,11 @@ class MeasurementWindow ( QtW.QWidget ) :
 		self._num_plots = num_plots
 		self._ax = []
 		self._args = args
-		self._x = []
-		self._y = [[] for i in range ( num_plots )]
+		# Columns of the series store of the thread plotted, and functions
+		# applied to the y values before plotting
+		self._xcolumn = u"keihv_srcvoltage"
+		self._ycolumns = [ None ] * num_plots
+		self._ytransforms = [ None ] * num_plots
 		self._xlabel = "Source voltage in V"
 		self._ylabel = [""] * num_plots
 		self._should_abs = False
@@ -123,7 +265,27 @@ class MeasurementWindow ( QtW.QWidget ) :
 			else :
 				self._ax.append ( dynamic_canvas.figure.add_subplot ( 100 * self._num_plots + 10 + ( i + 1 ), sharex = self._ax[0] ) )
 
+		# The lines are animated, so they are left out when the canvas draws
+		# and drawn on top of the saved background instead
+		self._lines = [ ax.plot ( [], [], animated = True ) [0] for ax in self._ax ]
+		self._canvas = dynamic_canvas
+		self._backgrounds = None
+		dynamic_canvas.mpl_connect ( "draw_event", self._on_draw )
+		# Zooming or resizing changes what is plotted at full resolution
+		dynamic_canvas.mpl_connect ( "resize_event", self._on_view_changed )
+		self._ax[0].callbacks.connect ( "xlim_changed", self._on_xlim_changed )
+		# x limits of the last redraw
+		self._drawn_xlim = None
+		self._redrawing = False
+
+		self._redraw_timer = QtCore.QTimer ( self )
+		self._redraw_timer.setSingleShot ( True )
+		self._redraw_timer.setInterval ( self.REDRAW_INTERVAL )
+		self._redraw_timer.timeout.connect ( self._redraw )
+
 		self._thread = thread
+		# Kept for plotting after the thread is released on close
+		self._store = thread.store
 		self._thread.error_signal.connect ( self.showErrorDialog )
 		self._thread.measurement_ready.connect ( self.add_point )
 		self._thread.finished.connect ( self._measurementFinished )
@@ -148,10 +310,9 @@ class MeasurementWindow ( QtW.QWidget ) :
 		self._env_label.setText ( "T1 = {:.1f} °C, Dewpoint1 = {:.1f} °C, T2 = {:.1f} °C, Dewpoint2 = {:.1f} °C".format(*measurement) )
 
 	def add_point ( self, point ) :
-		self._x.append ( point[0] )
-		for i, ax in enumerate ( self._ax ) :
-			self._y[i].append ( point[i + 1] )
-		self.update ( )
+		# The point is in the series store of the thread already
+		if not self._redraw_timer.isActive ( ) :
+			self._redraw_timer.start ( )
 
 	def set_absolute ( self, should_abs ) :
 		self._should_abs = should_abs
@@ -160,20 +321,90 @@ class MeasurementWindow ( QtW.QWidget ) :
 
 	def update ( self ) :
 		for i, ax in enumerate ( self._ax ) :
-			ax.clear ( )
 			ax.set_xlabel ( self._xlabel + ( " (Abs)" if self._should_abs else "" ) )
 			ax.set_ylabel ( self._ylabel[i] + ( " (Abs)" if self._should_abs else "" ) )
 			ax.ticklabel_format ( style = "sci", axis = "y", scilimits = ( 0, 0 ), useMathText = True )
-			ax.grid ( )
+			ax.grid ( True )
+		self._redraw ( full = True )
+
+	def _redraw ( self, full = False ) :
+		# Updates the lines and only draws them over the saved background
+		# as long as the axis limits stay the same
+		self._redrawing = True
+		try :
+			full = self._update_lines ( ) or full
+		finally :
+			self._redrawing = False
+		self._drawn_xlim = self._ax[0].get_xlim ( )
+
+		canvas = self._canvas
+		if full or self._backgrounds is None :
+			canvas.draw_idle ( )
+			return
+		for ax, line, background in zip ( self._ax, self._lines, self._backgrounds ) :
+			canvas.restore_region ( background )
+			ax.draw_artist ( line )
+			canvas.blit ( ax.bbox )
+
+	def _update_lines ( self ) :
+		# Sets the data of the lines, returns whether the axis limits changed
+		changed = False
+		series = self._store.view ( [ self._xcolumn ] + self._ycolumns )
+		x = series[self._xcolumn]
+		if self._should_abs :
+			x = np.abs ( x )
+		for i, ( ax, line ) in enumerate ( zip ( self._ax, self._lines ) ) :
+			y = series[self._ycolumns[i]]
+			if self._ytransforms[i] is not None :
+				y = self._ytransforms[i] ( y )
 			if self._should_abs :
-				ax.plot ( np.abs ( self._x ), np.abs ( self._y[i] ) )
-			else :
-				ax.plot ( self._x, self._y[i] )
+				y = np.abs ( y )
+			line.set_data ( *self._decimate ( ax, x, y ) )
+			limits = ( ax.get_xlim ( ), ax.get_ylim ( ) )
+			ax.relim ( )
 			ax.autoscale_view ( )
-		self._figure.canvas.draw ( )
+			if ( ax.get_xlim ( ), ax.get_ylim ( ) ) != limits :
+				changed = True
+		return changed
+
+	def _decimate ( self, ax, x, y ) :
+		# Only the points in view when zoomed in, at most about two per pixel
+		if not ax.get_autoscalex_on ( ) :
+			xmin, xmax = sorted ( ax.get_xlim ( ) )
+			inview = ( x >= xmin ) & ( x <= xmax )
+			x, y = x[inview], y[inview]
+		return decimation.decimate ( x, y, ax.bbox.width, self.DECIMATION )
+
+	def _on_view_changed ( self, *args ) :
+		if not self._redraw_timer.isActive ( ) :
+			self._redraw_timer.start ( )
+
+	def _on_xlim_changed ( self, ax ) :
+		# Also emitted by the autoscaling of each redraw, limits unchanged
+		if self._redrawing or ax.get_xlim ( ) == self._drawn_xlim :
+			return
+		self._on_view_changed ( )
+
+	def _on_draw ( self, event ) :
+		# Also called when saving the figure, with another canvas
+		if event.canvas is not self._canvas :
+			return
+		canvas = self._canvas
+		self._backgrounds = [ canvas.copy_from_bbox ( ax.bbox ) for ax in self._ax ]
+		for ax, line in zip ( self._ax, self._lines ) :
+			ax.draw_artist ( line )
 
 	def savefig ( self, fname ) :
-		self._figure.savefig ( fname )
+		# Animated lines are not part of the saved figure otherwise
+		self._redraw_timer.stop ( )
+		for line in self._lines :
+			line.set_animated ( False )
+		try :
+			self._figure.savefig ( fname )
+		finally :
+			for line in self._lines :
+				line.set_animated ( True )
+			self._redraw ( full = True )
 
 	def isRunning ( self ) :
 		return self._thread and self._thread.isRunning ( )
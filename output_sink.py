@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import
+import sys
+import os
+import io
+import csv
+import glob
+import json
+import time
+import logging
+import threading
+import numpy as np
+from series_store import SeriesStore
+
+try :
+	import queue
+except ImportError :
+	import Queue as queue
+
+try :
+	import h5py
+except ImportError :
+	h5py = None
+
+# Column types of the columnar formats by name suffix, float64 otherwise
+COLUMN_DTYPES = [ ( u"_count", np.int32 ) ]
+
+class CsvSink ( object ) :
+	EXTENSION = u".csv"
+	# Default time between flushes of the asynchronous writer in s
+	FLUSH_INTERVAL = 1.0
+
+	def __init__ ( self, base_path, columns, metadata = None, dtypes = None ) :
+		self.path = base_path + self.EXTENSION
+		mode = 'w'
+		if sys.version_info.major < 3:
+			mode += 'b'
+		self._file = io.open ( self.path, mode )
+		self._writer = csv.DictWriter ( self._file, fieldnames = list ( columns ), extrasaction = u"ignore" )
+		self._writer.writeheader ( )
+
+	def write ( self, row ) :
+		self._writer.writerow ( row )
+
+	def flush ( self ) :
+		self._file.flush ( )
+
+	def sync ( self ) :
+		self._file.flush ( )
+		os.fsync ( self._file.fileno ( ) )
+
+	def close ( self ) :
+		self._file.close ( )
+
+	def __enter__ ( self ) :
+		return self
+
+	def __exit__ ( self, *exc ) :
+		self.close ( )
+
+class ColumnarSink ( object ) :
+	# Collects the rows column by column and stores them in blocks of
+	# BLOCK_ROWS rows as arrays of the types in dtypes, float64 by default,
+	# missing values being NaN (0 in integer columns). Only the rows of the
+	# block being collected are kept.
+	BLOCK_ROWS = 1000
+	# Flushing writes the rows collected so far as a block, so less often
+	FLUSH_INTERVAL = 60.0
+
+	def __init__ ( self, base_path, columns, metadata = None, dtypes = None ) :
+		self._columns = list ( columns )
+		self._metadata = metadata if metadata is not None else {}
+		self._pending = SeriesStore ( self._columns, dtypes = dtypes )
+
+	def write ( self, row ) :
+		self._pending.append ( row )
+		if len ( self._pending ) >= self.BLOCK_ROWS :
+			self.flush ( )
+
+	def flush ( self ) :
+		rows = len ( self._pending )
+		if rows == 0 :
+			return
+		self._write_block ( self._pending.view ( ), rows )
+		self._pending.clear ( )
+
+	def sync ( self ) :
+		# Blocks are synced as they are written
+		self.flush ( )
+
+	def close ( self ) :
+		self.flush ( )
+
+	def __enter__ ( self ) :
+		return self
+
+	def __exit__ ( self, *exc ) :
+		self.close ( )
+
+class NpzSink ( ColumnarSink ) :
+	# Directory holding metadata.json and one .npz file per block. Like the
+	# other formats an existing output is replaced, a resumed run writes the
+	# rows of the interrupted one again.
+	EXTENSION = u"_npz"
+
+	def __init__ ( self, base_path, columns, metadata = None, dtypes = None ) :
+		super ( NpzSink, self ) .__init__ ( base_path, columns, metadata, dtypes )
+		self.path = base_path + self.EXTENSION
+		if os.path.isdir ( self.path ) :
+			for name in glob.glob ( os.path.join ( self.path, u"block_*.npz*" ) ) :
+				os.remove ( name )
+		else :
+			os.mkdir ( self.path )
+		self._blocks = 0
+		with io.open ( os.path.join ( self.path, u"metadata.json" ), 'w' ) as f :
+			f.write ( _to_json ( { u"columns": self._columns, u"metadata": self._metadata } ) )
+
+	def _write_block ( self, block, rows ) :
+		name = os.path.join ( self.path, u"block_{:06d}.npz" .format ( self._blocks ) )
+		# Written under a temporary name so readers never see partial blocks
+		tmpname = name + u".tmp"
+		with io.open ( tmpname, 'wb' ) as f :
+			np.savez ( f, **block )
+			f.flush ( )
+			os.fsync ( f.fileno ( ) )
+		os.rename ( tmpname, name )
+		self._blocks += 1
+
+class Hdf5Sink ( ColumnarSink ) :
+	# One resizable, chunked dataset per column, the metadata as JSON in the
+	# attribute "metadata" of the file
+	EXTENSION = u".h5"
+
+	def __init__ ( self, base_path, columns, metadata = None, dtypes = None ) :
+		if h5py is None :
+			raise ValueError ( u"HDF5 output needs the h5py package" )
+		super ( Hdf5Sink, self ) .__init__ ( base_path, columns, metadata, dtypes )
+		dtypes = dtypes or {}
+		self.path = base_path + self.EXTENSION
+		self._file = h5py.File ( self.path, 'w' )
+		self._file.attrs[u"metadata"] = _to_json ( self._metadata )
+		for name in self._columns :
+			self._file.create_dataset ( name, ( 0, ), maxshape = ( None, ), chunks = ( self.BLOCK_ROWS, ), dtype = dtypes.get ( name, np.float64 ) )
+
+	def _write_block ( self, block, rows ) :
+		for name, values in block.items ( ) :
+			dataset = self._file[name]
+			size = dataset.shape[0]
+			dataset.resize ( ( size + rows, ) )
+			dataset[size:] = values
+		self._file.flush ( )
+
+	def close ( self ) :
+		super ( Hdf5Sink, self ) .close ( )
+		self._file.close ( )
+
+class AsyncSinkWriter ( threading.Thread ) :
+	# Writes the rows to sink in its own thread, so a slow disk or network
+	# share does not delay the measurement. write only blocks if maxsize rows
+	# are waiting. The sink is flushed every flush_interval seconds, and
+	# synced to disk as well with fsync.
+	# Rows waiting longer than this are reported once, until the writer has
+	# caught up again, in s
+	LATENCY_WARNING = 1.0
+
+	def __init__ ( self, sink, maxsize = 10000, flush_interval = None, fsync = False ) :
+		super ( AsyncSinkWriter, self ) .__init__ ( )
+		self.daemon = True
+		self._logger = logging.getLogger ( u'probestation.output_sink.AsyncSinkWriter' )
+		self.path = sink.path
+		self._sink = sink
+		self._queue = queue.Queue ( maxsize )
+		self._flush_interval = flush_interval if flush_interval is not None else sink.FLUSH_INTERVAL
+		self._fsync = fsync
+		self._error = None
+		self._rows = 0
+		self._max_latency = 0
+		self._lagging = False
+		self._blocked = 0
+		self.start ( )
+
+	def write ( self, row ) :
+		self._check ( )
+		item = ( time.time ( ), row )
+		try :
+			self._queue.put_nowait ( item )
+		except queue.Full :
+			self._logger.warning ( u"Output queue full, waiting for {}" .format ( self.path ) )
+			start = time.time ( )
+			self._queue.put ( item )
+			self._blocked += time.time ( ) - start
+
+	def close ( self ) :
+		self._queue.put ( None )
+		self.join ( )
+		self._logger.debug ( u"Wrote {} rows to {}, max latency {:.3f} s, blocked {:.3f} s" .format ( self._rows, self.path, self._max_latency, self._blocked ) )
+		self._check ( )
+
+	def run ( self ) :
+		last_flush = time.time ( )
+		try :
+			while True :
+				try :
+					item = self._queue.get ( timeout = self._flush_interval )
+				except queue.Empty :
+					item = False
+				if item is None :
+					break
+				if item :
+					queued, row = item
+					self._sink.write ( row )
+					self._rows += 1
+					latency = time.time ( ) - queued
+					if latency > self.LATENCY_WARNING and not self._lagging :
+						self._logger.warning ( u"Writing to {} lags behind by {:.1f} s" .format ( self.path, latency ) )
+						self._lagging = True
+					elif latency <= self.LATENCY_WARNING and self._lagging :
+						self._logger.info ( u"Writing to {} caught up" .format ( self.path ) )
+						self._lagging = False
+					self._max_latency = max ( self._max_latency, latency )
+				if time.time ( ) - last_flush >= self._flush_interval :
+					self._flush ( )
+					last_flush = time.time ( )
+		except Exception as e :
+			self._error = e
+			self._logger.error ( u"Writing to {} failed: {}" .format ( self.path, e ) )
+			# Keep taking rows so the measurement does not block
+			while self._queue.get ( ) is not None :
+				pass
+		finally :
+			try :
+				self._sink.close ( )
+			except Exception as e :
+				self._error = self._error or e
+
+	def _flush ( self ) :
+		if self._fsync :
+			self._sink.sync ( )
+		else :
+			self._sink.flush ( )
+
+	def _check ( self ) :
+		if self._error is not None :
+			raise IOError ( u"Writing to {} failed: {}" .format ( self.path, self._error ) )
+
+	def __enter__ ( self ) :
+		return self
+
+	def __exit__ ( self, *exc ) :
+		self.close ( )
+
+SINKS = { u"csv": CsvSink, u"npz": NpzSink, u"hdf5": Hdf5Sink }
+
+def available_formats ( ) :
+	formats = [ u"csv", u"npz" ]
+	if h5py is not None :
+		formats.append ( u"hdf5" )
+	return formats
+
+def column_dtypes ( columns ) :
+	# Types of the columns that are not float64, see COLUMN_DTYPES
+	dtypes = {}
+	for name in columns :
+		for suffix, dtype in COLUMN_DTYPES :
+			if name.endswith ( suffix ) :
+				dtypes[name] = dtype
+	return dtypes
+
+def open_sink ( output_format, base_path, columns, metadata = None, dtypes = None ) :
+	# base_path is the output file name without extension
+	try :
+		cls = SINKS[output_format]
+	except KeyError :
+		raise ValueError ( u"Unknown output format: {}" .format ( output_format ) )
+	return cls ( base_path, columns, metadata, dtypes )
+
+def read_columnar ( path ) :
+	# Returns the columns as dict of arrays and the metadata of a file
+	# written by NpzSink or Hdf5Sink
+	if os.path.isdir ( path ) :
+		with io.open ( os.path.join ( path, u"metadata.json" ), 'r' ) as f :
+			header = json.load ( f )
+		pieces = dict ( ( name, [] ) for name in header[u"columns"] )
+		for blockname in sorted ( glob.glob ( os.path.join ( path, u"block_*.npz" ) ) ) :
+			with np.load ( blockname ) as block :
+				for name, values in pieces.items ( ) :
+					values.append ( block[name] )
+		columns = dict ( ( name, np.concatenate ( values ) if values else np.empty ( 0 ) ) for name, values in pieces.items ( ) )
+		return columns, header[u"metadata"]
+
+	if h5py is None :
+		raise ValueError ( u"Reading HDF5 files needs the h5py package" )
+	with h5py.File ( path, 'r' ) as f :
+		columns = dict ( ( name, f[name][:] ) for name in f.keys ( ) )
+		return columns, json.loads ( f.attrs[u"metadata"] )
+
+def _to_json ( obj ) :
+	# namedtuples end up as lists, anything unknown as string
+	text = json.dumps ( obj, default = str, indent = 1 )
+	if isinstance ( text, bytes ) :
+		text = text.decode ( u"utf-8" )
+	return text
@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import
+from collections import namedtuple, OrderedDict
+
+# Integration and filter settings of the meters. nplc is the Keithley
+# integration time in power line cycles (None for the default after *RST),
+# average the Keithley averaging filter count (None for the default of the
+# driver), aperture and aperture_average the E4980A measurement time
+# (SHORT, MED or LONG) and averaging rate.
+Profile = namedtuple ( u"Profile", [ u"nplc", u"average", u"aperture", u"aperture_average" ] )
+
+PROFILES = OrderedDict ( [ ( u"fast", Profile ( 0.1, 1, u"SHORT", 1 ) ),
+						   ( u"normal", Profile ( None, None, u"MED", 5 ) ),
+						   ( u"precise", Profile ( 10, 10, u"LONG", 10 ) ) ] )
+
+CUSTOM = u"custom"
+
+def get_profile ( name, custom = None ) :
+	if name == CUSTOM :
+		if custom is None :
+			raise ValueError ( u"No settings given for the custom profile" )
+		return custom
+	try :
+		return PROFILES[name]
+	except KeyError :
+		raise ValueError ( u"Unknown profile: {}" .format ( name ) )
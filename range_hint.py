@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+from __future__ import division
+from __future__ import absolute_import
+import logging
+from keithley import OVERFLOW
+
+class RangeHinter ( object ) :
+	# Fixes the current range of a Keithley meter before each point to the
+	# current extrapolated from the previous readings times a guard band,
+	# so the device does not hunt for the range. Readings at the end of the
+	# fixed range are taken again with autorange.
+	GUARD = 3
+	# Fraction of the range above which a reading counts as overflow
+	FULL_SCALE = 0.95
+
+	def __init__ ( self, dev, read, current_of, guard = GUARD ) :
+		self._logger = logging.getLogger ( u'probestation.range_hint.RangeHinter' )
+		self._dev = dev
+		self._read = read
+		self._current_of = current_of
+		self._guard = guard
+		self._currents = []
+		self._range = None
+
+	def predict ( self ) :
+		if not self._currents :
+			return None
+		last = abs ( self._currents[-1] )
+		if len ( self._currents ) < 2 :
+			return last
+		return max ( last, abs ( 2 * self._currents[-1] - self._currents[-2] ) )
+
+	def prepare ( self ) :
+		current = self.predict ( )
+		if current is None :
+			self._range = self._dev.set_current_range ( None )
+		else :
+			self._range = self._dev.set_current_range ( self._guard * current )
+
+	def read ( self ) :
+		reading = self._read ( )
+		current = self._current_of ( reading )
+		if current is None :
+			return reading
+		if self._range is not None and ( abs ( current ) >= OVERFLOW or abs ( current ) >= self.FULL_SCALE * self._range ) :
+			self._logger.debug ( u"Reading {} A at the end of the {} A range, reading again with autorange" .format ( current, self._range ) )
+			self._range = self._dev.set_current_range ( None )
+			reading = self._read ( )
+			current = self._current_of ( reading )
+		if current is not None and abs ( current ) < OVERFLOW :
+			self._currents = self._currents[-1:] + [ current ]
+		return reading
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import
+import threading
+import numpy as np
+
+class SeriesStore ( object ) :
+	# Columns of a run in preallocated NumPy arrays, doubling in size when
+	# full. With maxlen only the last maxlen rows are kept. One thread may
+	# append while others read; views handed out stay valid as the arrays
+	# are replaced, never overwritten, when they grow or wrap around.
+	INITIAL_CAPACITY = 1024
+
+	def __init__ ( self, columns = ( ), maxlen = None, dtypes = None ) :
+		self._lock = threading.Lock ( )
+		self._maxlen = maxlen
+		self.reset ( columns, dtypes )
+
+	def reset ( self, columns, dtypes = None ) :
+		# Drops all rows and sets the columns, float64 unless given in dtypes
+		dtypes = dtypes or {}
+		capacity = self.INITIAL_CAPACITY
+		if self._maxlen is not None :
+			capacity = 2 * self._maxlen
+		with self._lock :
+			self._columns = list ( columns )
+			self._data = dict ( ( name, np.empty ( capacity, dtype = dtypes.get ( name, np.float64 ) ) ) for name in self._columns )
+			self._start = 0
+			self._end = 0
+
+	def columns ( self ) :
+		return list ( self._columns )
+
+	def __len__ ( self ) :
+		return self._end - self._start
+
+	def append ( self, row ) :
+		# Missing values are stored as NaN, or 0 in integer columns
+		with self._lock :
+			if self._end == self._capacity ( ) :
+				self._reallocate ( )
+			for name, values in self._data.items ( ) :
+				value = row.get ( name )
+				if value is None :
+					value = np.nan if values.dtype.kind == u"f" else 0
+				values[self._end] = value
+			self._end += 1
+			if self._maxlen is not None and self._end - self._start > self._maxlen :
+				self._start += 1
+
+	def clear ( self ) :
+		with self._lock :
+			# New arrays, so views taken before keep their values
+			self._data = dict ( ( name, np.empty_like ( values ) ) for name, values in self._data.items ( ) )
+			self._start = 0
+			self._end = 0
+
+	def column ( self, name ) :
+		return self.view ( [ name ] ) [name]
+
+	def view ( self, names = None ) :
+		# Views of the stored rows of the columns, all of the same length.
+		# Columns not in the store are returned empty.
+		if names is None :
+			names = self._columns
+		with self._lock :
+			return dict ( ( name, self._data[name][self._start:self._end] if name in self._data else np.empty ( 0 ) ) for name in names )
+
+	def _capacity ( self ) :
+		return len ( next ( iter ( self._data.values ( ) ) ) ) if self._data else 0
+
+	def _reallocate ( self ) :
+		count = self._end - self._start
+		capacity = self._capacity ( )
+		if self._maxlen is None :
+			capacity = max ( 2 * capacity, self.INITIAL_CAPACITY )
+		for name, values in self._data.items ( ) :
+			new = np.empty ( capacity, dtype = values.dtype )
+			new[:count] = values[self._start:self._end]
+			self._data[name] = new
+		self._start = 0
+		self._end = count
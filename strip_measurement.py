@@ -6,8 +6,8 @@ from __future__ import absolute_import
 import logging
 from measurement_window import MeasurementThread, MeasurementWindow
 import keithley
+import drivers
 import agilent
-import sys
 from math import fabs
 
 try:
@@ -18,11 +18,9 @@ except ImportError as e :
     from PyQt4 import QtCore
 
 import os
-import csv
 import datetime
 from time import sleep
 from pyvisa.errors import VisaIOError, InvalidBinaryFormat
-from io import open
 from collections import OrderedDict
 
 def getDateTimeFilename ( ) :
@@ -38,38 +36,27 @@ class StripMeasurementThread ( MeasurementThread ) :
 	def run ( self ) :
 		args = self.args
 
-		fname = getDateTimeFilename ( )
-		output_csv = os.path.join ( str ( args.output_dir ), fname + u".csv" )
+		output_base = self._output_base ( getDateTimeFilename ( ) )
 		logger = logging.getLogger ( u'probestation.strip_measurement.StripMeasurementThread' )
 		logger.debug ( u" In strip_measurement.py:" )
 
 		try :
 			if args.devname_ardenv:
-				if not self._init_envsensor ( ):
+				if not self._init_envsensor ( output_base + u"_env.csv" ):
 					errormsg = u"Could not open environment sensor device."
 					self.error_signal.emit ( errormsg )
 					logger.error ( errormsg )
-					self.finished.emit ( os.path.join ( str ( args.output_dir ), fname ) )
+					self.finished.emit ( output_base )
 			
-			input_hv = keithley.KeithleyMeter ( args.devname_hv, args.serialenable )
-			if input_hv.identify ( ) .startswith ( u"KEITHLEY INSTRUMENTS INC.,MODEL 6517B" ) :
-				keith_hv = keithley.Keithley6517B ( args.devname_hv, args.serialenable )
-			elif input_hv.identify ( ) .startswith ( u"KEITHLEY INSTRUMENTS INC.,MODEL 2410" ) :
-				keith_hv = keithley.Keithley2410 ( args.devname_hv, args.serialenable )
-			else :
-				errormsg = u"Could not open devices."
-				self.error_signal.emit ( errormsg )
-				logger.error ( errormsg )
-				self.finished.emit ( os.path.join ( str ( args.output_dir ), fname ) )
-				return
+			keith_hv = drivers.open_device ( args.devname_hv, args.serialenable, keithley.KeithleySource, args.keepwarm )
 			logger.info ( u"  Voltage source device introduced itself as {}" .format ( keith_hv.identify ( ) ) )
-			agilentE4980A = agilent.AgilentE4980A ( args.devname_agiE4980A, args.serialenable )
+			agilentE4980A = drivers.open_device ( args.devname_agiE4980A, args.serialenable, agilent.AgilentE4980A, args.keepwarm )
 			logger.info ( u"LCR meter introduced itself as {}" .format ( agilentE4980A.identify ( ) ) )
-		except VisaIOError :
+		except ( VisaIOError, IOError, ValueError ) :
 			errormsg = u"Could not open devices."
 			self.error_signal.emit ( errormsg )
 			logger.error ( errormsg )
-			self.finished.emit ( os.path.join ( str ( args.output_dir ), fname ) )
+			self.finished.emit ( output_base )
 			return
 
 		try :
@@ -77,49 +64,63 @@ class StripMeasurementThread ( MeasurementThread ) :
 			if args.resistance :
 				logger.info ( u"Resistance!" )
 
-			agilentE4980A.set_frequency ( args.frequency )
-			agilentE4980A.set_voltage_level ( args.deltavolt )
-
-			mode = 'w'
-			if sys.version_info.major < 3:
-				mode += 'b'
-
-			keith_hv.set_compliance ( args.compcurrent )
-
-			with open ( output_csv, mode ) as f :
-				if not args.resistance :
-					header = OrderedDict ( [ ( 'keihv_srcvoltage', None ), ( 'agie4980a_capacitance', None ), ( 'keihv_current', None ) ] )
-				else :
-					header = OrderedDict ( [ ( 'keihv_srcvoltage', None ), ( 'agie4980a_resistance', None ), ( 'agie4980a_impedance', None ), ( 'keihv_current', None ) ] )
-				if args.devname_ardenv:
-					header.update ( { 'envsensor1_temperature': None, 'envsensor1_dewpoint': None, 'envsensor2_temperature': None, 'envsensor2_dewpoint': None } )
-				writer = csv.DictWriter ( f, header, extrasaction = "ignore" )
-				writer.writeheader ( )
-
-				for keivolt in keith_hv.voltage_series ( args.start, args.end, args.step ) :
-					sleep ( args.sleep )
+			with agilentE4980A.batch ( ) :
+				agilentE4980A.set_impedance_function ( u"CPG" )
+				agilentE4980A.set_frequency_list ( None )
+				agilentE4980A.set_frequency ( args.frequency )
+				agilentE4980A.set_voltage_level ( args.deltavolt )
+				agilentE4980A.set_binary_transfer ( args.binary )
+				agilentE4980A.set_profile ( args.profile )
+
+			with keith_hv.batch ( ) :
+				keith_hv.set_binary_transfer ( args.binary )
+				keith_hv.set_compliance ( args.compcurrent )
+				keith_hv.set_profile ( args.profile )
+				read_hv = self._range_reader ( keith_hv, keith_hv.get_reading, lambda reading : keith_hv.parse_iv ( reading, u"keihv" ) [u"keihv_current"] )
+			keith_hv.set_ramp ( args.rampspeed, args.rampstep )
+
+			if not args.resistance :
+				header = OrderedDict ( [ ( 'keihv_srcvoltage', None ), ( 'agie4980a_capacitance', None ), ( 'keihv_current', None ) ] )
+			else :
+				header = OrderedDict ( [ ( 'keihv_srcvoltage', None ), ( 'agie4980a_resistance', None ), ( 'agie4980a_impedance', None ), ( 'keihv_current', None ) ] )
+			if args.devname_ardenv:
+				header.update ( { 'envsensor1_temperature': None, 'envsensor1_dewpoint': None, 'envsensor2_temperature': None, 'envsensor2_dewpoint': None } )
+			header.update ( [ ( 'agie4980a_time', None ), ( 'keihv_time', None ) ] )
+			if args.devname_ardenv:
+				header['envsensor_time'] = None
+			compliance = False
+			with self._open_sink ( output_base, header, keihv = keith_hv, agie4980a = agilentE4980A ) as sink :
+				for keivolt in self._voltage_series ( keith_hv ) :
+					self._apply_profile ( agilentE4980A, keith_hv )
+					self._prepare_ranges ( )
+					if not args.resistance :
+						self._settle ( lambda : agilent.parse_cgv ( agilentE4980A.get_reading ( ), u"agie4980a" ) [u"agie4980a_capacitance"] )
+					else :
+						self._settle ( lambda : agilent.parse_res ( agilentE4980A.get_resistance ( ), u"agie4980a" ) [u"agie4980a_resistance"] )
 					if self._exiting :
 						break
 
 					if not args.resistance :
-						line = agilentE4980A.get_reading ( )
-						meas = agilent.parse_cgv ( line, "agie4980a" )
+						tasks = OrderedDict ( [ ( u"agie4980a", agilentE4980A.get_reading ), ( u"keihv", read_hv ) ] )
+					else :
+						tasks = OrderedDict ( [ ( u"agie4980a", agilentE4980A.get_resistance ), ( u"keihv", read_hv ) ] )
+					readings, times = self._acquire ( tasks )
+
+					if not args.resistance :
+						meas = agilent.parse_cgv ( readings[u"agie4980a"], "agie4980a" )
 						meas["keihv_srcvoltage"] = keivolt
 						if ( not "keihv_srcvoltage" in meas or not "agie4980a_capacitance" in meas or not "agie4980a_conductance" in meas or meas["keihv_srcvoltage"] is None or meas["agie4980a_capacitance"] is None or meas["agie4980a_conductance"] is None ) :
 							raise IOError ( "Got invalid reading from device" )
-						compline = keith_hv.get_reading ( )
-						meas.update ( keith_hv.parse_iv ( compline, u"keihv" ) )
+						meas.update ( keith_hv.parse_iv ( readings[u"keihv"], u"keihv" ) )
 
 						print ( "VSrc = {: 10.4g} V; C = {: 10.4g} F; G = {: 10.4g} S" .format ( meas["keihv_srcvoltage"], meas["agie4980a_capacitance"], meas["agie4980a_conductance"] ) )
 
 					else :
-						line = agilentE4980A.get_resistance ( )
-						meas = agilent.parse_res ( line, "agie4980a" )
+						meas = agilent.parse_res ( readings[u"agie4980a"], "agie4980a" )
 						meas["keihv_srcvoltage"] = keivolt
 						if ( not "keihv_srcvoltage" in meas or not "agie4980a_resistance" in meas or not "agie4980a_impedance" in meas or meas["keihv_srcvoltage"] is None or meas["agie4980a_resistance"] is None or meas["agie4980a_impedance"] is None ) :
 							raise IOError ( "Got invalid reading from device" )
-						compline = keith_hv.get_reading ( )
-						meas.update ( keith_hv.parse_iv ( compline, u"keihv" ) )
+						meas.update ( keith_hv.parse_iv ( readings[u"keihv"], u"keihv" ) )
 
 						print ( "VSrc = {: 10.4g} V; R = {: 10.4g} O" .format( meas["keihv_srcvoltage"], meas["agie4980a_resistance"], meas["agie4980a_impedance"] ) )
 
@@ -129,12 +130,18 @@ class StripMeasurementThread ( MeasurementThread ) :
 						#Instant turn off
 						keith_hv.set_output_state ( False )
 						self._exiting = True
+						compliance = True
 						
 					if args.devname_ardenv:
-						env = self._measure_environment ( )
-						meas.update(env)
+						meas.update ( self._measure_environment ( times[u"agie4980a"] ) )
+					for name, timestamp in times.items ( ) :
+						meas[u"{}_time" .format ( name )] = timestamp
 
-					writer.writerow ( meas )
+					if not args.resistance :
+						self._feed_planner ( meas["agie4980a_capacitance"] )
+					else :
+						self._feed_planner ( meas["agie4980a_resistance"] )
+					sink.write ( keivolt, meas )
 					if not args.resistance :
 						self.measurement_ready.emit ( ( meas["keihv_srcvoltage"], meas["agie4980a_capacitance"] ) )
 					else :
@@ -142,6 +149,9 @@ class StripMeasurementThread ( MeasurementThread ) :
 
 					if self._exiting :
 						break
+				# Reaching compliance ends the run, the point is written first
+				if compliance or not self._exiting :
+					sink.finish ( )
 
 		except IOError as e :
 			errormsg = u"Error: {}" .format ( e )
@@ -151,6 +161,8 @@ class StripMeasurementThread ( MeasurementThread ) :
 			errormsg = u"Error during communication with devices."
 			self.error_signal.emit ( errormsg )
 			logger.error ( errormsg )
+			# Device state is unknown, configure from scratch next time
+			drivers.forget_devices ( )
 		finally :
 			logger.info ( u"Stopping measurement" )
 			try :
@@ -159,7 +171,7 @@ class StripMeasurementThread ( MeasurementThread ) :
 				logger.error ( u"Error during stopping. Trying to turn off output" )
 				keith_hv.set_output_state ( False )
 
-		self.finished.emit ( os.path.join ( str ( args.output_dir ), fname ) )
+		self.finished.emit ( output_base )
 
 class StripMeasurementWindow ( MeasurementWindow ) :
 	def __init__ ( self, parent, args ) :
@@ -168,6 +180,8 @@ class StripMeasurementWindow ( MeasurementWindow ) :
 
 		if not args.resistance :
 			self._ylabel = [u"Capacitance in $\\mathrm{F}$", u"Conductance in $\\mathrm{S}$"]
+			self._ycolumns = [u"agie4980a_capacitance"]
 		else:
 			self._ylabel = [u"Resistance in $\\mathrm{Ohm}$", u"Impedance in $\\mathrm{Ohm}$"]
+			self._ycolumns = [u"agie4980a_resistance", u"agie4980a_impedance"]
 		self.setWindowTitle ( u"Strip measurement" )
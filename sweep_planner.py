@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+from __future__ import division
+from __future__ import absolute_import
+import logging
+
+class AdaptiveSweepPlanner ( object ) :
+	# Iterating yields the voltages of the sweep. After each voltage the
+	# measured value has to be passed to feed, which is used to decide the
+	# next step: coarse while the slope of the values stays the same, fine
+	# where it changes by more than threshold (relative). Changes within the
+	# noise of the values are ignored, the noise being estimated from how far
+	# the previous values were off the straight line through their neighbours.
+	# Deviations below NOISE_FACTOR times the noise do not refine the step.
+	NOISE_FACTOR = 3
+	# Number of recent deviations the noise is estimated from, and needed
+	# before any refinement
+	NOISE_WINDOW = 10
+	NOISE_MIN_SAMPLES = 3
+
+	def __init__ ( self, start_volt, end_volt, coarse_step, fine_step, threshold, max_points ) :
+		if not 0 < fine_step <= coarse_step :
+			raise ValueError ( u"Fine step must be positive and not larger than the coarse step: {}" .format ( fine_step ) )
+		if max_points < 2 :
+			raise ValueError ( u"At least two points are needed: {}" .format ( max_points ) )
+
+		self._logger = logging.getLogger ( u'probestation.sweep_planner.AdaptiveSweepPlanner' )
+		self._start = start_volt
+		self._end = end_volt
+		self._coarse_step = abs ( coarse_step )
+		self._fine_step = abs ( fine_step )
+		self._threshold = threshold
+		self._max_points = max_points
+		self._direction = 1 if end_volt >= start_volt else -1
+		self._points = []
+		self._deviations = []
+		self._noise = None
+		self._pending = None
+		self._count = 0
+		self._step = self._coarse_step
+		self._refining = False
+
+	def __iter__ ( self ) :
+		volts = self._start
+		while True :
+			self._pending = volts
+			self._count += 1
+			yield volts
+			if self._pending is not None :
+				# No value fed for this voltage, keep the step
+				self._pending = None
+			if volts == self._end :
+				return
+			volts = self._next_voltage ( volts )
+
+	def feed ( self, value, noise = None ) :
+		# noise is the standard deviation of value, if measured
+		if self._pending is None or value is None :
+			return
+		self._points.append ( ( self._pending, value ) )
+		self._noise = noise
+		self._pending = None
+		self._update_step ( )
+
+	def is_refining ( self ) :
+		return self._refining
+
+	def get_points ( self ) :
+		return list ( self._points )
+
+	def _update_step ( self ) :
+		if len ( self._points ) < 3 :
+			return
+		( v0, y0 ), ( v1, y1 ), ( v2, y2 ) = self._points[-3:]
+		if v1 == v0 or v2 == v1 :
+			return
+		slope1 = ( y1 - y0 ) / ( v1 - v0 )
+		slope2 = ( y2 - y1 ) / ( v2 - v1 )
+		scale = max ( abs ( slope1 ), abs ( slope2 ) )
+		change = abs ( slope2 - slope1 ) / scale if scale > 0 else 0
+		# Distance of the value from the line through the previous two
+		deviation = abs ( y2 - y1 - slope1 * ( v2 - v1 ) )
+		significant = deviation > self.NOISE_FACTOR * self._noise_floor ( )
+		self._deviations = self._deviations[-( self.NOISE_WINDOW - 1 ):] + [ deviation ]
+
+		if change > self._threshold and significant :
+			if not self._refining :
+				self._logger.debug ( u"Refining step at {} V (slope change {:.2f})" .format ( v2, change ) )
+			self._step = self._fine_step
+			self._refining = True
+		else :
+			self._step = min ( 2 * self._step, self._coarse_step )
+			self._refining = self._step < self._coarse_step
+
+	def _noise_floor ( self ) :
+		# Median of the recent deviations, or the measured noise if larger
+		if len ( self._deviations ) < self.NOISE_MIN_SAMPLES :
+			return float ( u"inf" )
+		deviations = sorted ( self._deviations )
+		floor = deviations[len ( deviations ) // 2]
+		if self._noise is not None :
+			floor = max ( floor, self._noise )
+		return floor
+
+	def _next_voltage ( self, volts ) :
+		distance = abs ( self._end - volts )
+		remaining = self._max_points - self._count
+		step = self._step
+		if remaining <= 1 :
+			step = distance
+		else :
+			# Make sure the end is reached within the point budget
+			step = max ( step, distance / remaining )
+		if step >= distance :
+			return self._end
+		return round ( volts + self._direction * step, 3 )
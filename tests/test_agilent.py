@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert ( 0, os.path.dirname ( os.path.dirname ( os.path.abspath ( __file__ ) ) ) )
+pytest.importorskip ( u"visa" )
+import agilent
+
+def test_list_columns_unique ( ) :
+	freqs = [ 1000, 1000.5, 1000.25, 1e6 ]
+	columns = agilent.list_columns ( u"lcr", freqs )
+	assert len ( columns ) == 2 * len ( freqs )
+	assert len ( set ( columns ) ) == len ( columns )
+	assert columns[:2] == [ u"lcr_capacitance_1000Hz", u"lcr_conductance_1000Hz" ]
+	assert columns[2] == u"lcr_capacitance_1000.5Hz"
+
+def test_parse_cgv_list ( ) :
+	freqs = [ 1000, 1000.5 ]
+	line = u"1e-12,2e-6,0,0,3e-12,4e-6,0,0"
+	ret = agilent.parse_cgv_list ( line, u"lcr", freqs )
+	# The first frequency also under the names of a single reading
+	assert ret[u"lcr_capacitance"] == 1e-12
+	assert ret[u"lcr_conductance"] == 2e-6
+	assert ret[u"lcr_capacitance_1000Hz"] == 1e-12
+	assert ret[u"lcr_capacitance_1000.5Hz"] == 3e-12
+	assert ret[u"lcr_conductance_1000.5Hz"] == 4e-6
+	binary = agilent.parse_cgv_list ( np.array ( [ 1e-12, 2e-6, 0, 0, 3e-12, 4e-6, 0, 0 ] ), u"lcr", freqs )
+	assert binary == ret
+
+def test_parse_cgv_list_length ( ) :
+	with pytest.raises ( ValueError ) :
+		agilent.parse_cgv_list ( u"1e-12,2e-6,0,0", u"lcr", [ 1000, 2000 ] )
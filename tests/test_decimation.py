@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert ( 0, os.path.dirname ( os.path.dirname ( os.path.abspath ( __file__ ) ) ) )
+import decimation
+
+def series ( n ) :
+	x = np.arange ( n, dtype = np.float64 )
+	y = np.sin ( x / 50 )
+	y[n // 3] = 10
+	return x, y
+
+def test_minmax ( ) :
+	x, y = series ( 10000 )
+	dx, dy = decimation.minmax ( x, y, 100 )
+	# Two per bucket and the endpoints, some of them the same point
+	assert 200 <= len ( dx ) <= 202
+	assert dx[0] == 0 and dx[-1] == 9999
+	assert np.all ( np.diff ( dx ) >= 0 )
+	# The spike and the extremes are kept
+	assert dy.max ( ) == 10
+	assert dy.min ( ) == y.min ( )
+
+def test_minmax_nan ( ) :
+	x, y = series ( 1000 )
+	y[:500] = np.nan
+	dx, dy = decimation.minmax ( x, y, 10 )
+	assert not np.isnan ( dy[10:] ) .any ( )
+
+def test_lttb ( ) :
+	x, y = series ( 10000 )
+	dx, dy = decimation.lttb ( x, y, 300 )
+	assert len ( dx ) == 300
+	assert ( dx[0], dy[0] ) == ( x[0], y[0] )
+	assert ( dx[-1], dy[-1] ) == ( x[-1], y[-1] )
+	assert np.all ( np.diff ( dx ) > 0 )
+	assert dy.max ( ) == 10
+
+@pytest.mark.parametrize ( u"method", [ u"minmax", u"lttb" ] )
+def test_short_series_unchanged ( method ) :
+	x, y = series ( 50 )
+	dx, dy = decimation.decimate ( x, y, 100, method )
+	np.testing.assert_array_equal ( dx, x )
+	np.testing.assert_array_equal ( dy, y )
+
+def test_unknown_method ( ) :
+	with pytest.raises ( ValueError ) :
+		decimation.decimate ( [ 0 ], [ 0 ], 100, u"mean" )
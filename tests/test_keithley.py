@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import
+import os
+import sys
+import pytest
+
+sys.path.insert ( 0, os.path.dirname ( os.path.dirname ( os.path.abspath ( __file__ ) ) ) )
+pytest.importorskip ( u"visa" )
+import keithley
+
+def test_ramp_steps ( ) :
+	assert keithley.ramp_steps ( 0, -35, 10 ) == [ -10, -20, -30, -35 ]
+	assert keithley.ramp_steps ( -35, 0, -10 ) == [ -25, -15, -5, 0 ]
+
+def test_ramp_steps_short ( ) :
+	# Within one step, only the end
+	assert keithley.ramp_steps ( 0, 5, 10 ) == [ 5 ]
+	assert keithley.ramp_steps ( 5, 5, 10 ) == [ 5 ]
+
+def test_voltage_steps ( ) :
+	assert keithley.voltage_steps ( 0, -1, 0.25 ) == [ 0, -0.25, -0.5, -0.75, -1 ]
+	assert keithley.voltage_steps ( 0, 1, 0.3 ) == [ 0, 0.3, 0.6, 0.9 ]
@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import
+import os
+import sys
+
+sys.path.insert ( 0, os.path.dirname ( os.path.dirname ( os.path.abspath ( __file__ ) ) ) )
+from lcr_correction import CorrectionCache
+
+IDN = u"Agilent Technologies,E4980A,MY00000000,A.02.10\n"
+FREQS = [ 1e3, 1e4 ]
+
+def test_put_replaces_instrument_correction ( tmpdir ) :
+	cache = CorrectionCache ( str ( tmpdir.join ( u"corrections.json" ) ) )
+	cache.put ( u"probecard", IDN, FREQS )
+	cache.put ( u"needles", IDN, FREQS )
+	assert cache.get ( u"probecard", IDN, FREQS ) is None
+	assert cache.get ( u"needles", IDN, FREQS ) is not None
+
+def test_forget_is_saved ( tmpdir ) :
+	path = str ( tmpdir.join ( u"corrections.json" ) )
+	cache = CorrectionCache ( path )
+	cache.put ( u"needles", IDN, FREQS )
+	cache.put ( u"needles", u"Other,E4980A", FREQS )
+	cache.forget ( IDN )
+	cache = CorrectionCache ( path )
+	assert cache.get ( u"needles", IDN, FREQS ) is None
+	assert cache.get ( u"needles", u"Other,E4980A", FREQS ) is not None
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import
+import os
+import sys
+import pytest
+
+sys.path.insert ( 0, os.path.dirname ( os.path.dirname ( os.path.abspath ( __file__ ) ) ) )
+pytest.importorskip ( u"visa" )
+import keithley
+from range_hint import RangeHinter
+
+class FakeResource ( object ) :
+	def __init__ ( self ) :
+		self.writes = []
+
+	def write ( self, cmd ) :
+		self.writes.append ( cmd )
+
+def meter ( ) :
+	# Keithley 6485 driver without a device, recording the commands
+	dev = keithley.Keithley6485.__new__ ( keithley.Keithley6485 )
+	dev._res = FakeResource ( )
+	dev._batch = None
+	dev._settings = {}
+	return dev
+
+class Reader ( object ) :
+	def __init__ ( self, *currents ) :
+		self.currents = list ( currents )
+		self.reads = 0
+
+	def read ( self ) :
+		self.reads += 1
+		return self.currents.pop ( 0 )
+
+def test_guard_band ( ) :
+	dev = meter ( )
+	reader = Reader ( 1e-9, 2e-9 )
+	hinter = RangeHinter ( dev, reader.read, lambda current : current )
+	hinter.prepare ( )
+	assert dev._res.writes[-1] .endswith ( u"RANGE:AUTO ON" )
+	hinter.read ( )
+	hinter.read ( )
+	# Extrapolated 3e-9 A times the guard band of 3 fits the 2e-8 A range
+	assert hinter.predict ( ) == pytest.approx ( 3e-9 )
+	hinter.prepare ( )
+	assert dev._res.writes[-1] == u":SENSE:CURRENT:RANGE 2e-08"
+
+def test_unchanged_range_not_sent ( ) :
+	dev = meter ( )
+	reader = Reader ( 1e-9, 1e-9, 1e-9 )
+	hinter = RangeHinter ( dev, reader.read, lambda current : current )
+	hinter.read ( )
+	hinter.prepare ( )
+	hinter.read ( )
+	hinter.prepare ( )
+	assert dev._res.writes.count ( u":SENSE:CURRENT:RANGE 2e-08" ) == 1
+
+@pytest.mark.parametrize ( u"first", [ keithley.OVERFLOW, 0.96 * 2e-8 ] )
+def test_overflow_read_again ( first ) :
+	dev = meter ( )
+	reader = Reader ( 1e-9, first, 5e-6 )
+	hinter = RangeHinter ( dev, reader.read, lambda current : current )
+	hinter.read ( )
+	hinter.prepare ( )
+	assert hinter.read ( ) == 5e-6
+	assert reader.reads == 3
+	assert dev._res.writes[-1] .endswith ( u"RANGE:AUTO ON" )
+	# The overflow is not used for the next prediction
+	assert hinter.predict ( ) == pytest.approx ( 2 * 5e-6 - 1e-9 )
+
+def test_invalid_reading ( ) :
+	dev = meter ( )
+	reader = Reader ( None )
+	hinter = RangeHinter ( dev, reader.read, lambda current : current )
+	assert hinter.read ( ) is None
+	assert hinter.predict ( ) is None
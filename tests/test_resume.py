@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import
+import os
+import io
+import csv
+import sys
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+sys.path.insert ( 0, os.path.dirname ( os.path.dirname ( os.path.abspath ( __file__ ) ) ) )
+import output_sink
+import journal
+
+COLUMNS = [ u"keihv_srcvoltage", u"keihv_current" ]
+
+def rows ( start, stop ) :
+	return [ { u"keihv_srcvoltage": -float ( i ), u"keihv_current": 1e-9 * i } for i in range ( start, stop ) ]
+
+class ResumeTest ( unittest.TestCase ) :
+	# An interrupted run is resumed the way MeasurementThread._open_sink does
+	# it: the output is opened again and the journaled rows are written first.
+	def setUp ( self ) :
+		self.directory = tempfile.mkdtemp ( )
+		self.base = os.path.join ( self.directory, u"run" )
+
+	def tearDown ( self ) :
+		shutil.rmtree ( self.directory )
+
+	def _run ( self, output_format, rows_before, rows_after, journaled = None ) :
+		# Only the first journaled rows before the interruption made it to
+		# the journal, all of them if None
+		runjournal = journal.RunJournal ( journal.journal_path ( self.base ) )
+		runjournal.write ( { u"event": u"start", u"time": 0, u"output": self.base, u"args": { } } )
+		sink = output_sink.open_sink ( output_format, self.base, COLUMNS )
+		for i, row in enumerate ( rows_before ) :
+			sink.write ( row )
+			if journaled is not None and i >= journaled :
+				continue
+			runjournal.write ( journal.point_record ( row[u"keihv_srcvoltage"], row ) )
+		# Interrupted, the output is left as it is
+		sink.flush ( )
+		runjournal.close ( )
+
+		points = journal.load_journal ( journal.journal_path ( self.base ) ) [2]
+		sink = output_sink.open_sink ( output_format, self.base, COLUMNS )
+		for voltage, row in points :
+			sink.write ( row )
+		for row in rows_after :
+			sink.write ( row )
+		sink.close ( )
+		return sink.path
+
+	def _check_columns ( self, columns, expected ) :
+		for name in COLUMNS :
+			np.testing.assert_array_equal ( columns[name], [ row[name] for row in expected ] )
+
+	def test_csv ( self ) :
+		path = self._run ( u"csv", rows ( 0, 5 ), rows ( 5, 8 ) )
+		with io.open ( path, 'r' ) as f :
+			read = list ( csv.DictReader ( f ) )
+		self.assertEqual ( len ( read ), 8 )
+		self._check_columns ( dict ( ( name, [ float ( row[name] ) for row in read ] ) for name in COLUMNS ), rows ( 0, 8 ) )
+
+	def test_npz ( self ) :
+		path = self._run ( u"npz", rows ( 0, 5 ), rows ( 5, 8 ) )
+		self._check_columns ( output_sink.read_columnar ( path ) [0], rows ( 0, 8 ) )
+
+	def test_npz_stale_blocks ( self ) :
+		# Blocks written after the last journaled row are not kept
+		blockrows = output_sink.NpzSink.BLOCK_ROWS
+		path = self._run ( u"npz", rows ( 0, 2 * blockrows ), rows ( blockrows // 2, blockrows ), journaled = blockrows // 2 )
+		self._check_columns ( output_sink.read_columnar ( path ) [0], rows ( 0, blockrows ) )
+
+	@unittest.skipIf ( output_sink.h5py is None, u"h5py is not installed" )
+	def test_hdf5 ( self ) :
+		path = self._run ( u"hdf5", rows ( 0, 5 ), rows ( 5, 8 ) )
+		self._check_columns ( output_sink.read_columnar ( path ) [0], rows ( 0, 8 ) )
+
+if __name__ == u"__main__" :
+	unittest.main ( )
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import
+import os
+import sys
+import numpy as np
+
+sys.path.insert ( 0, os.path.dirname ( os.path.dirname ( os.path.abspath ( __file__ ) ) ) )
+from series_store import SeriesStore
+
+def test_growth ( ) :
+	store = SeriesStore ( [ u"x", u"y" ] )
+	count = 3 * SeriesStore.INITIAL_CAPACITY + 1
+	for i in range ( count ) :
+		store.append ( { u"x": i, u"y": 2 * i } )
+	assert len ( store ) == count
+	view = store.view ( )
+	np.testing.assert_array_equal ( view[u"x"], np.arange ( count ) )
+	np.testing.assert_array_equal ( view[u"y"], 2 * np.arange ( count ) )
+
+def test_maxlen_wraps ( ) :
+	store = SeriesStore ( [ u"x" ], maxlen = 10 )
+	for i in range ( 35 ) :
+		store.append ( { u"x": i } )
+	assert len ( store ) == 10
+	np.testing.assert_array_equal ( store.column ( u"x" ), np.arange ( 25, 35 ) )
+
+def test_views_stay_valid ( ) :
+	store = SeriesStore ( [ u"x" ], maxlen = 4 )
+	for i in range ( 4 ) :
+		store.append ( { u"x": i } )
+	view = store.column ( u"x" )
+	for i in range ( 4, 20 ) :
+		store.append ( { u"x": i } )
+	np.testing.assert_array_equal ( view, [ 0, 1, 2, 3 ] )
+	store.clear ( )
+	assert len ( store ) == 0
+	np.testing.assert_array_equal ( view, [ 0, 1, 2, 3 ] )
+
+def test_missing_values_and_dtypes ( ) :
+	store = SeriesStore ( [ u"x", u"n" ], dtypes = { u"n": np.int32 } )
+	store.append ( { u"x": 1.5, u"n": 3 } )
+	store.append ( { } )
+	view = store.view ( [ u"x", u"n", u"other" ] )
+	assert np.isnan ( view[u"x"][1] )
+	assert view[u"n"] .dtype == np.int32
+	np.testing.assert_array_equal ( view[u"n"], [ 3, 0 ] )
+	assert len ( view[u"other"] ) == 0
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import
+import os
+import sys
+import logging
+import pytest
+from collections import namedtuple
+
+sys.path.insert ( 0, os.path.dirname ( os.path.dirname ( os.path.abspath ( __file__ ) ) ) )
+pytest.importorskip ( u"visa" )
+pytest.importorskip ( u"PyQt5" )
+from keithley import OVERFLOW
+from measurement_window import MeasurementThread
+
+SettleArgs = namedtuple ( u"SettleArgs", [ u"settle", u"sleep", u"settle_abstol", u"settle_reltol" ] )
+
+class FakeThread ( object ) :
+	# Only what MeasurementThread._settle uses
+	SETTLE_INTERVAL = 0
+	_logger = logging.getLogger ( u"probestation.tests.FakeThread" )
+
+	def __init__ ( self, args ) :
+		self.args = args
+		self._exiting = False
+
+def settle ( values, sleep = 1.0, abstol = 1e-12, reltol = 0.0 ) :
+	# Returns the number of readings taken until settled
+	values = iter ( values )
+	taken = []
+	def read_value ( ) :
+		taken.append ( next ( values ) )
+		return taken[-1]
+	MeasurementThread._settle ( FakeThread ( SettleArgs ( True, sleep, abstol, reltol ) ), read_value )
+	return len ( taken )
+
+def test_settles_within_tolerance ( ) :
+	assert settle ( [ 1e-9, 5e-10, 1e-10, 1.005e-10, 0.0 ] ) == 4
+
+def test_relative_tolerance ( ) :
+	assert settle ( [ 1e-6, 1.2e-6, 1.205e-6, 0.0 ], abstol = 0.0, reltol = 0.01 ) == 3
+
+def test_overflow_is_not_settled ( ) :
+	assert settle ( [ OVERFLOW, OVERFLOW, 1e-9, 1e-9 ] ) == 4
+
+def test_none_is_skipped ( ) :
+	assert settle ( [ None, 1e-9, None, 1e-9, 1e-9 ] ) == 5
+
+def test_gives_up_after_wait_time ( ) :
+	assert settle ( [], sleep = 0.0 ) == 0
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import
+import os
+import sys
+import numpy as np
+
+sys.path.insert ( 0, os.path.dirname ( os.path.dirname ( os.path.abspath ( __file__ ) ) ) )
+from sweep_planner import AdaptiveSweepPlanner
+
+def sweep ( planner, value ) :
+	volts = []
+	for volt in planner :
+		volts.append ( volt )
+		planner.feed ( value ( volt ) )
+	return volts
+
+def test_noise_not_refined ( ) :
+	rng = np.random.RandomState ( 1 )
+	planner = AdaptiveSweepPlanner ( 0, -100, 5, 0.5, 0.3, 200 )
+	volts = sweep ( planner, lambda volt : 1e-9 + rng.normal ( 0, 1e-11 ) )
+	assert len ( volts ) == 21
+	assert volts[-1] == -100
+
+def test_kink_refined ( ) :
+	rng = np.random.RandomState ( 1 )
+	planner = AdaptiveSweepPlanner ( 0, -100, 5, 0.5, 0.3, 200 )
+	volts = sweep ( planner, lambda volt : 1e-9 + rng.normal ( 0, 1e-12 ) + max ( 0, abs ( volt ) - 60 ) * 1e-8 )
+	steps = np.abs ( np.diff ( volts ) )
+	assert len ( volts ) > 21
+	# The fine steps are right after the kink, the last step may be short
+	fine = [ volt for volt, step in zip ( volts[1:-1], steps ) if step < 5 ]
+	assert fine and all ( 60 < abs ( volt ) < 80 for volt in fine )
+	assert volts[-1] == -100
+
+def test_budget ( ) :
+	# Refining everywhere, the end is still reached within max_points
+	planner = AdaptiveSweepPlanner ( 0, 100, 5, 0.1, 0, 30 )
+	volts = sweep ( planner, lambda volt : volt ** 3 )
+	assert len ( volts ) <= 30
+	assert volts[-1] == 100
+	assert all ( b > a for a, b in zip ( volts, volts[1:] ) )
+
+def test_without_values ( ) :
+	# Voltages without a fed value keep the coarse step
+	planner = AdaptiveSweepPlanner ( 0, 10, 2, 1, 0.3, 100 )
+	assert list ( planner ) == [ 0, 2, 4, 6, 8, 10 ]
@@ -2,43 +2,205 @@
 
 import visa
 import logging
+import threading
+import numpy as np
+from contextlib import contextmanager
 
-class VisaProbestationDev ( object ) :
-	def __init__ ( self, resource_name, useserial, baud_rate = 19200, data_bits = 8 ) :
-		logger = logging.getLogger ( u'probestation.visa_probestation_dev.VisaProbestationDev' )
+class DeviceError ( IOError ) :
+	pass
+
+def _scpi_root ( cmd ) :
+	# Commands joined with ";" are relative to the previous header unless
+	# they start at the root
+	cmd = cmd.strip ( )
+	if cmd.startswith ( u":" ) or cmd.startswith ( u"*" ) :
+		return cmd
+	return u":" + cmd
+
+class SessionPool ( object ) :
+	# Owns the resource managers and keeps the instrument sessions open, so
+	# that devices and measurements opening the same resource share them.
+	def __init__ ( self ) :
+		self._logger = logging.getLogger ( u'probestation.visa_probestation_dev.SessionPool' )
+		self._lock = threading.RLock ( )
+		self._managers = { }
+		self._resources = { }
+		self._sessions = { }
+		self._idns = { }
+
+	def resource_manager ( self, backend = u"" ) :
+		with self._lock :
+			if not backend in self._managers :
+				self._managers[backend] = visa.ResourceManager ( backend )
+			return self._managers[backend]
+
+	def list_resources ( self, backend = u"", refresh = False ) :
+		with self._lock :
+			if refresh or not backend in self._resources :
+				self._resources[backend] = tuple ( self.resource_manager ( backend ) .list_resources ( ) )
+			return self._resources[backend]
+
+	def _find ( self, resource_name, useserial, refresh ) :
+		resources = ( )
 		try :
-			rm1 = visa.ResourceManager ( )
-			resources = rm1.list_resources ( )
+			resources = self.list_resources ( u"", refresh )
 		except :
-			logger.debug ( u"  Failed to open ni-visa" )
+			self._logger.debug ( u"  Failed to open ni-visa" )
 		try :
 			if useserial :
-				rm2 = visa.ResourceManager ( u'@py' )
-				resources += rm2.list_resources ( )
+				resources += self.list_resources ( u"@py", refresh )
 		except :
-			logger.debug ( u"  Failed to open py-visa" )
-		if not resource_name in resources :
+			self._logger.debug ( u"  Failed to open py-visa" )
+		return resource_name in resources
+
+	def open ( self, resource_name, useserial, baud_rate = 19200, data_bits = 8 ) :
+		with self._lock :
+			if resource_name in self._sessions :
+				self._logger.debug ( u"  Reusing open session to {}." .format ( resource_name ) )
+				return self._sessions[resource_name]
+			if not self._find ( resource_name, useserial, False ) and not self._find ( resource_name, useserial, True ) :
+				raise ValueError ( u"Resource not found {}" .format ( resource_name ) )
+			if resource_name.startswith ( u"ASRL" ) and useserial :
+				self._logger.debug ( u"  Opening {} with py-visa." .format ( resource_name ) )
+				res = self.resource_manager ( u"@py" ) .open_resource ( resource_name, baud_rate = baud_rate, data_bits = data_bits, timeout = 5000 )
+			else :
+				self._logger.debug ( u"  Opening {} with ni-visa." .format ( resource_name ) )
+				res = self.resource_manager ( ) .open_resource ( resource_name )
+			self._sessions[resource_name] = res
+			return res
+
+	def remember_idn ( self, resource_name, idn ) :
+		with self._lock :
+			self._idns[resource_name] = idn.strip ( )
+
+	def identify ( self, resource_name, useserial ) :
+		# Returns the identification known from discovery, or asks the
+		# device once
+		with self._lock :
+			if resource_name in self._idns :
+				return self._idns[resource_name]
+		idn = self.open ( resource_name, useserial ) .query ( u"*IDN?" )
+		self.remember_idn ( resource_name, idn )
+		return self._idns[resource_name]
+
+	def close ( self, resource_name ) :
+		with self._lock :
+			res = self._sessions.pop ( resource_name, None )
+			self._idns.pop ( resource_name, None )
+		if res is not None :
+			res.close ( )
+
+	def close_all ( self ) :
+		with self._lock :
+			sessions = list ( self._sessions )
+		for resource_name in sessions :
+			try :
+				self.close ( resource_name )
+			except Exception as e :
+				self._logger.debug ( u"  Failed to close {}: {}" .format ( resource_name, e ) )
+
+session_pool = SessionPool ( )
+
+class VisaProbestationDev ( object ) :
+	def __init__ ( self, resource_name, useserial, baud_rate = 19200, data_bits = 8, idn = None ) :
+		try :
+			self._res = session_pool.open ( resource_name, useserial, baud_rate, data_bits )
+		except ValueError :
 			self._connected = False
-			raise ValueError ( u"Resource not found {}" .format ( resource_name ) )
-		if resource_name.startswith ( u"ASRL" ) and useserial :
-			logger.debug ( u"  Opening {} with py-visa." .format ( resource_name ) )
-			self._res = rm2.open_resource ( resource_name, baud_rate = baud_rate, data_bits = data_bits, timeout = 5000 )
-		else :
-			logger.debug ( u"  Opening {} with ni-visa." .format ( resource_name ) )
-			self._res = rm1.open_resource ( resource_name )
+			raise
 		self._connected = True
+		self._binary = False
+		self._resource_name = resource_name
+		self._batch = None
+		self._batch_written = False
+		self._idn = idn
+		# Last command sent per setting, to skip resending unchanged ones
+		self._settings = {}
+
+	def identify ( self ) :
+		if self._idn is None :
+			self._idn = self._query ( u"*IDN?" ) .strip ( )
+		return self._idn
+
+	def _write_setting ( self, key, cmd ) :
+		if self._settings.get ( key ) == cmd :
+			return
+		self._write ( cmd )
+		self._settings[key] = cmd
+
+	def get_settings ( self ) :
+		return dict ( self._settings )
+
+	def invalidate_settings ( self ) :
+		# Forgets the settings sent so far, they are all sent again
+		self._settings.clear ( )
+
+	def reset ( self ) :
+		self._write ( u"*RST; *CLS" )
+		self.invalidate_settings ( )
+
+	@contextmanager
+	def batch ( self ) :
+		# Collects the writes into one ";" separated message, which is sent
+		# together with the next query or at the end of the batch. The error
+		# queue is checked once at the end, if anything was written.
+		if self._batch is not None :
+			yield
+			return
+		self._batch = []
+		self._batch_written = False
+		try :
+			yield
+			if not self._batch_written :
+				return
+			error = self._res.query ( self._pending ( u":SYSTEM:ERROR?" ) ) .strip ( )
+		except :
+			# Unknown which of the writes made it to the device
+			self.invalidate_settings ( )
+			raise
+		finally :
+			self._batch = None
+		if int ( error.split ( u"," ) [0] ) != 0 :
+			self.invalidate_settings ( )
+			raise DeviceError ( u"{} reported error {}" .format ( self._resource_name, error ) )
+
+	def _pending ( self, cmd ) :
+		# Prepends the writes collected in the current batch to cmd
+		if not self._batch :
+			return cmd
+		cmd = u";" .join ( self._batch + [ _scpi_root ( cmd ) ] )
+		del self._batch[:]
+		return cmd
 
 	def _write ( self, cmd ) :
+		if self._batch is not None :
+			self._batch.append ( _scpi_root ( cmd ) )
+			self._batch_written = True
+			return
 		self._res.write ( cmd )
 
 	def _query ( self, cmd ) :
-		return self._res.query ( cmd )
+		return self._res.query ( self._pending ( cmd ) )
         
 	def _query_ascii_values ( self, cmd ) :
-		return self._res.query_ascii_values ( cmd )
+		return self._res.query_ascii_values ( self._pending ( cmd ) )
+
+	def _query_binary_values ( self, cmd, datatype = u"f", is_big_endian = True ) :
+		return self._res.query_binary_values ( self._pending ( cmd ), datatype = datatype, is_big_endian = is_big_endian, container = np.array )
+
+	def is_binary_transfer ( self ) :
+		return self._binary
         
 	def _read ( self ) :
 		return self._res.read ( )
 
+	def _get_timeout ( self ) :
+		return self._res.timeout
+
+	def _set_timeout ( self, timeout ) :
+		self._res.timeout = timeout
+
 	def close ( self ) :
-		self._res.close()
+		# The session stays open in the pool for the next device object,
+		# use session_pool.close to really close it
+		self._connected = False